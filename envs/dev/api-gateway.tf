@@ -13,11 +13,23 @@ resource "aws_apigatewayv2_integration" "websocket_lambda" {
   integration_uri  = module.lambdas["notifications"].function_invoke_arn
 }
 
+# WebSocket $connect authorizer: verifies the Cognito access token sent as
+# ?token= and passes its sub to the connection. No identity source, so
+# connections without a token still reach the Lambda and stay anonymous
+resource "aws_apigatewayv2_authorizer" "websocket_connect" {
+  api_id          = aws_apigatewayv2_api.websocket_api.id
+  name            = "${local.base_name}-websocket-authorizer"
+  authorizer_type = "REQUEST"
+  authorizer_uri  = module.lambdas["notifications"].function_invoke_arn
+}
+
 # WebSocket Routes
 resource "aws_apigatewayv2_route" "connect" {
-  api_id    = aws_apigatewayv2_api.websocket_api.id
-  route_key = "$connect"
-  target    = "integrations/${aws_apigatewayv2_integration.websocket_lambda.id}"
+  api_id             = aws_apigatewayv2_api.websocket_api.id
+  route_key          = "$connect"
+  target             = "integrations/${aws_apigatewayv2_integration.websocket_lambda.id}"
+  authorization_type = "CUSTOM"
+  authorizer_id      = aws_apigatewayv2_authorizer.websocket_connect.id
 }
 
 resource "aws_apigatewayv2_route" "disconnect" {
@@ -50,7 +62,7 @@ resource "aws_apigatewayv2_deployment" "websocket_deployment" {
   ]
 }
 
-# Lambda Permission for WebSocket API
+# Lambda Permission for WebSocket API (routes and the $connect authorizer)
 resource "aws_lambda_permission" "websocket_lambda_permission" {
   statement_id  = "AllowExecutionFromWebSocketAPI"
   action        = "lambda:InvokeFunction"
@@ -90,6 +102,17 @@ resource "aws_api_gateway_resource" "packages" {
   path_part   = "packages"
 }
 
+# Packages/batch resource for bulk package creation
+resource "aws_api_gateway_resource" "packages_batch" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.packages.id
+  path_part   = "batch"
+}
+
 # Tracks resource
 resource "aws_api_gateway_resource" "tracks" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -101,6 +124,39 @@ resource "aws_api_gateway_resource" "tracks" {
   path_part   = "tracks"
 }
 
+# Tracks/batch resource for bulk depot scan ingestion
+resource "aws_api_gateway_resource" "tracks_batch" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.tracks.id
+  path_part   = "batch"
+}
+
+# Tracks/batches resource for queued scan ingestion
+resource "aws_api_gateway_resource" "tracks_batches" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.tracks.id
+  path_part   = "batches"
+}
+
+# Tracks/batches/{batch_id} resource for queued batch progress
+resource "aws_api_gateway_resource" "tracks_batches_id" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.tracks_batches.id
+  path_part   = "{batch_id}"
+}
+
 # Packages/{code} resource for individual package operations
 resource "aws_api_gateway_resource" "packages_code" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -123,6 +179,28 @@ resource "aws_api_gateway_resource" "packages_code_images" {
   path_part   = "images"
 }
 
+# Packages/{code}/images/uploads resource for multipart upload sessions
+resource "aws_api_gateway_resource" "packages_code_images_uploads" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.packages_code_images.id
+  path_part   = "uploads"
+}
+
+# Packages/{code}/images/uploads/{image_id} resource for one upload session
+resource "aws_api_gateway_resource" "packages_code_images_uploads_id" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  
+  lifecycle {
+    create_before_destroy = true
+  }
+  parent_id   = aws_api_gateway_resource.packages_code_images_uploads.id
+  path_part   = "{image_id}"
+}
+
 # Packages/{code}/tracks resource for package tracks
 resource "aws_api_gateway_resource" "packages_code_tracks" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -238,6 +316,25 @@ resource "aws_api_gateway_integration" "get_packages_lambda" {
   uri                     = module.lambdas["packages"].function_invoke_arn
 }
 
+# POST /packages/batch
+resource "aws_api_gateway_method" "post_packages_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_batch.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "post_packages_batch_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_batch.id
+  http_method = aws_api_gateway_method.post_packages_batch.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["packages"].function_invoke_arn
+}
+
 # GET /packages/{code}
 resource "aws_api_gateway_method" "get_packages_code" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -304,6 +401,101 @@ resource "aws_api_gateway_integration" "post_packages_code_images_lambda" {
   }
 }
 
+# POST /packages/{code}/images/uploads (start a multipart upload session)
+resource "aws_api_gateway_method" "post_packages_code_images_uploads" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "post_packages_code_images_uploads_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method = aws_api_gateway_method.post_packages_code_images_uploads.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["images"].function_invoke_arn
+}
+
+# GET /packages/{code}/images/uploads/{image_id} (session state and part URLs)
+resource "aws_api_gateway_method" "get_packages_code_images_uploads_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "get_packages_code_images_uploads_id_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.get_packages_code_images_uploads_id.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["images"].function_invoke_arn
+}
+
+# PUT /packages/{code}/images/uploads/{image_id} (record part ETags)
+resource "aws_api_gateway_method" "put_packages_code_images_uploads_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method   = "PUT"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "put_packages_code_images_uploads_id_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.put_packages_code_images_uploads_id.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["images"].function_invoke_arn
+}
+
+# POST /packages/{code}/images/uploads/{image_id} (complete the upload)
+resource "aws_api_gateway_method" "post_packages_code_images_uploads_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "post_packages_code_images_uploads_id_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.post_packages_code_images_uploads_id.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["images"].function_invoke_arn
+}
+
+# DELETE /packages/{code}/images/uploads/{image_id} (abort the upload)
+resource "aws_api_gateway_method" "delete_packages_code_images_uploads_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method   = "DELETE"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "delete_packages_code_images_uploads_id_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.delete_packages_code_images_uploads_id.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["images"].function_invoke_arn
+}
+
 # GET /packages/{code}/tracks
 resource "aws_api_gateway_method" "get_packages_code_tracks" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -359,6 +551,63 @@ resource "aws_api_gateway_integration" "post_packages_code_tracks_lambda" {
   uri                     = module.lambdas["tracks"].function_invoke_arn
 }
 
+# POST /tracks/batch
+resource "aws_api_gateway_method" "post_tracks_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batch.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "post_tracks_batch_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batch.id
+  http_method = aws_api_gateway_method.post_tracks_batch.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["tracks"].function_invoke_arn
+}
+
+# POST /tracks/batches
+resource "aws_api_gateway_method" "post_tracks_batches" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batches.id
+  http_method   = "POST"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "post_tracks_batches_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches.id
+  http_method = aws_api_gateway_method.post_tracks_batches.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["tracks"].function_invoke_arn
+}
+
+# GET /tracks/batches/{batch_id}
+resource "aws_api_gateway_method" "get_tracks_batches_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batches_id.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS" # Protected endpoint
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "get_tracks_batches_id_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches_id.id
+  http_method = aws_api_gateway_method.get_tracks_batches_id.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY" # proxies to lambda
+  uri                     = module.lambdas["tracks"].function_invoke_arn
+}
+
 # POST /addresses
 resource "aws_api_gateway_method" "post_addresses" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -477,12 +726,21 @@ resource "aws_api_gateway_deployment" "api_deploy" {
   depends_on = [
     aws_api_gateway_integration.post_packages_lambda,
     aws_api_gateway_integration.get_packages_lambda,
+    aws_api_gateway_integration.post_packages_batch_lambda,
     aws_api_gateway_integration.get_packages_code_lambda,
     aws_api_gateway_integration.get_packages_code_images_lambda,
     aws_api_gateway_integration.post_packages_code_images_lambda,
+    aws_api_gateway_integration.post_packages_code_images_uploads_lambda,
+    aws_api_gateway_integration.get_packages_code_images_uploads_id_lambda,
+    aws_api_gateway_integration.put_packages_code_images_uploads_id_lambda,
+    aws_api_gateway_integration.post_packages_code_images_uploads_id_lambda,
+    aws_api_gateway_integration.delete_packages_code_images_uploads_id_lambda,
     aws_api_gateway_integration.get_packages_code_tracks_lambda,
     aws_api_gateway_integration.get_packages_code_tracks_latest_lambda,
     aws_api_gateway_integration.post_packages_code_tracks_lambda,
+    aws_api_gateway_integration.post_tracks_batch_lambda,
+    aws_api_gateway_integration.post_tracks_batches_lambda,
+    aws_api_gateway_integration.get_tracks_batches_id_lambda,
     aws_api_gateway_integration.post_addresses_lambda,
     aws_api_gateway_integration.get_addresses_lambda,
     aws_api_gateway_integration.get_addresses_id_lambda,
@@ -490,15 +748,21 @@ resource "aws_api_gateway_deployment" "api_deploy" {
     aws_api_gateway_integration.get_depots_id_lambda,
     aws_api_gateway_integration.post_change_role_lambda,
     aws_api_gateway_integration.options_packages_mock,
+    aws_api_gateway_integration.options_packages_batch_mock,
     aws_api_gateway_integration.options_packages_code_mock,
     aws_api_gateway_integration.options_addresses_mock,
     aws_api_gateway_integration.options_addresses_id_mock,
     aws_api_gateway_integration.options_depots_mock,
     aws_api_gateway_integration.options_depots_id_mock,
     aws_api_gateway_integration.options_tracks_mock,
+    aws_api_gateway_integration.options_tracks_batch_mock,
+    aws_api_gateway_integration.options_tracks_batches_mock,
+    aws_api_gateway_integration.options_tracks_batches_id_mock,
     aws_api_gateway_integration.options_packages_code_tracks_mock,
     aws_api_gateway_integration.options_packages_code_tracks_latest_mock,
     aws_api_gateway_integration.options_packages_code_images_mock,
+    aws_api_gateway_integration.options_packages_code_images_uploads_mock,
+    aws_api_gateway_integration.options_packages_code_images_uploads_id_mock,
     aws_api_gateway_integration.options_change_role_mock
   ]
 
@@ -510,12 +774,21 @@ resource "aws_api_gateway_deployment" "api_deploy" {
       aws_api_gateway_method.post_packages.authorization,
       aws_api_gateway_integration.post_packages_lambda.uri,
       aws_api_gateway_integration.get_packages_lambda.uri,
+      aws_api_gateway_integration.post_packages_batch_lambda.uri,
       aws_api_gateway_integration.get_packages_code_lambda.uri,
       aws_api_gateway_integration.get_packages_code_images_lambda.uri,
       aws_api_gateway_integration.post_packages_code_images_lambda.uri,
+      aws_api_gateway_integration.post_packages_code_images_uploads_lambda.uri,
+      aws_api_gateway_integration.get_packages_code_images_uploads_id_lambda.uri,
+      aws_api_gateway_integration.put_packages_code_images_uploads_id_lambda.uri,
+      aws_api_gateway_integration.post_packages_code_images_uploads_id_lambda.uri,
+      aws_api_gateway_integration.delete_packages_code_images_uploads_id_lambda.uri,
       aws_api_gateway_integration.get_packages_code_tracks_lambda.uri,
       aws_api_gateway_integration.get_packages_code_tracks_latest_lambda.uri,
       aws_api_gateway_integration.post_packages_code_tracks_lambda.uri,
+      aws_api_gateway_integration.post_tracks_batch_lambda.uri,
+      aws_api_gateway_integration.post_tracks_batches_lambda.uri,
+      aws_api_gateway_integration.get_tracks_batches_id_lambda.uri,
       aws_api_gateway_integration.post_addresses_lambda.uri,
       aws_api_gateway_integration.get_addresses_lambda.uri,
       aws_api_gateway_integration.get_addresses_id_lambda.uri,
@@ -523,26 +796,40 @@ resource "aws_api_gateway_deployment" "api_deploy" {
       aws_api_gateway_integration.get_depots_id_lambda.uri,
       aws_api_gateway_integration.post_change_role_lambda.uri,
       aws_api_gateway_method.options_packages.http_method,
+      aws_api_gateway_method.options_packages_batch.http_method,
       aws_api_gateway_method.options_packages_code.http_method,
       aws_api_gateway_method.options_addresses.http_method,
       aws_api_gateway_method.options_addresses_id.http_method,
       aws_api_gateway_method.options_depots.http_method,
       aws_api_gateway_method.options_depots_id.http_method,
       aws_api_gateway_method.options_tracks.http_method,
+      aws_api_gateway_method.options_tracks_batch.http_method,
+      aws_api_gateway_method.options_tracks_batches.http_method,
+      aws_api_gateway_method.options_tracks_batches_id.http_method,
       aws_api_gateway_method.options_packages_code_tracks.http_method,
       aws_api_gateway_method.options_packages_code_tracks_latest.http_method,
       aws_api_gateway_method.options_packages_code_images.http_method,
+      aws_api_gateway_method.options_packages_code_images_uploads.http_method,
+      aws_api_gateway_method.options_packages_code_images_uploads_id.http_method,
       aws_api_gateway_integration.options_packages_mock.type,
+      aws_api_gateway_integration.options_packages_batch_mock.type,
       aws_api_gateway_integration.options_packages_code_mock.type,
       aws_api_gateway_integration.options_addresses_mock.type,
       aws_api_gateway_integration.options_addresses_id_mock.type,
       aws_api_gateway_integration.options_depots_mock.type,
       aws_api_gateway_integration.options_depots_id_mock.type,
       aws_api_gateway_integration.options_tracks_mock.type,
+      aws_api_gateway_integration.options_tracks_batch_mock.type,
+      aws_api_gateway_integration.options_tracks_batches_mock.type,
+      aws_api_gateway_integration.options_tracks_batches_id_mock.type,
       aws_api_gateway_integration.options_packages_code_tracks_mock.type,
       aws_api_gateway_integration.options_packages_code_tracks_latest_mock.type,
       aws_api_gateway_integration.options_packages_code_images_mock.type,
-      aws_api_gateway_integration.options_change_role_mock.type
+      aws_api_gateway_integration.options_packages_code_images_uploads_mock.type,
+      aws_api_gateway_integration.options_packages_code_images_uploads_id_mock.type,
+      aws_api_gateway_integration.options_change_role_mock.type,
+      aws_api_gateway_integration_response.options_packages_200_response.response_parameters,
+      aws_api_gateway_integration_response.options_packages_code_tracks_200_response.response_parameters
     ]))
   }
 }
@@ -603,12 +890,216 @@ resource "aws_api_gateway_integration_response" "options_packages_200_response"
   response_parameters = {
     "method.response.header.Access-Control-Allow-Origin"  = "'*'",
     "method.response.header.Access-Control-Allow-Methods" = "'GET, POST, OPTIONS'",
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token, Idempotency-Key'"
   }
 
   depends_on = [aws_api_gateway_integration.options_packages_mock]
 }
 
+# OPTIONS /packages/batch
+resource "aws_api_gateway_method" "options_packages_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_batch.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_packages_batch_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_batch.id
+  http_method = aws_api_gateway_method.options_packages_batch.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_packages_batch_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_batch.id
+  http_method = aws_api_gateway_method.options_packages_batch.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_packages_batch_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_batch.id
+  http_method = aws_api_gateway_method.options_packages_batch.http_method
+  status_code = aws_api_gateway_method_response.options_packages_batch_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'POST, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_packages_batch_mock]
+}
+
+# OPTIONS /tracks/batch
+resource "aws_api_gateway_method" "options_tracks_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batch.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_tracks_batch_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batch.id
+  http_method = aws_api_gateway_method.options_tracks_batch.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_tracks_batch_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batch.id
+  http_method = aws_api_gateway_method.options_tracks_batch.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_tracks_batch_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batch.id
+  http_method = aws_api_gateway_method.options_tracks_batch.http_method
+  status_code = aws_api_gateway_method_response.options_tracks_batch_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'POST, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_tracks_batch_mock]
+}
+
+# OPTIONS /tracks/batches
+resource "aws_api_gateway_method" "options_tracks_batches" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batches.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_tracks_batches_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches.id
+  http_method = aws_api_gateway_method.options_tracks_batches.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_tracks_batches_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches.id
+  http_method = aws_api_gateway_method.options_tracks_batches.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_tracks_batches_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches.id
+  http_method = aws_api_gateway_method.options_tracks_batches.http_method
+  status_code = aws_api_gateway_method_response.options_tracks_batches_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'POST, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_tracks_batches_mock]
+}
+
+# OPTIONS /tracks/batches/{batch_id}
+resource "aws_api_gateway_method" "options_tracks_batches_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.tracks_batches_id.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_tracks_batches_id_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches_id.id
+  http_method = aws_api_gateway_method.options_tracks_batches_id.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_tracks_batches_id_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches_id.id
+  http_method = aws_api_gateway_method.options_tracks_batches_id.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_tracks_batches_id_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.tracks_batches_id.id
+  http_method = aws_api_gateway_method.options_tracks_batches_id.http_method
+  status_code = aws_api_gateway_method_response.options_tracks_batches_id_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'GET, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_tracks_batches_id_mock]
+}
+
 # OPTIONS /change-role (CORS)
 resource "aws_api_gateway_method" "options_change_role" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -1012,7 +1503,7 @@ resource "aws_api_gateway_integration_response" "options_packages_code_tracks_20
   response_parameters = {
     "method.response.header.Access-Control-Allow-Origin"  = "'*'",
     "method.response.header.Access-Control-Allow-Methods" = "'GET, POST, OPTIONS'",
-    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token, Idempotency-Key'"
   }
 
   depends_on = [aws_api_gateway_integration.options_packages_code_tracks_mock]
@@ -1120,6 +1611,108 @@ resource "aws_api_gateway_integration_response" "options_packages_code_images_20
   depends_on = [aws_api_gateway_integration.options_packages_code_images_mock]
 }
 
+# OPTIONS /packages/{code}/images/uploads
+resource "aws_api_gateway_method" "options_packages_code_images_uploads" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_packages_code_images_uploads_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_packages_code_images_uploads_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_packages_code_images_uploads_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads.http_method
+  status_code = aws_api_gateway_method_response.options_packages_code_images_uploads_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'POST, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_packages_code_images_uploads_mock]
+}
+
+# OPTIONS /packages/{code}/images/uploads/{image_id}
+resource "aws_api_gateway_method" "options_packages_code_images_uploads_id" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "options_packages_code_images_uploads_id_mock" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads_id.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
+resource "aws_api_gateway_method_response" "options_packages_code_images_uploads_id_200" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads_id.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "options_packages_code_images_uploads_id_200_response" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  resource_id = aws_api_gateway_resource.packages_code_images_uploads_id.id
+  http_method = aws_api_gateway_method.options_packages_code_images_uploads_id.http_method
+  status_code = aws_api_gateway_method_response.options_packages_code_images_uploads_id_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'",
+    "method.response.header.Access-Control-Allow-Methods" = "'GET, PUT, POST, DELETE, OPTIONS'",
+    "method.response.header.Access-Control-Allow-Headers" = "'Content-Type, Authorization, X-Amz-Date, X-Api-Key, X-Amz-Security-Token'"
+  }
+
+  depends_on = [aws_api_gateway_integration.options_packages_code_images_uploads_id_mock]
+}
+
 
 # ERROR responses---
 
@@ -151,12 +151,37 @@ module "dynamodb_packages" {
     }
   ]
 
+  # New packages are published to SNS from the stream (see events.tf)
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   encryption_enabled             = false
   point_in_time_recovery_enabled = false
 
   tags = merge(local.common_tags, { Name = "package-tracking-packages"})
 }
 
+# Package Codes Table
+# One item per issued package code (uniqueness guard) plus the COUNTER item
+# used to lease blocks of sequential codes
+module "dynamodb_package_codes" {
+  source = "../../modules/dynamodb"
+
+  table_name   = "package-tracking-package-codes"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "code"
+  range_key    = null
+
+  attributes = [
+    { name = "code", type = "S" }
+  ]
+
+  encryption_enabled             = false
+  point_in_time_recovery_enabled = false
+
+  tags = merge(local.common_tags, { Name = "package-tracking-package-codes" })
+}
+
 # Tracks Table
 module "dynamodb_tracks" {
   source = "../../modules/dynamodb"
@@ -168,7 +193,8 @@ module "dynamodb_tracks" {
 
   attributes = [
     { name = "track_id",   type = "S" },
-    { name = "package_id", type = "S" }
+    { name = "package_id", type = "S" },
+    { name = "timestamp",  type = "S" }
   ]
 
   global_secondary_indexes = [
@@ -176,6 +202,13 @@ module "dynamodb_tracks" {
       name            = "package-index"
       hash_key        = "package_id"
       projection_type = "ALL"
+    },
+    {
+      # Track history of a package in time order
+      name            = "package-timestamp-index"
+      hash_key        = "package_id"
+      range_key       = "timestamp"
+      projection_type = "ALL"
     }
   ]
 
@@ -186,6 +219,77 @@ module "dynamodb_tracks" {
 
 }
 
+# Scan Batches Table
+# Progress of queued scan batches (POST /tracks/batches), expired after a week
+module "dynamodb_scan_batches" {
+  source = "../../modules/dynamodb"
+
+  table_name   = "package-tracking-scan-batches"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "batch_id"
+  range_key    = null
+
+  attributes = [
+    { name = "batch_id", type = "S" }
+  ]
+
+  ttl_enabled        = true
+  ttl_attribute_name = "expires_at"
+
+  encryption_enabled             = false
+  point_in_time_recovery_enabled = false
+
+  tags = merge(local.common_tags, { Name = "package-tracking-scan-batches" })
+}
+
+# Idempotency Table
+# Stored responses of POST /packages and POST /packages/{code}/tracks per
+# Idempotency-Key, replayed to client retries for a day
+module "dynamodb_idempotency" {
+  source = "../../modules/dynamodb"
+
+  table_name   = "package-tracking-idempotency"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "idempotency_key"
+  range_key    = null
+
+  attributes = [
+    { name = "idempotency_key", type = "S" }
+  ]
+
+  ttl_enabled        = true
+  ttl_attribute_name = "expires_at"
+
+  encryption_enabled             = false
+  point_in_time_recovery_enabled = false
+
+  tags = merge(local.common_tags, { Name = "package-tracking-idempotency" })
+}
+
+# Processed Events Table
+# SNS event ids already handled by the notifications consumer, so
+# redelivered SQS messages are skipped; expired by TTL
+module "dynamodb_processed_events" {
+  source = "../../modules/dynamodb"
+
+  table_name   = "package-tracking-processed-events"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "event_id"
+  range_key    = null
+
+  attributes = [
+    { name = "event_id", type = "S" }
+  ]
+
+  ttl_enabled        = true
+  ttl_attribute_name = "expires_at"
+
+  encryption_enabled             = false
+  point_in_time_recovery_enabled = false
+
+  tags = merge(local.common_tags, { Name = "package-tracking-processed-events" })
+}
+
 # Package Images Table
 module "dynamodb_package_images" {
   source = "../../modules/dynamodb"
@@ -246,3 +350,27 @@ module "dynamodb_websocket_connections" {
   tags = merge(local.common_tags, { Name = "package-tracking-websocket-connections" })
 }
 
+# WebSocket Subscriptions Table
+# One row per (package, connection) so broadcasts query a package's subscribers
+# instead of scanning every connection. Rows share the connection's ttl.
+module "dynamodb_websocket_subscriptions" {
+  source = "../../modules/dynamodb"
+
+  table_name   = "package-tracking-websocket-subscriptions"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "package_code"
+  range_key    = "connection_id"
+
+  attributes = [
+    { name = "package_code",  type = "S" },
+    { name = "connection_id", type = "S" }
+  ]
+
+  ttl_enabled        = true
+  ttl_attribute_name = "ttl"
+
+  encryption_enabled             = false
+  point_in_time_recovery_enabled = false
+
+  tags = merge(local.common_tags, { Name = "package-tracking-websocket-subscriptions" })
+}
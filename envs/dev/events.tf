@@ -1,5 +1,5 @@
 # Events Configuration
-# Contains SNS topic, SQS queue, and related policies
+# Contains SNS topic, SQS queues, and related policies
 
 # --- events resources ---
 # SNS topic
@@ -8,24 +8,94 @@ resource "aws_sns_topic" "notifications" {
   tags = local.common_tags
 }
 
-# SQS queue
+# One SQS queue per event type, each fed by an SNS subscription whose filter
+# policy matches the event_type message attribute, so the notifications
+# Lambda only receives events it handles and batching is tuned per type.
+# Track updates are the bulk of the traffic and are coalesced per package,
+# so they get the largest batches; creations and images are pushed promptly.
+# The tracks queue is the original notifications queue (see the moved blocks
+# below). It keeps its name and also takes messages without an event_type
+# attribute, published before the envelope, which the consumer still reads.
+locals {
+  notification_queues = {
+    tracks = {
+      queue_name      = "notifications"
+      filter_policy   = jsonencode({ event_type = ["package_track_updated", { exists = false }] })
+      batch_size      = var.notifications_batch_size
+      batching_window = var.notifications_batching_window_seconds
+    }
+    packages = {
+      queue_name      = "packages-notifications"
+      filter_policy   = jsonencode({ event_type = ["package_created"] })
+      batch_size      = 25
+      batching_window = 1
+    }
+    images = {
+      queue_name      = "images-notifications"
+      filter_policy   = jsonencode({ event_type = ["image_uploaded"] })
+      batch_size      = 10
+      batching_window = 0
+    }
+  }
+}
+
+# SQS queues
+resource "aws_sqs_queue" "notifications_dlq" {
+  for_each = local.notification_queues
+
+  name                      = "${local.base_name}-${each.value.queue_name}-dlq"
+  message_retention_seconds = 1209600
+  tags                      = local.common_tags
+}
+
 resource "aws_sqs_queue" "notifications_queue" {
-  name = "${local.base_name}-notifications-queue"
+  for_each = local.notification_queues
+
+  name = "${local.base_name}-${each.value.queue_name}-queue"
+
+  # At least 6x the Lambda timeout, as AWS recommends for SQS event sources
+  visibility_timeout_seconds = 90
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.notifications_dlq[each.key].arn
+    maxReceiveCount     = 5
+  })
+
   tags = local.common_tags
 }
 
-# SNS -> SQS
+moved {
+  from = aws_sqs_queue.notifications_dlq
+  to   = aws_sqs_queue.notifications_dlq["tracks"]
+}
+
+moved {
+  from = aws_sqs_queue.notifications_queue
+  to   = aws_sqs_queue.notifications_queue["tracks"]
+}
+
+# SNS -> SQS, filtered on the event_type message attribute
 resource "aws_sns_topic_subscription" "sns_to_sqs" {
-  topic_arn = aws_sns_topic.notifications.arn
-  protocol  = "sqs"
-  endpoint  = aws_sqs_queue.notifications_queue.arn
+  for_each = local.notification_queues
+
+  topic_arn     = aws_sns_topic.notifications.arn
+  protocol      = "sqs"
+  endpoint      = aws_sqs_queue.notifications_queue[each.key].arn
+  filter_policy = each.value.filter_policy
+}
+
+moved {
+  from = aws_sns_topic_subscription.sns_to_sqs
+  to   = aws_sns_topic_subscription.sns_to_sqs["tracks"]
 }
 
 # QUEUE POLICY to allow SNS to send messages to SQS
 data "aws_iam_policy_document" "sqs_policy" {
+  for_each = local.notification_queues
+
   statement {
     actions   = ["sqs:SendMessage"]
-    resources = [aws_sqs_queue.notifications_queue.arn]
+    resources = [aws_sqs_queue.notifications_queue[each.key].arn]
     principals {
       type        = "Service"
       identifiers = ["sns.amazonaws.com"]
@@ -40,6 +110,103 @@ data "aws_iam_policy_document" "sqs_policy" {
 }
 
 resource "aws_sqs_queue_policy" "main" {
-  queue_url = aws_sqs_queue.notifications_queue.id
-  policy    = data.aws_iam_policy_document.sqs_policy.json
+  for_each = local.notification_queues
+
+  queue_url = aws_sqs_queue.notifications_queue[each.key].id
+  policy    = data.aws_iam_policy_document.sqs_policy[each.key].json
+}
+
+moved {
+  from = aws_sqs_queue_policy.main
+  to   = aws_sqs_queue_policy.main["tracks"]
+}
+
+# SQS -> notifications Lambda; failed records are retried alone
+resource "aws_lambda_event_source_mapping" "notifications_queue" {
+  for_each = local.notification_queues
+
+  event_source_arn                   = aws_sqs_queue.notifications_queue[each.key].arn
+  function_name                      = module.lambdas["notifications"].function_arn
+  batch_size                         = each.value.batch_size
+  maximum_batching_window_in_seconds = each.value.batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
+moved {
+  from = aws_lambda_event_source_mapping.notifications_queue
+  to   = aws_lambda_event_source_mapping.notifications_queue["tracks"]
+}
+
+# Packages table stream -> packages Lambda, which publishes package_created
+# events so package creation does not wait on SNS
+resource "aws_lambda_event_source_mapping" "packages_stream" {
+  event_source_arn        = module.dynamodb_packages.table_stream_arn
+  function_name           = module.lambdas["packages"].function_arn
+  starting_position       = "LATEST"
+  batch_size              = 100
+  maximum_retry_attempts  = 5
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Queued depot scans (POST /tracks/batches), applied by the tracks Lambda.
+# FIFO with one message group per package code, so the scans of a package
+# are applied in order even with several consumers
+resource "aws_sqs_queue" "scan_dlq" {
+  name                      = "${local.base_name}-scan-dlq.fifo"
+  fifo_queue                = true
+  message_retention_seconds = 1209600
+  tags                      = local.common_tags
+}
+
+resource "aws_sqs_queue" "scan_queue" {
+  name       = "${local.base_name}-scan-queue.fifo"
+  fifo_queue = true
+
+  # Deduplication ids are set per scan; high throughput mode, as ordering is only needed per package
+  deduplication_scope   = "messageGroup"
+  fifo_throughput_limit = "perMessageGroupId"
+
+  # At least 6x the Lambda timeout, as AWS recommends for SQS event sources
+  visibility_timeout_seconds = 90
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.scan_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = local.common_tags
+}
+
+resource "aws_lambda_event_source_mapping" "scan_queue" {
+  event_source_arn = aws_sqs_queue.scan_queue.arn
+  function_name    = module.lambdas["tracks"].function_arn
+  # FIFO event sources take at most 10 messages and no batching window
+  batch_size              = 10
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Bounded consumers drain peaks without piling onto DynamoDB throttling
+  scaling_config {
+    maximum_concurrency = 5
+  }
+}
+
+# Scheduled sweep of idle WebSocket connections by the notifications Lambda:
+# gone connections are found with GetConnection and deleted in bulk
+resource "aws_cloudwatch_event_rule" "websocket_sweep" {
+  name                = "${local.base_name}-websocket-sweep"
+  schedule_expression = "rate(15 minutes)"
+  tags                = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "websocket_sweep" {
+  rule = aws_cloudwatch_event_rule.websocket_sweep.name
+  arn  = module.lambdas["notifications"].function_arn
+}
+
+resource "aws_lambda_permission" "websocket_sweep" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = module.lambdas["notifications"].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.websocket_sweep.arn
 }
@@ -54,6 +54,7 @@ module "lambdas" {
   env = {
     SNS_TOPIC_ARN  = aws_sns_topic.notifications.arn,
     S3_BUCKET_NAME = module.images_bucket.bucket_id,
+    SCAN_QUEUE_URL = aws_sqs_queue.scan_queue.url,
     WEBSOCKET_API_ENDPOINT = "https://${aws_apigatewayv2_api.websocket_api.id}.execute-api.${data.aws_region.current.id}.amazonaws.com/${aws_apigatewayv2_stage.websocket_stage.name}"
   }
 
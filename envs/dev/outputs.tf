@@ -38,9 +38,14 @@ output "sns_topic_arn" {
   value       = aws_sns_topic.notifications.arn
 }
 
-output "sqs_queue_arn" {
-  description = "ARN of the SQS notifications queue"
-  value       = aws_sqs_queue.notifications_queue.arn
+output "sqs_queue_arns" {
+  description = "ARNs of the SQS notifications queues, by event group"
+  value       = { for name, queue in aws_sqs_queue.notifications_queue : name => queue.arn }
+}
+
+output "scan_queue_url" {
+  description = "URL of the SQS queue for queued depot scans"
+  value       = aws_sqs_queue.scan_queue.url
 }
 
 # Authentication outputs
@@ -91,6 +91,21 @@ resource "aws_s3_bucket_notification" "images_bucket_notification" {
     filter_suffix       = ".gif"
   }
 
+  # Videos from multipart upload sessions
+  lambda_function {
+    lambda_function_arn = module.lambdas["images"].function_arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "packages/"
+    filter_suffix       = ".mp4"
+  }
+
+  lambda_function {
+    lambda_function_arn = module.lambdas["images"].function_arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "packages/"
+    filter_suffix       = ".mov"
+  }
+
   depends_on = [module.lambdas]
 }
 
@@ -100,4 +100,17 @@ variable "dynamodb_deletion_protection" {
   description = "Enable deletion protection for DynamoDB table"
   type        = bool
   default     = false
-}
\ No newline at end of file
+}
+
+# Notifications consumer
+variable "notifications_batch_size" {
+  description = "Maximum track update messages per notifications Lambda invocation (above 10 needs a batching window)"
+  type        = number
+  default     = 100
+}
+
+variable "notifications_batching_window_seconds" {
+  description = "Seconds the track updates event source waits to fill a batch"
+  type        = number
+  default     = 5
+}
@@ -1,8 +1,10 @@
 import json
 import boto3
 import uuid
+import os
 from datetime import datetime
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
@@ -10,6 +12,10 @@ dynamodb = boto3.resource('dynamodb')
 # Table references
 addresses_table = dynamodb.Table('package-tracking-addresses')
 
+# Parallel scan used for the full address listing
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '8'))
+MAX_SCAN_WORKERS = 8
+
 def cors_response(status_code, body=None):
     """
     Create a CORS-enabled response
@@ -57,11 +63,43 @@ def lambda_handler(event, context):
         print(f"Error in address_handler: {str(e)}")
         return cors_response(500, {'error': 'Internal server error'})
 
+def parallel_scan(table, segments, total_segments, page_size=None, **scan_kwargs):
+    """
+    Scan the given segments concurrently on a bounded thread pool.
+    `segments` maps segment number -> ExclusiveStartKey (None = from the start).
+    Yields (segment, items, last_evaluated_key) as soon as each page arrives and
+    keeps following a segment until DynamoDB stops returning LastEvaluatedKey.
+    """
+    def read_page(segment, start_key):
+        kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        if page_size:
+            kwargs['Limit'] = page_size
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = table.scan(**kwargs)
+        return segment, response['Items'], response.get('LastEvaluatedKey')
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(segments), MAX_SCAN_WORKERS)))
+    try:
+        pending = {executor.submit(read_page, segment, start_key) for segment, start_key in segments.items()}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                segment, items, last_key = future.result()
+                if last_key:
+                    pending.add(executor.submit(read_page, segment, last_key))
+                yield segment, items, last_key
+    finally:
+        # Consumer may stop early: drop queued page reads
+        executor.shutdown(wait=False, cancel_futures=True)
+
 def get_addresses_list():
     """Get list of all addresses"""
     try:
-        response = addresses_table.scan()
-        addresses = response['Items']
+        addresses = []
+        segments = {segment: None for segment in range(SCAN_SEGMENTS)}
+        for _, items, _ in parallel_scan(addresses_table, segments, SCAN_SEGMENTS):
+            addresses.extend(items)
         
         return cors_response(200, addresses)
         
@@ -1,14 +1,25 @@
+import io
 import json
 import boto3
 import uuid
 import os
+import time
 import mimetypes
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import unquote_plus
 from botocore.exceptions import ClientError
 import base64
 from decimal import Decimal
-from email import message_from_string
-from email.message import EmailMessage
+from email.message import EmailMessage, Message
+from email.parser import BytesHeaderParser
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    # Uploads keep working without Pillow, images are then only served at full size
+    Image = None
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
@@ -19,6 +30,52 @@ sns = boto3.client('sns')
 package_images_table = dynamodb.Table('package-tracking-images')
 packages_table = dynamodb.Table('package-tracking-packages')
 
+# SNS event envelope, bumped on incompatible changes to an event's data
+EVENT_VERSION = 1
+
+# S3 notification batches
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+SNS_BATCH_SIZE = 10
+STATUS_UPDATE_WORKERS = 8
+VARIANTS_MIN_REMAINING_TIME_MS = 3000
+
+# Image types kept as uploaded; anything else is stored as JPEG like before
+IMAGE_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif'}
+
+# Multipart upload sessions for large photos and videos. Parts are
+# DEFAULT_PART_SIZE (S3 needs at least 5 MiB) and grow so an upload never needs
+# more than MAX_UPLOAD_PARTS, which keeps the recorded ETags well inside one item
+MEDIA_EXTENSIONS = {**IMAGE_EXTENSIONS, 'video/mp4': '.mp4', 'video/quicktime': '.mov'}
+MAX_UPLOAD_SIZE = 5 * 1024 ** 3
+DEFAULT_PART_SIZE = 8 * 1024 ** 2
+MAX_UPLOAD_PARTS = 1000
+PART_URL_BATCH_SIZE = 20
+MAX_PARTS_PER_REQUEST = 100
+PART_URL_EXPIRES_IN = 3600
+
+# Smaller renditions made on upload, longest side in pixels. They are written
+# under derived/ so the packages/ upload notification never fires for them
+IMAGE_VARIANTS = {'thumb': 320, 'medium': 1280}
+IMAGE_SIZES = ('thumb', 'medium', 'original')
+VARIANTS_PREFIX = 'derived'
+VARIANT_QUALITY = 80
+
+# Larger originals are listed without variants: the whole file and its decoded
+# pixels have to fit in the Lambda's memory next to each other
+MAX_VARIANT_SOURCE_BYTES = int(os.environ.get('MAX_VARIANT_SOURCE_BYTES', str(25 * 1024 ** 2)))
+MAX_VARIANT_SOURCE_PIXELS = int(os.environ.get('MAX_VARIANT_SOURCE_PIXELS', '16000000'))
+
+# Presigned GET URLs are reused by this container while more than
+# PRESIGNED_URL_REUSE_FRACTION of their lifetime is left, so repeated listings
+# return identical URLs that browsers and CDNs can cache
+PRESIGNED_URL_EXPIRES_IN = int(os.environ.get('PRESIGNED_URL_EXPIRES_IN', '3600'))
+PRESIGNED_URL_REUSE_FRACTION = float(os.environ.get('PRESIGNED_URL_REUSE_FRACTION', '0.5'))
+PRESIGNED_URL_CACHE_SIZE = int(os.environ.get('PRESIGNED_URL_CACHE_SIZE', '5000'))
+
+# (operation, s3_key) -> (url, expires_at), least recently used first
+presigned_url_cache = OrderedDict()
+
 def convert_decimals_to_float(obj):
     """Convert Decimal objects to float for JSON serialization"""
     if isinstance(obj, Decimal):
@@ -30,6 +87,150 @@ def convert_decimals_to_float(obj):
     else:
         return obj
 
+def build_event(event_type, event_id, data):
+    """Versioned SNS event envelope, the same in every producer"""
+    return {
+        'event_id': event_id,
+        'event_type': event_type,
+        'event_version': EVENT_VERSION,
+        'occurred_at': datetime.utcnow().isoformat(),
+        'data': data
+    }
+
+def event_attributes(event):
+    """SNS message attributes of an event, matched by the queue subscription filter policies"""
+    return {
+        'event_type': {'DataType': 'String', 'StringValue': event['event_type']},
+        'event_version': {'DataType': 'Number', 'StringValue': str(event['event_version'])}
+    }
+
+def batch_get_items(table, keys):
+    """
+    Read items by primary key with BatchGetItem, BATCH_GET_SIZE keys per call,
+    retrying UnprocessedKeys with exponential backoff. Missing items are omitted.
+    """
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {table.name: {'Keys': keys[start:start + BATCH_GET_SIZE]}}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(table.name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+        else:
+            raise Exception(f"Unprocessed keys reading {table.name}")
+    return items
+
+def publish_batch(messages, subject):
+    """
+    Publish (entry_id, event) pairs with SNS PublishBatch, 10 per call.
+    Returns the ids of the entries that were not published.
+    """
+    failed_ids = []
+    for start in range(0, len(messages), SNS_BATCH_SIZE):
+        chunk = messages[start:start + SNS_BATCH_SIZE]
+        try:
+            response = sns.publish_batch(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                PublishBatchRequestEntries=[
+                    {
+                        'Id': entry_id,
+                        'Message': json.dumps(event),
+                        'Subject': subject,
+                        'MessageAttributes': event_attributes(event)
+                    }
+                    for entry_id, event in chunk
+                ]
+            )
+            failed_ids.extend(entry['Id'] for entry in response.get('Failed', []))
+        except Exception as e:
+            print(f"Error publishing SNS batch: {str(e)}")
+            failed_ids.extend(entry_id for entry_id, _ in chunk)
+    return failed_ids
+
+class MemoryviewReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview, so S3 reads an upload in chunks without a copy of it"""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self.view) - self.position))
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+def multipart_boundary(content_type):
+    """Boundary of a multipart Content-Type header, as bytes"""
+    header = Message()
+    header['Content-Type'] = content_type
+    boundary = header.get_param('boundary')
+    if not boundary:
+        raise ValueError('Multipart boundary missing from Content-Type')
+    return boundary.encode('latin-1')
+
+def parse_multipart(body, content_type):
+    """
+    Parse a multipart/form-data body given as bytes. Only the small part headers
+    are decoded; part contents are memoryview slices of body, never copied.
+    Returns (fields, files): field name -> str value, and
+    file field name -> (filename, content type, memoryview) for non-empty files.
+    """
+    delimiter = b'--' + multipart_boundary(content_type)
+    view = memoryview(body)
+    fields = {}
+    files = {}
+    
+    position = body.find(delimiter)
+    if position < 0:
+        raise ValueError('Multipart boundary not found in body')
+    while True:
+        position += len(delimiter)
+        # The closing delimiter ends with "--"
+        if body[position:position + 2] == b'--':
+            return fields, files
+        
+        headers_end = body.find(b'\r\n\r\n', position)
+        if headers_end < 0:
+            raise ValueError('Malformed multipart part headers')
+        next_delimiter = body.find(b'\r\n' + delimiter, headers_end + 4)
+        if next_delimiter < 0:
+            raise ValueError('Unterminated multipart part')
+        
+        headers = BytesHeaderParser().parsebytes(view[position:headers_end + 4].tobytes().lstrip())
+        name = headers.get_param('name', header='content-disposition')
+        filename = headers.get_param('filename', header='content-disposition')
+        content = view[headers_end + 4:next_delimiter]
+        
+        if filename is not None:
+            # An empty file input still sends a part, with filename="" and no content
+            if filename and len(content):
+                files[name] = (filename, headers.get_content_type(), content)
+        elif name:
+            fields[name] = content.tobytes().decode('utf-8')
+        position = next_delimiter + 2
+
 def cors_response(status_code, body=None):
     """
     Create a CORS-enabled response
@@ -55,17 +256,22 @@ def lambda_handler(event, context):
     Routes: 
     - GET /packages/{code}/images/ - Request pre-signed URL for upload
     - POST /packages/{code}/images/ - Upload via multipart (legacy)
-    - GET /packages/{code}/images/ - Get existing images (if query param present)
+    - GET /packages/{code}/images/?size=thumb|medium|original - Get existing images
+    - POST /packages/{code}/images/uploads - Start a multipart upload session
+    - GET /packages/{code}/images/uploads/{image_id} - Session state and part URLs
+    - PUT /packages/{code}/images/uploads/{image_id} - Record uploaded part ETags
+    - POST /packages/{code}/images/uploads/{image_id} - Complete the upload
+    - DELETE /packages/{code}/images/uploads/{image_id} - Abort the upload
     - S3 Event - Handle upload completion
     """
     
+    # S3 invokes asynchronously and ignores the response, so S3 events raise
+    # to be retried rather than returning a 500
+    if 'Records' in event and event['Records']:
+        if event['Records'][0].get('eventSource') == 'aws:s3':
+            return handle_s3_records(event['Records'], context)
+    
     try:
-        # Check if this is an S3 event
-        if 'Records' in event and event['Records']:
-            record = event['Records'][0]
-            if record.get('eventSource') == 'aws:s3':
-                return handle_s3_event(record)
-        
         # Extract user information from Cognito JWT
         user_id = event['requestContext']['authorizer']['claims']['sub']
         user_email = event['requestContext']['authorizer']['claims']['email']
@@ -81,13 +287,29 @@ def lambda_handler(event, context):
         if not package_code:
             return cors_response(400, {'error': 'Package code is required'})
         
+        # Multipart upload sessions
+        path = event.get('path', '').rstrip('/')
+        image_id = (path_parameters or {}).get('image_id')
+        if image_id:
+            if http_method == 'GET':
+                return get_upload_session(package_code, image_id, user_id, user_role, query_parameters)
+            elif http_method == 'PUT':
+                return record_upload_parts(package_code, image_id, event.get('body'), user_id, user_role)
+            elif http_method == 'POST':
+                return complete_upload_session(package_code, image_id, event.get('body'), user_id, user_role)
+            elif http_method == 'DELETE':
+                return abort_upload_session(package_code, image_id, user_id, user_role)
+            return cors_response(405, {'error': 'Method not allowed'})
+        if http_method == 'POST' and path.endswith('/images/uploads'):
+            return create_upload_session(package_code, event.get('body'), user_id, user_role)
+        
         # Route to appropriate handler
         if http_method == 'GET':
             # Check if requesting upload URL or getting existing images
             if query_parameters and query_parameters.get('action') == 'upload':
                 return get_upload_url(package_code, user_id, user_role, query_parameters)
             else:
-                return get_package_images(package_code, user_id, user_role)
+                return get_package_images(package_code, user_id, user_role, query_parameters)
         elif http_method == 'POST':
             return upload_image(package_code, event, user_id, user_role)
         else:
@@ -116,45 +338,32 @@ def upload_image(package_code, event, user_id, user_role):
         print(f"DEBUG: Body length: {len(body) if body else 0}")
         print(f"DEBUG: isBase64Encoded: {event.get('isBase64Encoded', False)}")
         
+        file_content = None
         if 'multipart/form-data' in content_type:
-            # Handle multipart form data using Python's email parser
             print("DEBUG: Processing multipart form data")
             
-            # Get the raw body
-            raw_body = event.get('body', '')
+            # Decode the body to bytes once; the file is then a slice of it,
+            # uploaded as is with no text decoding or base64 round trip
+            raw_body = event.get('body') or ''
             if event.get('isBase64Encoded', False):
-                raw_body = base64.b64decode(raw_body).decode('utf-8')
+                raw_body = base64.b64decode(raw_body)
+            else:
+                raw_body = raw_body.encode('utf-8')
             
             print(f"DEBUG: Raw body length: {len(raw_body)}")
             
-            # Create a proper multipart message
-            headers = f"Content-Type: {content_type}\r\n\r\n"
-            message_text = headers + raw_body
-            
-            # Parse using email library
-            msg = message_from_string(message_text)
-            
-            purpose = 'CREATION'
-            file_data = None
-            
-            # Extract form fields
-            for part in msg.walk():
-                if part.get_content_disposition() == 'form-data':
-                    name = part.get_param('name', header='content-disposition')
-                    filename = part.get_param('filename', header='content-disposition')
-                    
-                    if name == 'purpose':
-                        purpose = part.get_payload(decode=True).decode('utf-8').strip()
-                        print(f"DEBUG: Extracted purpose: {purpose}")
-                    elif name == 'image' and filename:
-                        # This is the file
-                        file_data = part.get_payload(decode=True)
-                        print(f"DEBUG: Extracted file: {filename}, size: {len(file_data)} bytes")
-                        # Convert to base64 for processing
-                        file_data = base64.b64encode(file_data).decode('utf-8')
+            try:
+                fields, files = parse_multipart(raw_body, content_type)
+            except ValueError as e:
+                return cors_response(400, {'error': str(e)})
             
-            if not file_data:
+            purpose = fields.get('purpose', 'CREATION').strip()
+            if 'image' not in files:
                 return cors_response(400, {'error': 'Image file is required'})
+            
+            filename, file_content_type, file_view = files['image']
+            print(f"DEBUG: Extracted file: {filename}, size: {len(file_view)} bytes")
+            file_content = MemoryviewReader(file_view)
         else:
             # Handle JSON payload with base64 image
             if not body:
@@ -171,16 +380,19 @@ def upload_image(package_code, event, user_id, user_role):
                 print(f"DEBUG: JSON decode error: {str(e)}")
                 return cors_response(400, {'error': 'Invalid JSON in request body'})
         
-        # Generate S3 key
+        # Generate S3 key, named after the image id like presigned uploads
+        image_id = str(uuid.uuid4())
         file_extension = '.jpg'  # Default extension
-        s3_key = f"packages/{package_id}/{uuid.uuid4().hex}{file_extension}"
+        s3_key = f"packages/{package_id}/{image_id}{file_extension}"
         
         # Upload to S3
         try:
-            print(f"DEBUG: Processing file_data type: {type(file_data)}")
-            print(f"DEBUG: File data length: {len(file_data) if file_data else 0}")
-            
-            if isinstance(file_data, str) and file_data.startswith('data:'):
+            if file_content is not None:
+                # Multipart upload, already bytes
+                content_type = file_content_type if file_content_type in IMAGE_EXTENSIONS else 'image/jpeg'
+                file_extension = IMAGE_EXTENSIONS[content_type]
+                s3_key = f"packages/{package_id}/{image_id}{file_extension}"
+            elif isinstance(file_data, str) and file_data.startswith('data:'):
                 # Handle data URL
                 print("DEBUG: Processing data URL")
                 header, encoded = file_data.split(',', 1)
@@ -200,7 +412,7 @@ def upload_image(package_code, event, user_id, user_role):
                     content_type = 'image/jpeg'
                     file_extension = '.jpg'
                 
-                s3_key = f"packages/{package_id}/{uuid.uuid4().hex}{file_extension}"
+                s3_key = f"packages/{package_id}/{image_id}{file_extension}"
             else:
                 # Handle base64 string
                 print("DEBUG: Processing base64 string")
@@ -226,7 +438,6 @@ def upload_image(package_code, event, user_id, user_role):
             return cors_response(500, {'error': 'Failed to upload image to S3'})
         
         # Save image metadata to DynamoDB
-        image_id = str(uuid.uuid4())
         image_item = {
             'image_id': image_id,
             'package_id': package_id,
@@ -238,21 +449,21 @@ def upload_image(package_code, event, user_id, user_role):
         package_images_table.put_item(Item=image_item)
         
         # Publish to SNS for notifications
-        sns_message = {
+        sns_event = build_event('image_uploaded', f'image_uploaded:{image_id}', {
             'package_id': package_id,
             'code': package_code,
             'image_id': image_id,
             's3_key': s3_key,
             'purpose': purpose,
             'user_id': user_id,
-            'action': 'image_uploaded',
             'timestamp': datetime.utcnow().isoformat()
-        }
+        })
         
         sns.publish(
             TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(sns_message),
-            Subject='Package Image Uploaded'
+            Message=json.dumps(sns_event),
+            Subject='Package Image Uploaded',
+            MessageAttributes=event_attributes(sns_event)
         )
         
         return cors_response(201, {
@@ -267,9 +478,34 @@ def upload_image(package_code, event, user_id, user_role):
         print(f"Error uploading image: {str(e)}")
         return cors_response(500, {'error': 'Failed to upload image'})
 
-def get_package_images(package_code, user_id, user_role):
-    """Get all images for a package"""
+def cached_presigned_url(operation, s3_key):
+    """Presigned URL for an S3 object, signed once and reused until too little of its lifetime remains"""
+    cache_key = (operation, s3_key)
+    now = time.time()
+    
+    cached = presigned_url_cache.get(cache_key)
+    if cached and cached[1] - now > PRESIGNED_URL_EXPIRES_IN * PRESIGNED_URL_REUSE_FRACTION:
+        presigned_url_cache.move_to_end(cache_key)
+        return cached[0]
+    
+    url = s3.generate_presigned_url(
+        operation,
+        Params={'Bucket': os.environ['S3_BUCKET_NAME'], 'Key': s3_key},
+        ExpiresIn=PRESIGNED_URL_EXPIRES_IN
+    )
+    presigned_url_cache[cache_key] = (url, now + PRESIGNED_URL_EXPIRES_IN)
+    presigned_url_cache.move_to_end(cache_key)
+    while len(presigned_url_cache) > PRESIGNED_URL_CACHE_SIZE:
+        presigned_url_cache.popitem(last=False)
+    return url
+
+def get_package_images(package_code, user_id, user_role, query_parameters=None):
+    """Get all images for a package, with URLs for the requested size (thumb, medium or original)"""
     try:
+        size = (query_parameters or {}).get('size', 'original')
+        if size not in IMAGE_SIZES:
+            return cors_response(400, {'error': f"size must be one of {', '.join(IMAGE_SIZES)}"})
+        
         # First, get the package to verify access
         package = get_package_by_code(package_code, user_id, user_role)
         if package['statusCode'] != 200:
@@ -287,15 +523,16 @@ def get_package_images(package_code, user_id, user_role):
         
         images = response['Items']
         
-        # Generate pre-signed URLs for image access
+        # Generate pre-signed URLs for image access, falling back to the
+        # original while an image has no variants yet
         for image in images:
+            # Upload session state is for the uploader, and parts can hold up to MAX_UPLOAD_PARTS ETags
+            image.pop('upload_id', None)
+            image.pop('parts', None)
+            variant = image.get('variants', {}).get(size)
+            image['size'] = size if variant else 'original'
             try:
-                presigned_url = s3.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': os.environ['S3_BUCKET_NAME'], 'Key': image['s3_key']},
-                    ExpiresIn=3600  # 1 hour
-                )
-                image['presigned_url'] = presigned_url
+                image['presigned_url'] = cached_presigned_url('get_object', variant['s3_key'] if variant else image['s3_key'])
             except Exception as e:
                 print(f"Error generating presigned URL: {str(e)}")
                 image['presigned_url'] = None
@@ -357,7 +594,9 @@ def get_upload_url(package_code, user_id, user_role, query_parameters):
         elif 'image/gif' in content_type:
             file_extension = '.gif'
         
-        s3_key = f"packages/{package_id}/{uuid.uuid4().hex}{file_extension}"
+        # The object is named after the image id, which is how handle_s3_event finds its item
+        image_id = str(uuid.uuid4())
+        s3_key = f"packages/{package_id}/{image_id}{file_extension}"
         
         # Generate pre-signed URL for PUT operation
         presigned_url = s3.generate_presigned_url(
@@ -373,7 +612,6 @@ def get_upload_url(package_code, user_id, user_role, query_parameters):
         print(f"DEBUG: Generated presigned URL for key: {s3_key}")
         
         # Save upload metadata to DynamoDB (pending upload)
-        image_id = str(uuid.uuid4())
         image_item = {
             'image_id': image_id,
             'package_id': package_id,
@@ -402,6 +640,317 @@ def get_upload_url(package_code, user_id, user_role, query_parameters):
         print(f"Error generating upload URL: {str(e)}")
         return cors_response(500, {'error': 'Failed to generate upload URL'})
 
+def parse_json_body(body):
+    """Request body as a dict, ValueError if it is not a JSON object"""
+    try:
+        parsed = json.loads(body) if body else {}
+    except json.JSONDecodeError:
+        raise ValueError('Invalid JSON in request body')
+    if not isinstance(parsed, dict):
+        raise ValueError('Request body must be a JSON object')
+    return parsed
+
+def upload_part_urls(image_item, part_numbers):
+    """Presigned upload_part URLs of an upload session, by part number"""
+    return [
+        {
+            'part_number': part_number,
+            'url': s3.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': os.environ['S3_BUCKET_NAME'],
+                    'Key': image_item['s3_key'],
+                    'UploadId': image_item['upload_id'],
+                    'PartNumber': part_number
+                },
+                ExpiresIn=PART_URL_EXPIRES_IN
+            )
+        }
+        for part_number in part_numbers
+    ]
+
+def list_uploaded_parts(image_item):
+    """ETags of the parts S3 already holds for an upload session, by part number"""
+    parts = {}
+    list_kwargs = {
+        'Bucket': os.environ['S3_BUCKET_NAME'],
+        'Key': image_item['s3_key'],
+        'UploadId': image_item['upload_id']
+    }
+    while True:
+        response = s3.list_parts(**list_kwargs)
+        for part in response.get('Parts', []):
+            parts[part['PartNumber']] = part['ETag']
+        if not response.get('IsTruncated'):
+            return parts
+        list_kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+def session_response(image_item, uploaded_parts, part_numbers=None):
+    """Upload session state, with URLs for the given parts or the next missing ones"""
+    part_count = int(image_item['part_count'])
+    missing = [number for number in range(1, part_count + 1) if number not in uploaded_parts]
+    if part_numbers is None:
+        part_numbers = missing[:PART_URL_BATCH_SIZE]
+    
+    return {
+        'image_id': image_item['image_id'],
+        's3_key': image_item['s3_key'],
+        'status': image_item['status'],
+        'size': int(image_item['size_bytes']),
+        'part_size': int(image_item['part_size']),
+        'part_count': part_count,
+        'uploaded_parts': sorted(uploaded_parts),
+        'missing_parts': len(missing),
+        'parts': upload_part_urls(image_item, part_numbers),
+        'expires_in': PART_URL_EXPIRES_IN
+    }
+
+def get_session_item(package_code, image_id, user_id, user_role):
+    """(package access error response, open upload session item); one of them is None"""
+    package = get_package_by_code(package_code, user_id, user_role)
+    if package['statusCode'] != 200:
+        return package, None
+    package_id = json.loads(package['body'])['package_id']
+    
+    response = package_images_table.get_item(Key={'image_id': image_id})
+    image_item = response.get('Item')
+    if not image_item or image_item['package_id'] != package_id or 'part_count' not in image_item:
+        return cors_response(404, {'error': 'Upload session not found'}), None
+    if 'upload_id' not in image_item:
+        return cors_response(409, {'error': 'Upload session is already completed'}), None
+    return None, image_item
+
+def create_upload_session(package_code, body, user_id, user_role):
+    """Start an S3 multipart upload and hand out the URLs of its first parts"""
+    try:
+        package = get_package_by_code(package_code, user_id, user_role)
+        if package['statusCode'] != 200:
+            return package
+        package_id = json.loads(package['body'])['package_id']
+        
+        try:
+            body = parse_json_body(body)
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+        
+        content_type = body.get('contentType', 'image/jpeg')
+        if content_type not in MEDIA_EXTENSIONS:
+            return cors_response(400, {'error': f"contentType must be one of {', '.join(MEDIA_EXTENSIONS)}"})
+        size = body.get('size')
+        if not isinstance(size, int) or isinstance(size, bool) or not 0 < size <= MAX_UPLOAD_SIZE:
+            return cors_response(400, {'error': f'size must be a number of bytes up to {MAX_UPLOAD_SIZE}'})
+        
+        # Whole MiB parts, large enough to stay within MAX_UPLOAD_PARTS
+        part_size = max(DEFAULT_PART_SIZE, -(-size // MAX_UPLOAD_PARTS))
+        part_size = -(-part_size // 1024 ** 2) * 1024 ** 2
+        part_count = -(-size // part_size)
+        
+        image_id = str(uuid.uuid4())
+        s3_key = f"packages/{package_id}/{image_id}{MEDIA_EXTENSIONS[content_type]}"
+        upload = s3.create_multipart_upload(
+            Bucket=os.environ['S3_BUCKET_NAME'],
+            Key=s3_key,
+            ContentType=content_type
+        )
+        
+        image_item = {
+            'image_id': image_id,
+            'package_id': package_id,
+            'purpose': body.get('purpose', 'CREATION'),
+            's3_key': s3_key,
+            'filename': body.get('filename', 'upload' + MEDIA_EXTENSIONS[content_type]),
+            'content_type': content_type,
+            'status': 'UPLOADING',
+            'upload_id': upload['UploadId'],
+            'size_bytes': size,
+            'part_size': part_size,
+            'part_count': part_count,
+            'parts': {},
+            'created_at': datetime.utcnow().isoformat()
+        }
+        package_images_table.put_item(Item=image_item)
+        
+        print(f"DEBUG: Started multipart upload for {s3_key}: {part_count} parts of {part_size} bytes")
+        return cors_response(201, session_response(image_item, {}))
+        
+    except Exception as e:
+        print(f"Error creating upload session: {str(e)}")
+        return cors_response(500, {'error': 'Failed to create upload session'})
+
+def get_upload_session(package_code, image_id, user_id, user_role, query_parameters):
+    """
+    State of an upload session for resuming: the parts S3 already holds and
+    URLs for ?part_numbers=1,2,3 or, by default, the next missing parts
+    """
+    try:
+        error, image_item = get_session_item(package_code, image_id, user_id, user_role)
+        if error:
+            return error
+        
+        part_numbers = None
+        if query_parameters and query_parameters.get('part_numbers'):
+            try:
+                part_numbers = sorted({int(number) for number in query_parameters['part_numbers'].split(',')})
+            except ValueError:
+                return cors_response(400, {'error': 'part_numbers must be a comma separated list of numbers'})
+            if len(part_numbers) > MAX_PARTS_PER_REQUEST or not all(1 <= number <= image_item['part_count'] for number in part_numbers):
+                return cors_response(400, {'error': f"Up to {MAX_PARTS_PER_REQUEST} part numbers between 1 and {image_item['part_count']}"})
+        
+        return cors_response(200, session_response(image_item, list_uploaded_parts(image_item), part_numbers))
+        
+    except Exception as e:
+        print(f"Error getting upload session: {str(e)}")
+        return cors_response(500, {'error': 'Failed to get upload session'})
+
+def record_upload_parts(package_code, image_id, body, user_id, user_role):
+    """Record the ETags of uploaded parts ({"parts": [{"part_number", "etag"}]}) on the session"""
+    try:
+        error, image_item = get_session_item(package_code, image_id, user_id, user_role)
+        if error:
+            return error
+        
+        try:
+            parts = parse_json_body(body).get('parts')
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+        if not isinstance(parts, list) or not 0 < len(parts) <= MAX_PARTS_PER_REQUEST:
+            return cors_response(400, {'error': f'parts must be a list of 1 to {MAX_PARTS_PER_REQUEST} parts'})
+        for part in parts:
+            if (not isinstance(part, dict) or not isinstance(part.get('etag'), str) or not part['etag']
+                    or not isinstance(part.get('part_number'), int) or not 1 <= part['part_number'] <= image_item['part_count']):
+                return cors_response(400, {'error': f"Each part needs an etag and a part_number between 1 and {image_item['part_count']}"})
+        
+        # A part uploaded twice keeps its last ETag, as in S3; DynamoDB rejects
+        # an update that sets the same path twice
+        etags = {part['part_number']: part['etag'] for part in parts}
+        
+        names = {}
+        values = {':upload_id': image_item['upload_id']}
+        assignments = []
+        for index, (part_number, etag) in enumerate(etags.items()):
+            names[f'#p{index}'] = str(part_number)
+            values[f':e{index}'] = etag
+            assignments.append(f'parts.#p{index} = :e{index}')
+        
+        try:
+            response = package_images_table.update_item(
+                Key={'image_id': image_id},
+                UpdateExpression='SET ' + ', '.join(assignments),
+                ConditionExpression='upload_id = :upload_id',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return cors_response(409, {'error': 'Upload session is already completed'})
+        
+        recorded = response['Attributes']['parts']
+        return cors_response(200, {
+            'image_id': image_id,
+            'recorded_parts': sorted(int(number) for number in recorded),
+            'missing_parts': int(image_item['part_count']) - len(recorded)
+        })
+        
+    except Exception as e:
+        print(f"Error recording upload parts: {str(e)}")
+        return cors_response(500, {'error': 'Failed to record upload parts'})
+
+def complete_upload_session(package_code, image_id, body, user_id, user_role):
+    """
+    Complete a multipart upload with the recorded ETags plus any in the body;
+    parts never reported are taken from S3. The S3 event then marks the image
+    UPLOADED and notifies watchers as for any other upload.
+    """
+    try:
+        error, image_item = get_session_item(package_code, image_id, user_id, user_role)
+        if error:
+            return error
+        
+        try:
+            body_parts = parse_json_body(body).get('parts') or []
+            etags = {int(number): etag for number, etag in image_item.get('parts', {}).items()}
+            etags.update({int(part['part_number']): part['etag'] for part in body_parts})
+        except (ValueError, TypeError, KeyError):
+            return cors_response(400, {'error': 'parts must be a list of {"part_number", "etag"}'})
+        
+        part_count = int(image_item['part_count'])
+        if len(etags.keys() & range(1, part_count + 1)) < part_count:
+            etags = {**list_uploaded_parts(image_item), **etags}
+        missing = [number for number in range(1, part_count + 1) if number not in etags]
+        if missing:
+            return cors_response(409, {'error': 'Upload is missing parts', 'missing_parts': missing[:MAX_PARTS_PER_REQUEST]})
+        
+        try:
+            s3.complete_multipart_upload(
+                Bucket=os.environ['S3_BUCKET_NAME'],
+                Key=image_item['s3_key'],
+                UploadId=image_item['upload_id'],
+                MultipartUpload={'Parts': [
+                    {'PartNumber': number, 'ETag': etags[number]} for number in range(1, part_count + 1)
+                ]}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+                return cors_response(400, {'error': e.response['Error']['Message']})
+            if e.response['Error']['Code'] == 'NoSuchUpload':
+                return cors_response(409, {'error': 'Upload session is already completed or aborted'})
+            raise
+        
+        # Status is left to the S3 event, which may already have set UPLOADED
+        package_images_table.update_item(
+            Key={'image_id': image_id},
+            UpdateExpression='SET completed_at = :completed_at REMOVE upload_id, parts',
+            ExpressionAttributeValues={':completed_at': datetime.utcnow().isoformat()}
+        )
+        
+        return cors_response(200, {
+            'image_id': image_id,
+            'package_id': image_item['package_id'],
+            'purpose': image_item['purpose'],
+            's3_key': image_item['s3_key'],
+            'size': int(image_item['size_bytes'])
+        })
+        
+    except Exception as e:
+        print(f"Error completing upload session: {str(e)}")
+        return cors_response(500, {'error': 'Failed to complete upload'})
+
+def abort_upload_session(package_code, image_id, user_id, user_role):
+    """Abort a multipart upload, dropping its parts from S3 and its image record"""
+    try:
+        error, image_item = get_session_item(package_code, image_id, user_id, user_role)
+        if error:
+            return error
+        
+        try:
+            s3.abort_multipart_upload(
+                Bucket=os.environ['S3_BUCKET_NAME'],
+                Key=image_item['s3_key'],
+                UploadId=image_item['upload_id']
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+        
+        try:
+            package_images_table.delete_item(
+                Key={'image_id': image_id},
+                ConditionExpression='upload_id = :upload_id',
+                ExpressionAttributeValues={':upload_id': image_item['upload_id']}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return cors_response(409, {'error': 'Upload session is already completed'})
+        
+        return cors_response(204)
+        
+    except Exception as e:
+        print(f"Error aborting upload session: {str(e)}")
+        return cors_response(500, {'error': 'Failed to abort upload'})
+
 def handle_s3_upload_completion(s3_key, image_id):
     """Handle S3 upload completion - update DynamoDB and send notifications"""
     try:
@@ -436,20 +985,20 @@ def handle_s3_upload_completion(s3_key, image_id):
         package = package_response['Item']
         
         # Publish to SNS for notifications
-        sns_message = {
+        sns_event = build_event('image_uploaded', f'image_uploaded:{image_id}', {
             'package_id': package_id,
             'code': package.get('code'),
             'image_id': image_id,
             's3_key': s3_key,
             'purpose': image_item['purpose'],
-            'action': 'image_uploaded',
             'timestamp': datetime.utcnow().isoformat()
-        }
+        })
         
         sns.publish(
             TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(sns_message),
-            Subject='Package Image Uploaded'
+            Message=json.dumps(sns_event),
+            Subject='Package Image Uploaded',
+            MessageAttributes=event_attributes(sns_event)
         )
         
         print(f"DEBUG: Successfully processed upload completion for image_id: {image_id}")
@@ -458,52 +1007,88 @@ def handle_s3_upload_completion(s3_key, image_id):
         print(f"Error handling S3 upload completion: {str(e)}")
         # Don't return error response as this is called internally
 
-def handle_s3_event(record):
-    """Handle S3 upload event"""
+def variant_format():
+    """PIL format, Content-Type and extension of the variants: WebP when Pillow has it, JPEG otherwise"""
+    if features.check('webp'):
+        return 'WEBP', 'image/webp', '.webp'
+    return 'JPEG', 'image/jpeg', '.jpg'
+
+def generate_image_variants(bucket_name, image_item, source_size):
+    """
+    Write the missing IMAGE_VARIANTS of an uploaded image to S3 and record
+    their keys and dimensions on the image item. Sizes already recorded are
+    skipped, so a redelivered S3 event costs no S3 reads or writes.
+    Originals over MAX_VARIANT_SOURCE_BYTES or MAX_VARIANT_SOURCE_PIXELS get no variants.
+    """
+    variants = dict(image_item.get('variants') or {})
+    missing = sorted((size for size in IMAGE_VARIANTS if size not in variants), key=IMAGE_VARIANTS.get, reverse=True)
+    if not missing:
+        return variants
+    if Image is None:
+        print("Pillow is not available, skipping image variants")
+        return variants
+    if source_size > MAX_VARIANT_SOURCE_BYTES:
+        print(f"DEBUG: {image_item['s3_key']} is {source_size} bytes, skipping image variants")
+        return variants
+    
+    image_format, content_type, extension = variant_format()
+    body = s3.get_object(Bucket=bucket_name, Key=image_item['s3_key'])['Body'].read()
+    
+    with Image.open(io.BytesIO(body)) as original:
+        # JPEG decodes straight at 1/2, 1/4 or 1/8 scale when that still covers the largest variant
+        largest = IMAGE_VARIANTS[missing[0]]
+        original.draft('RGB', (largest, largest))
+        # Checked before decoding; the header alone gives the size
+        if original.width * original.height > MAX_VARIANT_SOURCE_PIXELS:
+            print(f"DEBUG: {image_item['s3_key']} is {original.width}x{original.height}, skipping image variants")
+            return variants
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha and image_format == 'WEBP' else 'RGB')
+    
+    # Largest first, each smaller variant is resized from the one before it
+    for size in missing:
+        image.thumbnail((IMAGE_VARIANTS[size], IMAGE_VARIANTS[size]), Image.Resampling.LANCZOS)
+        
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, quality=VARIANT_QUALITY)
+        variant_key = f"{VARIANTS_PREFIX}/{image_item['package_id']}/{image_item['image_id']}/{size}{extension}"
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=variant_key,
+            Body=buffer.getvalue(),
+            ContentType=content_type,
+            CacheControl='max-age=31536000, immutable'
+        )
+        variants[size] = {
+            's3_key': variant_key,
+            'content_type': content_type,
+            'width': image.width,
+            'height': image.height
+        }
+    
+    package_images_table.update_item(
+        Key={'image_id': image_item['image_id']},
+        UpdateExpression='SET variants = :variants',
+        ExpressionAttributeValues={':variants': variants}
+    )
+    return variants
+
+def parse_s3_record(record):
+    """(bucket_name, s3_key, package_id, image_id) of an upload notification, ValueError for an unexpected key"""
+    bucket_name = record['s3']['bucket']['name']
+    s3_key = unquote_plus(record['s3']['object']['key'])
+    
+    # Expected format: packages/{package_id}/{image_id}.{ext}
+    key_parts = s3_key.split('/')
+    if len(key_parts) != 3 or key_parts[0] != 'packages':
+        raise ValueError(f"Unexpected S3 key format: {s3_key}")
+    
+    return bucket_name, s3_key, key_parts[1], key_parts[2].split('.')[0]
+
+def mark_image_uploaded(image_id):
+    """Set an image to UPLOADED, returning the error message if that failed"""
     try:
-        print(f"DEBUG: Received S3 event: {json.dumps(record)}")
-        
-        # Extract S3 information
-        bucket_name = record['s3']['bucket']['name']
-        s3_key = record['s3']['object']['key']
-        event_name = record['eventName']
-        
-        print(f"DEBUG: S3 event - bucket: {bucket_name}, key: {s3_key}, event: {event_name}")
-        
-        # Only process ObjectCreated events
-        if not event_name.startswith('ObjectCreated'):
-            print(f"DEBUG: Ignoring non-ObjectCreated event: {event_name}")
-            return {'statusCode': 200}
-        
-        # Extract image_id from the S3 key path
-        # Expected format: packages/{package_id}/{image_id}.{ext}
-        key_parts = s3_key.split('/')
-        if len(key_parts) != 3 or key_parts[0] != 'packages':
-            print(f"ERROR: Unexpected S3 key format: {s3_key}")
-            return {'statusCode': 400}
-        
-        package_id = key_parts[1]
-        filename = key_parts[2]
-        
-        # Extract image_id from filename (remove extension)
-        image_id = filename.split('.')[0]
-        
-        print(f"DEBUG: Extracted package_id: {package_id}, image_id: {image_id}")
-        
-        # Find the image record in DynamoDB
-        response = package_images_table.get_item(Key={'image_id': image_id})
-        if 'Item' not in response:
-            print(f"ERROR: Image record not found for image_id: {image_id}")
-            return {'statusCode': 404}
-        
-        image_item = response['Item']
-        
-        # Verify the package_id matches
-        if image_item['package_id'] != package_id:
-            print(f"ERROR: Package ID mismatch. Expected: {package_id}, Found: {image_item['package_id']}")
-            return {'statusCode': 400}
-        
-        # Update image status to uploaded
         package_images_table.update_item(
             Key={'image_id': image_id},
             UpdateExpression='SET #status = :status, uploaded_at = :uploaded_at',
@@ -513,35 +1098,105 @@ def handle_s3_event(record):
                 ':uploaded_at': datetime.utcnow().isoformat()
             }
         )
-        
-        # Get package info for notifications
-        package_response = packages_table.get_item(Key={'package_id': package_id})
-        if 'Item' not in package_response:
-            print(f"ERROR: Package not found for package_id: {package_id}")
-            return {'statusCode': 404}
-        
-        package = package_response['Item']
-        
-        # Publish to SNS for notifications
-        sns_message = {
+        return None
+    except Exception as e:
+        print(f"Error updating image status for {image_id}: {str(e)}")
+        return 'Failed to update image status'
+
+def handle_s3_records(records, context):
+    """
+    Handle every upload in an S3 notification: images and packages are read
+    with BatchGetItem, statuses updated concurrently, notifications sent with
+    PublishBatch and variants generated while time allows.
+    Returns the uploads that could not be fully processed, with the reason.
+    Raises once everything else is done if any of them can succeed on a retry,
+    so Lambda's async retry runs the event again: statuses are set again,
+    notifications are deduplicated by event_id and existing variants skipped.
+    """
+    failures = []
+    uploads = {}
+    object_sizes = {}
+    for record in records:
+        s3_key = record['s3']['object']['key']
+        if not record['eventName'].startswith('ObjectCreated'):
+            print(f"DEBUG: Ignoring non-ObjectCreated event: {record['eventName']} for {s3_key}")
+            continue
+        try:
+            bucket_name, s3_key, package_id, image_id = parse_s3_record(record)
+        except ValueError as e:
+            print(f"ERROR: {str(e)}")
+            failures.append({'s3_key': s3_key, 'error': str(e), 'retryable': False})
+            continue
+        uploads[image_id] = (bucket_name, s3_key, package_id)
+        object_sizes[image_id] = record['s3']['object'].get('size', 0)
+    
+    print(f"DEBUG: S3 event with {len(records)} records, {len(uploads)} uploads")
+    
+    images = {}
+    if uploads:
+        images = {
+            item['image_id']: item
+            for item in batch_get_items(package_images_table, [{'image_id': image_id} for image_id in uploads])
+        }
+    for image_id, (_, s3_key, package_id) in list(uploads.items()):
+        if image_id not in images:
+            failures.append({'s3_key': s3_key, 'error': f'Image record not found for image_id: {image_id}', 'retryable': False})
+            del uploads[image_id]
+        elif images[image_id]['package_id'] != package_id:
+            failures.append({'s3_key': s3_key, 'error': f"Package ID mismatch, image belongs to {images[image_id]['package_id']}", 'retryable': False})
+            del uploads[image_id]
+    
+    if uploads:
+        image_ids = list(uploads)
+        with ThreadPoolExecutor(max_workers=min(len(image_ids), STATUS_UPDATE_WORKERS)) as executor:
+            for image_id, error in zip(image_ids, executor.map(mark_image_uploaded, image_ids)):
+                if error:
+                    failures.append({'s3_key': uploads.pop(image_id)[1], 'error': error, 'retryable': True})
+    
+    # Get package info for notifications
+    packages = {}
+    package_ids = {package_id for _, _, package_id in uploads.values()}
+    if package_ids:
+        packages = {
+            item['package_id']: item
+            for item in batch_get_items(packages_table, [{'package_id': package_id} for package_id in package_ids])
+        }
+    
+    messages = []
+    for image_id, (_, s3_key, package_id) in uploads.items():
+        if package_id not in packages:
+            failures.append({'s3_key': s3_key, 'error': f'Package not found for package_id: {package_id}', 'retryable': False})
+            continue
+        messages.append((image_id, build_event('image_uploaded', f'image_uploaded:{image_id}', {
             'package_id': package_id,
-            'code': package.get('code'),
+            'code': packages[package_id].get('code'),
             'image_id': image_id,
             's3_key': s3_key,
-            'purpose': image_item['purpose'],
-            'action': 'image_uploaded',
+            'purpose': images[image_id]['purpose'],
             'timestamp': datetime.utcnow().isoformat()
-        }
-        
-        sns.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(sns_message),
-            Subject='Package Image Uploaded'
-        )
-        
-        print(f"DEBUG: Successfully processed S3 upload for image_id: {image_id}")
-        return {'statusCode': 200}
-        
-    except Exception as e:
-        print(f"Error handling S3 event: {str(e)}")
-        return {'statusCode': 500}
+        })))
+    for image_id in publish_batch(messages, 'Package Image Uploaded'):
+        failures.append({'s3_key': uploads[image_id][1], 'error': 'Failed to publish notification', 'retryable': True})
+    
+    # After the notifications, so variants never delay them; listings fall back to the original
+    for image_id, (bucket_name, s3_key, _) in uploads.items():
+        if all(size in images[image_id].get('variants', {}) for size in IMAGE_VARIANTS):
+            continue
+        if not s3_key.endswith(tuple(IMAGE_EXTENSIONS.values())):
+            continue
+        if context and context.get_remaining_time_in_millis() < VARIANTS_MIN_REMAINING_TIME_MS:
+            failures.append({'s3_key': s3_key, 'error': 'Not enough time left to generate variants', 'retryable': True})
+            continue
+        try:
+            generate_image_variants(bucket_name, images[image_id], object_sizes[image_id])
+        except Exception as e:
+            print(f"Error generating image variants for {image_id}: {str(e)}")
+            failures.append({'s3_key': s3_key, 'error': 'Failed to generate variants', 'retryable': True})
+    
+    for failure in failures:
+        print(f"ERROR: S3 upload {failure['s3_key']} not fully processed: {failure['error']}")
+    print(f"DEBUG: Processed {len(uploads)} S3 uploads, {len(failures)} failures")
+    retryable = [failure for failure in failures if failure['retryable']]
+    if retryable:
+        raise Exception(f"{len(retryable)} S3 uploads not fully processed, retrying the event")
+    return {'statusCode': 207 if failures else 200, 'failures': failures}
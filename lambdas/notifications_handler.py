@@ -1,16 +1,75 @@
 import json
 import boto3
 import os
+import time
 from datetime import datetime, timezone
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+# WebSocket fan-out: concurrent pushes, one pooled HTTP connection per worker
+WEBSOCKET_PUSH_WORKERS = int(os.environ.get('WEBSOCKET_PUSH_WORKERS', '32'))
+WEBSOCKET_CONNECT_TIMEOUT_S = 2
+WEBSOCKET_READ_TIMEOUT_S = 3
+
+# Connections expire this long after connecting or their last ping
+CONNECTION_TTL_SECONDS = 3600
+
+# Scheduled sweep: connections silent this long are probed with GetConnection
+IDLE_CONNECTION_SECONDS = 15 * 60
+SWEEP_MIN_REMAINING_TIME_MS = 3000
+
+# Missed tracks pushed on subscribe, in frames well under the 128 KB WebSocket limit
+MAX_CATCH_UP_TRACKS = 500
+CATCH_UP_TRACKS_PER_MESSAGE = 100
+
+# Packages one connection can subscribe to
+MAX_SUBSCRIPTIONS_PER_CONNECTION = 100
+
+# Sender lookups for "watch all my packages" connections
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+
+# Newest SNS event envelope version this consumer understands
+EVENT_VERSION = 1
+
+# Handled SNS event ids are kept as long as SQS can redeliver them (default retention)
+PROCESSED_EVENT_TTL_SECONDS = 4 * 24 * 3600
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
-apigatewaymanagementapi = boto3.client('apigatewaymanagementapi')
+cognito = boto3.client('cognito-idp')
+# Bound to the stage so post_to_connection reaches this API
+apigatewaymanagementapi = boto3.client(
+    'apigatewaymanagementapi',
+    endpoint_url=os.environ.get('WEBSOCKET_API_ENDPOINT'),
+    config=Config(
+        max_pool_connections=WEBSOCKET_PUSH_WORKERS,
+        connect_timeout=WEBSOCKET_CONNECT_TIMEOUT_S,
+        read_timeout=WEBSOCKET_READ_TIMEOUT_S,
+        retries={'max_attempts': 2}
+    )
+)
 
 # Table references
 websocket_connections_table = dynamodb.Table('package-tracking-websocket-connections')
+# package_code + connection_id rows, so a broadcast queries one package's subscribers
+websocket_subscriptions_table = dynamodb.Table('package-tracking-websocket-subscriptions')
 packages_table = dynamodb.Table('package-tracking-packages')
+tracks_table = dynamodb.Table('package-tracking-tracks')
+processed_events_table = dynamodb.Table('package-tracking-processed-events')
+
+def convert_decimals_to_float(obj):
+    """Convert Decimal objects to float for JSON serialization"""
+    from decimal import Decimal
+    if isinstance(obj, Decimal):
+        return float(obj)
+    elif isinstance(obj, dict):
+        return {key: convert_decimals_to_float(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_decimals_to_float(item) for item in obj]
+    else:
+        return obj
 
 def cors_response(status_code, body=None):
     """
@@ -35,14 +94,23 @@ def lambda_handler(event, context):
     Processes messages from SNS Topic via SQS and WebSocket connection management
     """
     
+    # SQS event: errors are raised, not turned into a 500 response, which SQS
+    # would take as the whole batch succeeding
+    if 'Records' in event:
+        return handle_sqs_event(event, context)
+    
     try:
+        # Lambda authorizer of the WebSocket $connect route
+        if event.get('type') == 'REQUEST' and 'methodArn' in event:
+            return authorize_websocket_connect(event)
+        
         # Check if this is a WebSocket event
         if 'requestContext' in event and 'routeKey' in event:
             return handle_websocket_event(event, context)
         
-        # Check if this is an SQS event
-        if 'Records' in event:
-            return handle_sqs_event(event, context)
+        # EventBridge schedule: sweep idle connections
+        if event.get('source') == 'aws.events':
+            return sweep_idle_connections(context)
         
         # Unknown event type
         print(f"Unknown event type: {json.dumps(event)}")
@@ -52,32 +120,186 @@ def lambda_handler(event, context):
         print(f"Error in notifications_handler: {str(e)}")
         return cors_response(500, {'error': 'Failed to process event'})
 
+def batch_get_items(table, keys, projection):
+    """
+    Read items by primary key with BatchGetItem, BATCH_GET_SIZE keys per call,
+    retrying UnprocessedKeys with exponential backoff. Missing items are omitted.
+    """
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {table.name: {'Keys': keys[start:start + BATCH_GET_SIZE], 'ProjectionExpression': projection}}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(table.name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+        else:
+            raise Exception(f"Unprocessed keys reading {table.name}")
+    return items
+
+def get_user_watchers(user_id):
+    """Connections of a user that watch all of its packages (user-id-index)"""
+    query_kwargs = {
+        'IndexName': 'user-id-index',
+        'KeyConditionExpression': 'user_id = :user_id',
+        'FilterExpression': 'watch_all = :watch_all',
+        'ExpressionAttributeValues': {':user_id': user_id, ':watch_all': True},
+        'ProjectionExpression': 'connection_id'
+    }
+    connection_ids = []
+    while True:
+        response = websocket_connections_table.query(**query_kwargs)
+        connection_ids.extend(connection['connection_id'] for connection in response.get('Items', []))
+        
+        if 'LastEvaluatedKey' not in response:
+            return connection_ids
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def resolve_package_watchers(package_ids):
+    """
+    Map package ids to the connections watching all packages of their sender:
+    one BatchGetItem for the senders, then one user-id-index query per sender.
+    """
+    keys = [{'package_id': package_id} for package_id in sorted(set(package_ids))]
+    packages = batch_get_items(packages_table, keys, 'package_id, sender_id')
+    
+    watchers_by_sender = {}
+    for sender_id in {package['sender_id'] for package in packages if package.get('sender_id')}:
+        watchers_by_sender[sender_id] = get_user_watchers(sender_id)
+    
+    return {package['package_id']: watchers_by_sender.get(package.get('sender_id'), []) for package in packages}
+
+def get_processed_event_ids(event_ids):
+    """Event ids already handled by an earlier delivery, read with BatchGetItem"""
+    keys = [{'event_id': event_id} for event_id in sorted(set(event_ids))]
+    return {item['event_id'] for item in batch_get_items(processed_events_table, keys, 'event_id')}
+
+def mark_events_processed(event_ids):
+    """Record handled event ids with BatchWriteItem, expiring after PROCESSED_EVENT_TTL_SECONDS"""
+    expires_at = int(time.time()) + PROCESSED_EVENT_TTL_SECONDS
+    with processed_events_table.batch_writer(overwrite_by_pkeys=['event_id']) as batch:
+        for event_id in set(event_ids):
+            batch.put_item(Item={'event_id': event_id, 'expires_at': expires_at})
+
+class UnsupportedEventVersion(Exception):
+    """An envelope newer than this consumer understands, published by an updated producer"""
+
+def parse_sqs_record(record):
+    """
+    SQS record -> (event type, event data) from the SNS message.
+    The envelope's event_id is copied into the data for deduplication.
+    """
+    sns_message = json.loads(record['body'])
+    event = json.loads(sns_message['Message'])
+    
+    if 'event_type' in event:
+        if event['event_version'] > EVENT_VERSION:
+            raise UnsupportedEventVersion(f"unsupported event_version {event['event_version']}")
+        return event['event_type'], {**event['data'], 'event_id': event['event_id']}
+    
+    # Events published before the envelope; SNS routes them to the tracks queue
+    if sns_message.get('Subject') == 'Package Track Updated':
+        return 'package_track_updated', event
+    return event.get('action'), event
+
 def handle_sqs_event(event, context):
-    """Handle SQS messages from SNS Topic"""
+    """
+    Handle SQS messages from SNS Topic.
+    Events already handled (SNS/SQS deliver at least once) are skipped, track
+    updates are coalesced per package code, and only the records that failed
+    are reported back so SQS redelivers just those. Besides the package
+    subscribers, every event reaches the connections watching all packages of its sender.
+    """
+    failed_message_ids = []
+    handled_event_ids = []
+    records = []
+    
+    for record in event['Records']:
+        message_id = record['messageId']
+        try:
+            action, message_data = parse_sqs_record(record)
+        except UnsupportedEventVersion as e:
+            # Retried until this consumer is updated, then left in the DLQ
+            print(f"Cannot handle SQS message {message_id} yet: {str(e)}")
+            failed_message_ids.append(message_id)
+            continue
+        except (ValueError, KeyError, TypeError) as e:
+            # Redelivering a malformed message would fail the same way
+            print(f"Dropping malformed SQS message {message_id}: {str(e)}")
+            continue
+        records.append((message_id, action, message_data))
+    
+    # One read for the whole batch; if it fails the batch is handled, duplicates included
+    event_ids = [message_data['event_id'] for _, _, message_data in records if message_data.get('event_id')]
     try:
-        # Process SQS records
-        for record in event['Records']:
-            # Parse SNS message
-            sns_message = json.loads(record['body'])
-            message_data = json.loads(sns_message['Message'])
-            
-            # Process notification based on action type
-            action = message_data.get('action')
-            
+        seen_event_ids = get_processed_event_ids(event_ids) if event_ids else set()
+    except Exception as e:
+        print(f"Error reading processed events: {str(e)}")
+        seen_event_ids = set()
+    
+    notifications = []
+    track_updates = {}
+    for message_id, action, message_data in records:
+        event_id = message_data.get('event_id')
+        if event_id in seen_event_ids:
+            print(f"Skipping duplicate event {event_id} (SQS message {message_id})")
+            continue
+        if event_id:
+            seen_event_ids.add(event_id)
+        
+        if action == 'package_track_updated':
+            track_updates.setdefault(message_data.get('code'), []).append((message_id, message_data))
+        else:
+            notifications.append((message_id, action, message_data))
+    
+    # Resolved before broadcasting anything, so a failure here retries without duplicates
+    package_ids = [message_data.get('package_id') for _, _, message_data in notifications]
+    package_ids += [message_data.get('package_id') for updates in track_updates.values() for _, message_data in updates]
+    try:
+        watchers = resolve_package_watchers([package_id for package_id in package_ids if package_id])
+    except Exception as e:
+        print(f"Error resolving package watchers: {str(e)}")
+        return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in event['Records']]}
+    
+    for message_id, action, message_data in notifications:
+        watcher_ids = watchers.get(message_data.get('package_id'), [])
+        try:
             if action == 'package_created':
-                handle_package_created_notification(message_data)
-            elif action == 'package_track_updated':
-                handle_track_updated_notification(message_data)
+                handle_package_created_notification(message_data, watcher_ids)
             elif action == 'image_uploaded':
-                handle_image_uploaded_notification(message_data)
+                handle_image_uploaded_notification(message_data, watcher_ids)
             else:
-                print(f"Unknown action type: {action}")
-        
-        return cors_response(200, {'message': 'SQS notifications processed successfully'})
-        
-    except Exception as e:
-        print(f"Error handling SQS event: {str(e)}")
-        return cors_response(500, {'error': 'Failed to process SQS notifications'})
+                # Filter policies keep other event types off these queues
+                print(f"Unknown event type: {action}")
+            handled_event_ids.append(message_data.get('event_id'))
+        except Exception as e:
+            print(f"Error handling {action} notification {message_id}: {str(e)}")
+            failed_message_ids.append(message_id)
+    
+    # One broadcast per package with every update it got in this batch
+    for package_code, updates in track_updates.items():
+        watcher_ids = watchers.get(updates[0][1].get('package_id'), [])
+        try:
+            handle_track_updated_notification(package_code, [message_data for _, message_data in updates], watcher_ids)
+            handled_event_ids.extend(message_data.get('event_id') for _, message_data in updates)
+        except Exception as e:
+            print(f"Error handling track updates for package {package_code}: {str(e)}")
+            failed_message_ids.extend(message_id for message_id, _ in updates)
+    
+    handled_event_ids = [event_id for event_id in handled_event_ids if event_id]
+    if handled_event_ids:
+        try:
+            mark_events_processed(handled_event_ids)
+        except Exception as e:
+            # Only costs a duplicate push if these messages are delivered again
+            print(f"Error recording processed events: {str(e)}")
+    
+    if failed_message_ids:
+        print(f"{len(failed_message_ids)} of {len(event['Records'])} SQS messages failed")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
 
 def handle_websocket_event(event, context):
     """Handle WebSocket events"""
@@ -101,24 +323,61 @@ def handle_websocket_event(event, context):
         print(f"Error handling WebSocket event: {str(e)}")
         return cors_response(500, {'error': 'Failed to process WebSocket event'})
 
+def authorizer_policy(principal_id, effect, method_arn, context=None):
+    """IAM policy returned by the $connect authorizer"""
+    policy = {
+        'principalId': principal_id,
+        'policyDocument': {
+            'Version': '2012-10-17',
+            'Statement': [{'Action': 'execute-api:Invoke', 'Effect': effect, 'Resource': method_arn}]
+        }
+    }
+    if context:
+        policy['context'] = context
+    return policy
+
+def authorize_websocket_connect(event):
+    """
+    $connect authorizer. Browsers cannot set headers on a WebSocket, so the
+    Cognito access token comes as ?token= and is verified with GetUser; its
+    sub becomes the connection's user_id. Connections without a token stay
+    anonymous and can only watch packages by code.
+    """
+    token = (event.get('queryStringParameters') or {}).get('token')
+    if not token:
+        return authorizer_policy('anonymous', 'Allow', event['methodArn'])
+    
+    try:
+        user = cognito.get_user(AccessToken=token)
+    except ClientError as e:
+        print(f"Rejected WebSocket connection: {e.response['Error']['Code']}")
+        return authorizer_policy('unauthorized', 'Deny', event['methodArn'])
+    
+    attributes = {attribute['Name']: attribute['Value'] for attribute in user['UserAttributes']}
+    return authorizer_policy(attributes['sub'], 'Allow', event['methodArn'], {'user_id': attributes['sub']})
+
 def handle_websocket_connect(event, context):
     """Handle WebSocket connection"""
     try:
         connection_id = event['requestContext']['connectionId']
         
-        # Extract user info from query parameters (if available)
-        query_params = event.get('queryStringParameters', {})
-        user_id = query_params.get('user_id', 'anonymous')
+        # Only the authorizer's verified identity is trusted, never a query parameter
+        verified_user_id = (event['requestContext'].get('authorizer') or {}).get('user_id')
+        user_id = verified_user_id or 'anonymous'
         
-        # Store connection in DynamoDB
-        ttl = int((datetime.now(timezone.utc).timestamp() + 3600))  # 1 hour TTL
+        # Store connection in DynamoDB; pings keep extending the TTL
+        now = int(time.time())
         
         websocket_connections_table.put_item(
             Item={
                 'connection_id': connection_id,
                 'user_id': user_id,
+                'identity_verified': verified_user_id is not None,
                 'connected_at': datetime.now(timezone.utc).isoformat(),
-                'ttl': ttl
+                'last_seen_at': now,
+                'ttl': now + CONNECTION_TTL_SECONDS,
+                # Subscription rows are written with the connection TTL, so never expire before this
+                'subscriptions_ttl': now + CONNECTION_TTL_SECONDS
             }
         )
         
@@ -130,15 +389,35 @@ def handle_websocket_connect(event, context):
         print(f"Error handling WebSocket connect: {str(e)}")
         return cors_response(500, {'error': 'Failed to connect'})
 
+def subscribed_codes(connection):
+    """Package codes a connection item is subscribed to"""
+    package_codes = set(connection.get('package_codes', set()))
+    # Connections made before package_codes held a single package_code
+    if connection.get('package_code'):
+        package_codes.add(connection['package_code'])
+    return package_codes
+
+def delete_subscription_rows(connection_id, package_codes):
+    """Delete the subscription rows of one connection with BatchWriteItem"""
+    with websocket_subscriptions_table.batch_writer() as batch:
+        for package_code in package_codes:
+            batch.delete_item(Key={'package_code': package_code, 'connection_id': connection_id})
+
+def remove_connection(connection_id):
+    """Delete a connection and its subscription rows"""
+    response = websocket_connections_table.delete_item(
+        Key={'connection_id': connection_id},
+        ReturnValues='ALL_OLD'
+    )
+    delete_subscription_rows(connection_id, subscribed_codes(response.get('Attributes', {})))
+
 def handle_websocket_disconnect(event, context):
     """Handle WebSocket disconnection"""
     try:
         connection_id = event['requestContext']['connectionId']
         
-        # Remove connection from DynamoDB
-        websocket_connections_table.delete_item(
-            Key={'connection_id': connection_id}
-        )
+        # Remove connection and its subscription from DynamoDB
+        remove_connection(connection_id)
         
         print(f"WebSocket connection closed: {connection_id}")
         
@@ -157,11 +436,14 @@ def handle_websocket_message(event, context):
         action = body.get('action')
         
         if action == 'subscribe':
-            package_code = body.get('package_code')
-            return handle_subscribe_to_package(connection_id, package_code)
+            # Reconnecting clients pass since or last_track_id to get what they missed
+            return handle_subscribe_to_package(connection_id, message_package_codes(body), body.get('since'), body.get('last_track_id'))
         elif action == 'unsubscribe':
-            package_code = body.get('package_code')
-            return handle_unsubscribe_from_package(connection_id, package_code)
+            return handle_unsubscribe_from_package(connection_id, message_package_codes(body))
+        elif action == 'subscribe_all':
+            return handle_subscribe_to_user_packages(connection_id)
+        elif action == 'unsubscribe_all':
+            return handle_unsubscribe_from_user_packages(connection_id)
         elif action == 'ping':
             return handle_ping(connection_id)
         else:
@@ -172,46 +454,314 @@ def handle_websocket_message(event, context):
         print(f"Error handling WebSocket message: {str(e)}")
         return cors_response(500, {'error': 'Failed to process message'})
 
-def handle_subscribe_to_package(connection_id, package_code):
-    """Handle subscription to package updates"""
+def message_package_codes(body):
+    """Package codes of a subscribe/unsubscribe message: package_codes (a list) and/or package_code"""
+    package_codes = body.get('package_codes') or []
+    if not isinstance(package_codes, list):
+        package_codes = [package_codes]
+    if body.get('package_code'):
+        package_codes.append(body['package_code'])
+    return package_codes
+
+def parse_timestamp(value, name):
+    """
+    Validate a since timestamp and normalize it to the format tracks are
+    stored with (naive UTC isoformat), so string order is time order
+    """
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+def get_package_id(package_code):
+    """package_id of the package with package_code, or None"""
+    response = packages_table.query(
+        IndexName='code-index',
+        KeyConditionExpression='code = :code',
+        ExpressionAttributeValues={':code': package_code}
+    )
+    return response['Items'][0]['package_id'] if response['Items'] else None
+
+def get_track_timestamp(package_code, track_id):
+    """Timestamp of the track track_id, or None if it is not a track of package_code"""
+    package_id = get_package_id(package_code)
+    if not package_id:
+        return None
+    track = tracks_table.get_item(
+        Key={'track_id': track_id},
+        ProjectionExpression='package_id, #timestamp',
+        ExpressionAttributeNames={'#timestamp': 'timestamp'}
+    ).get('Item')
+    if not track or track['package_id'] != package_id:
+        return None
+    return track['timestamp']
+
+def get_missed_tracks(package_code, since):
+    """
+    Tracks of a package after since, oldest first.
+    Returns (tracks, truncated), at most MAX_CATCH_UP_TRACKS of them.
+    """
+    package_id = get_package_id(package_code)
+    if not package_id:
+        return [], False
+    
+    query_kwargs = {
+        'IndexName': 'package-timestamp-index',
+        'KeyConditionExpression': 'package_id = :package_id AND #timestamp > :since',
+        'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
+        'ExpressionAttributeValues': {':package_id': package_id, ':since': since},
+        'ScanIndexForward': True
+    }
+    
+    # One extra track tells whether there is more than we push
+    tracks = []
+    while len(tracks) <= MAX_CATCH_UP_TRACKS:
+        query_kwargs['Limit'] = MAX_CATCH_UP_TRACKS + 1 - len(tracks)
+        response = tracks_table.query(**query_kwargs)
+        tracks.extend(response.get('Items', []))
+        
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    return tracks[:MAX_CATCH_UP_TRACKS], len(tracks) > MAX_CATCH_UP_TRACKS
+
+def push_missed_tracks(connection_id, package_code, since):
+    """Send the tracks a reconnecting client missed, in order. Returns how many were sent."""
+    tracks, truncated = get_missed_tracks(package_code, since)
+    tracks = convert_decimals_to_float(tracks)
+    
+    # Always at least one frame, so the client knows the catch-up is complete
+    sent = 0
+    for start in range(0, max(len(tracks), 1), CATCH_UP_TRACKS_PER_MESSAGE):
+        chunk = tracks[start:start + CATCH_UP_TRACKS_PER_MESSAGE]
+        is_last = start + CATCH_UP_TRACKS_PER_MESSAGE >= len(tracks)
+        message = {
+            'action': 'package_track_history',
+            'package_code': package_code,
+            'tracks': chunk,
+            # More history than was pushed: the client reads the rest from GET /packages/{code}/tracks
+            'truncated': truncated and is_last,
+            'complete': is_last
+        }
+        if not send_websocket_message(connection_id, message):
+            break
+        sent += len(chunk)
+    return sent
+
+def handle_subscribe_to_package(connection_id, package_codes, since=None, last_track_id=None):
+    """
+    Handle subscription to package updates, adding package_codes to the
+    connection's subscriptions (at most MAX_SUBSCRIPTIONS_PER_CONNECTION).
+    With since, or last_track_id for a single package, the tracks missed while
+    offline are pushed once the subscription is live; clients drop duplicates by track_id.
+    A last_track_id that is not a track of the package is rejected rather than
+    replaying the whole history.
+    """
+    try:
+        if not package_codes or not all(isinstance(code, str) and code for code in package_codes):
+            return cors_response(400, {'error': 'package_code or package_codes is required'})
+        if since:
+            try:
+                since = parse_timestamp(since, 'since')
+            except ValueError as e:
+                return cors_response(400, {'error': str(e)})
+        package_codes = set(package_codes)
+        if last_track_id:
+            # A track id only pins the position in its own package
+            if len(package_codes) > 1:
+                return cors_response(400, {'error': 'last_track_id needs a single package_code, use since for several'})
+            since = get_track_timestamp(next(iter(package_codes)), last_track_id)
+            if not since:
+                return cors_response(400, {'error': 'last_track_id is not a track of this package'})
+        
+        connection = websocket_connections_table.get_item(Key={'connection_id': connection_id}).get('Item')
+        if not connection:
+            return cors_response(404, {'error': 'Connection not found'})
+        
+        current_codes = set(connection.get('package_codes', set()))
+        if len(current_codes | package_codes) > MAX_SUBSCRIPTIONS_PER_CONNECTION:
+            return cors_response(400, {'error': f'A connection can subscribe to at most {MAX_SUBSCRIPTIONS_PER_CONNECTION} packages'})
+        
+        new_codes = package_codes - current_codes
+        if new_codes:
+            # The set must not have changed since it was read, or the limit could be exceeded
+            condition = 'attribute_exists(connection_id) AND attribute_not_exists(package_codes)'
+            values = {':package_codes': new_codes}
+            if current_codes:
+                condition = 'attribute_exists(connection_id) AND size(package_codes) = :count'
+                values[':count'] = len(current_codes)
+            try:
+                websocket_connections_table.update_item(
+                    Key={'connection_id': connection_id},
+                    UpdateExpression='ADD package_codes :package_codes',
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    return cors_response(409, {'error': 'Subscriptions changed concurrently, retry'})
+                raise
+            
+            # Subscription rows expire with their connection
+            ttl = connection.get('ttl', int(time.time()) + CONNECTION_TTL_SECONDS)
+            with websocket_subscriptions_table.batch_writer() as batch:
+                for package_code in new_codes:
+                    batch.put_item(Item={
+                        'package_code': package_code,
+                        'connection_id': connection_id,
+                        'user_id': connection.get('user_id', 'anonymous'),
+                        'ttl': ttl
+                    })
+        
+        print(f"Connection {connection_id} subscribed to packages {sorted(package_codes)}")
+        
+        # Catch up only after subscribing, so no update falls in between
+        body = {
+            'message': f'Subscribed to {len(package_codes)} packages',
+            'package_codes': sorted(current_codes | package_codes)
+        }
+        if since:
+            body['missed_tracks'] = sum(
+                push_missed_tracks(connection_id, package_code, since)
+                for package_code in sorted(package_codes)
+            )
+        
+        return cors_response(200, body)
+        
+    except Exception as e:
+        print(f"Error subscribing to package: {str(e)}")
+        return cors_response(500, {'error': 'Failed to subscribe'})
+
+def handle_unsubscribe_from_package(connection_id, package_codes):
+    """Handle unsubscription from package updates, from every package when none are given"""
+    try:
+        if package_codes:
+            response = websocket_connections_table.update_item(
+                Key={'connection_id': connection_id},
+                UpdateExpression='DELETE package_codes :package_codes',
+                ConditionExpression='attribute_exists(connection_id)',
+                ExpressionAttributeValues={':package_codes': set(package_codes)},
+                ReturnValues='UPDATED_OLD'
+            )
+            removed_codes = set(response.get('Attributes', {}).get('package_codes', set())) & set(package_codes)
+        else:
+            response = websocket_connections_table.update_item(
+                Key={'connection_id': connection_id},
+                UpdateExpression='REMOVE package_codes, package_code',
+                ConditionExpression='attribute_exists(connection_id)',
+                ReturnValues='UPDATED_OLD'
+            )
+            removed_codes = subscribed_codes(response.get('Attributes', {}))
+        
+        delete_subscription_rows(connection_id, removed_codes)
+        
+        print(f"Connection {connection_id} unsubscribed from packages {sorted(removed_codes)}")
+        
+        return cors_response(200, {'message': f'Unsubscribed from {len(removed_codes)} packages'})
+        
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return cors_response(404, {'error': 'Connection not found'})
+        print(f"Error unsubscribing from package: {str(e)}")
+        return cors_response(500, {'error': 'Failed to unsubscribe'})
+    except Exception as e:
+        print(f"Error unsubscribing from package: {str(e)}")
+        return cors_response(500, {'error': 'Failed to unsubscribe'})
+
+def handle_subscribe_to_user_packages(connection_id):
+    """Watch every package sent by the connection's user, found through user-id-index on delivery"""
     try:
-        # Update connection with package subscription
         websocket_connections_table.update_item(
             Key={'connection_id': connection_id},
-            UpdateExpression='SET package_code = :package_code',
-            ExpressionAttributeValues={':package_code': package_code}
+            UpdateExpression='SET watch_all = :watch_all',
+            ConditionExpression='attribute_exists(connection_id) AND identity_verified = :verified',
+            ExpressionAttributeValues={':watch_all': True, ':verified': True}
         )
         
-        print(f"Connection {connection_id} subscribed to package {package_code}")
+        print(f"Connection {connection_id} subscribed to all packages of its user")
         
-        return cors_response(200, {'message': f'Subscribed to package {package_code}'})
+        return cors_response(200, {'message': 'Subscribed to all your packages'})
         
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return cors_response(403, {'error': 'Connect with a valid token to watch all your packages'})
+        print(f"Error subscribing to user packages: {str(e)}")
+        return cors_response(500, {'error': 'Failed to subscribe'})
     except Exception as e:
-        print(f"Error subscribing to package: {str(e)}")
+        print(f"Error subscribing to user packages: {str(e)}")
         return cors_response(500, {'error': 'Failed to subscribe'})
 
-def handle_unsubscribe_from_package(connection_id, package_code):
-    """Handle unsubscription from package updates"""
+def handle_unsubscribe_from_user_packages(connection_id):
+    """Stop watching all packages of the connection's user"""
     try:
-        # Remove package subscription
         websocket_connections_table.update_item(
             Key={'connection_id': connection_id},
-            UpdateExpression='REMOVE package_code'
+            UpdateExpression='REMOVE watch_all'
         )
         
-        print(f"Connection {connection_id} unsubscribed from package {package_code}")
+        print(f"Connection {connection_id} unsubscribed from all packages of its user")
         
-        return cors_response(200, {'message': f'Unsubscribed from package {package_code}'})
+        return cors_response(200, {'message': 'Unsubscribed from all your packages'})
         
     except Exception as e:
-        print(f"Error unsubscribing from package: {str(e)}")
+        print(f"Error unsubscribing from user packages: {str(e)}")
         return cors_response(500, {'error': 'Failed to unsubscribe'})
 
+def refresh_connection(connection_id):
+    """
+    Extend the TTL of a live connection. Its subscription rows are rewritten only
+    once their TTL (subscriptions_ttl) is past half its lifetime, so most pings
+    are a single write. Returns False if the connection item is gone.
+    """
+    now = int(time.time())
+    ttl = now + CONNECTION_TTL_SECONDS
+    try:
+        response = websocket_connections_table.update_item(
+            Key={'connection_id': connection_id},
+            UpdateExpression='SET #ttl = :ttl, last_seen_at = :now',
+            ConditionExpression='attribute_exists(connection_id)',
+            ExpressionAttributeNames={'#ttl': 'ttl'},
+            ExpressionAttributeValues={':ttl': ttl, ':now': now},
+            ReturnValues='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    
+    connection = response['Attributes']
+    package_codes = subscribed_codes(connection)
+    if package_codes and connection.get('subscriptions_ttl', 0) - now < CONNECTION_TTL_SECONDS // 2:
+        with websocket_subscriptions_table.batch_writer() as batch:
+            for package_code in package_codes:
+                batch.put_item(Item={
+                    'package_code': package_code,
+                    'connection_id': connection_id,
+                    'user_id': connection.get('user_id', 'anonymous'),
+                    'ttl': ttl
+                })
+        websocket_connections_table.update_item(
+            Key={'connection_id': connection_id},
+            UpdateExpression='SET subscriptions_ttl = :ttl',
+            ExpressionAttributeValues={':ttl': ttl}
+        )
+    return True
+
 def handle_ping(connection_id):
-    """Handle ping message"""
+    """Handle ping message, which also keeps the connection from expiring"""
     try:
+        # An expired connection no longer gets broadcasts; the client should reconnect
+        pong = {'action': 'pong', 'timestamp': datetime.now(timezone.utc).isoformat()}
+        if not refresh_connection(connection_id):
+            pong['reconnect'] = True
+        
         # Send pong response
-        send_websocket_message(connection_id, {'action': 'pong', 'timestamp': datetime.now(timezone.utc).isoformat()})
+        send_websocket_message(connection_id, pong)
         
         return cors_response(200, {'message': 'Pong'})
         
@@ -219,130 +769,259 @@ def handle_ping(connection_id):
         print(f"Error handling ping: {str(e)}")
         return cors_response(500, {'error': 'Failed to ping'})
 
-def send_websocket_message(connection_id, message):
-    """Send message to WebSocket connection"""
+def post_to_connection(connection_id, data):
+    """Push already serialized data to one connection: 'delivered', 'gone' or 'failed'"""
     try:
-        # Get WebSocket API endpoint from environment
-        endpoint = os.environ.get('WEBSOCKET_API_ENDPOINT')
-        if not endpoint:
-            print("WebSocket API endpoint not configured")
-            return False
-        
-        # Send message via API Gateway Management API
-        apigatewaymanagementapi.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps(message)
-        )
-        
-        print(f"Message sent to connection {connection_id}: {message}")
-        return True
-        
+        apigatewaymanagementapi.post_to_connection(ConnectionId=connection_id, Data=data)
+        return 'delivered'
     except ClientError as e:
         if e.response['Error']['Code'] == 'GoneException':
-            print(f"Connection {connection_id} is gone, removing from database")
-            websocket_connections_table.delete_item(Key={'connection_id': connection_id})
-        else:
-            print(f"Error sending WebSocket message: {str(e)}")
-        return False
+            return 'gone'
+        print(f"Error sending WebSocket message to {connection_id}: {str(e)}")
+        return 'failed'
     except Exception as e:
-        print(f"Error sending WebSocket message: {str(e)}")
+        print(f"Error sending WebSocket message to {connection_id}: {str(e)}")
+        return 'failed'
+
+def send_websocket_message(connection_id, message):
+    """Send message to WebSocket connection"""
+    # Get WebSocket API endpoint from environment
+    endpoint = os.environ.get('WEBSOCKET_API_ENDPOINT')
+    if not endpoint:
+        print("WebSocket API endpoint not configured")
         return False
+    
+    # Send message via API Gateway Management API
+    result = post_to_connection(connection_id, json.dumps(message))
+    if result == 'gone':
+        print(f"Connection {connection_id} is gone, removing from database")
+        try:
+            remove_connection(connection_id)
+        except Exception as e:
+            print(f"Error removing connection {connection_id}: {str(e)}")
+    return result == 'delivered'
 
-def broadcast_to_subscribers(package_code, message):
-    """Broadcast message to all subscribers of a package"""
+def delete_gone_connections(connection_ids, package_code=None):
+    """
+    Delete gone connections and all their subscription rows with BatchWriteItem.
+    Their subscriptions are read first with BatchGetItem; package_code, if given, is always included.
+    """
+    keys = [{'connection_id': connection_id} for connection_id in connection_ids]
+    connections = batch_get_items(websocket_connections_table, keys, 'connection_id, package_code, package_codes')
+    package_codes = {connection['connection_id']: subscribed_codes(connection) for connection in connections}
+    
+    with websocket_connections_table.batch_writer() as batch:
+        for connection_id in connection_ids:
+            batch.delete_item(Key={'connection_id': connection_id})
+    with websocket_subscriptions_table.batch_writer() as batch:
+        for connection_id in connection_ids:
+            codes = package_codes.get(connection_id, set())
+            if package_code:
+                codes = codes | {package_code}
+            for code in codes:
+                batch.delete_item(Key={'package_code': code, 'connection_id': connection_id})
+
+def probe_connection(connection_id):
+    """Check a connection with GetConnection without sending it anything: 'alive', 'gone' or 'failed'"""
     try:
-        # Find all connections subscribed to this package
-        response = websocket_connections_table.scan(
-            FilterExpression='package_code = :package_code',
-            ExpressionAttributeValues={':package_code': package_code}
-        )
-        
-        connections = response.get('Items', [])
-        
-        for connection in connections:
-            connection_id = connection['connection_id']
-            send_websocket_message(connection_id, message)
-        
-        print(f"Broadcasted message to {len(connections)} connections for package {package_code}")
-        
+        apigatewaymanagementapi.get_connection(ConnectionId=connection_id)
+        return 'alive'
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'GoneException':
+            return 'gone'
+        print(f"Error probing WebSocket connection {connection_id}: {str(e)}")
+        return 'failed'
     except Exception as e:
-        print(f"Error broadcasting to subscribers: {str(e)}")
+        print(f"Error probing WebSocket connection {connection_id}: {str(e)}")
+        return 'failed'
 
-def handle_package_created_notification(message_data):
-    """Handle package creation notification"""
-    try:
-        package_code = message_data.get('code')
-        user_id = message_data.get('user_id')
-        timestamp = message_data.get('timestamp')
-        
-        # Broadcast to WebSocket subscribers
-        websocket_message = {
-            'action': 'package_created',
-            'package_code': package_code,
-            'user_id': user_id,
-            'timestamp': timestamp,
-            'message': f'Package {package_code} has been created'
-        }
-        
-        broadcast_to_subscribers(package_code, websocket_message)
+def sweep_idle_connections(context):
+    """
+    Scheduled sweep: probe connections not seen for IDLE_CONNECTION_SECONDS and
+    delete the gone ones, with their subscription rows, in bulk. Stops early when
+    the invocation gets close to its timeout; the next run starts over.
+    """
+    if not os.environ.get('WEBSOCKET_API_ENDPOINT'):
+        print("WebSocket API endpoint not configured")
+        return {'probed': 0, 'gone': 0}
+    
+    scan_kwargs = {
+        'ProjectionExpression': 'connection_id',
+        'FilterExpression': 'attribute_not_exists(last_seen_at) OR last_seen_at < :idle_before',
+        'ExpressionAttributeValues': {':idle_before': int(time.time()) - IDLE_CONNECTION_SECONDS}
+    }
+    probed = 0
+    gone = 0
+    while True:
+        response = websocket_connections_table.scan(**scan_kwargs)
+        connection_ids = [connection['connection_id'] for connection in response.get('Items', [])]
         
-        # Log notification
-        print(f"Package creation notification sent for package {package_code}")
+        if connection_ids:
+            with ThreadPoolExecutor(max_workers=min(len(connection_ids), WEBSOCKET_PUSH_WORKERS)) as executor:
+                outcomes = list(executor.map(probe_connection, connection_ids))
+            gone_ids = [connection_id for connection_id, outcome in zip(connection_ids, outcomes) if outcome == 'gone']
+            if gone_ids:
+                delete_gone_connections(gone_ids)
+            probed += len(connection_ids)
+            gone += len(gone_ids)
         
-    except Exception as e:
-        print(f"Error handling package created notification: {str(e)}")
+        if 'LastEvaluatedKey' not in response:
+            break
+        if context and context.get_remaining_time_in_millis() < SWEEP_MIN_REMAINING_TIME_MS:
+            print("Stopping connection sweep before the Lambda timeout")
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    print(f"Connection sweep: probed {probed}, removed {gone}")
+    return {'probed': probed, 'gone': gone}
 
-def handle_track_updated_notification(message_data):
-    """Handle track update notification"""
-    try:
-        package_code = message_data.get('code')
-        action = message_data.get('action')
-        new_state = message_data.get('new_state')
-        timestamp = message_data.get('timestamp')
-        
-        # Broadcast to WebSocket subscribers
-        websocket_message = {
-            'action': 'package_track_updated',
-            'package_code': package_code,
-            'track_action': action,
-            'new_state': new_state,
-            'timestamp': timestamp,
-            'message': f'Package {package_code} status updated to {new_state}'
-        }
-        
-        broadcast_to_subscribers(package_code, websocket_message)
+def push_to_connections(connection_ids, message):
+    """
+    Push one message to many connections with a bounded thread pool.
+    Returns {'delivered': n, 'failed': n, 'gone': [connection ids]}.
+    """
+    data = json.dumps(message)
+    result = {'delivered': 0, 'failed': 0, 'gone': []}
+    if not connection_ids:
+        return result
+    
+    with ThreadPoolExecutor(max_workers=min(len(connection_ids), WEBSOCKET_PUSH_WORKERS)) as executor:
+        for connection_id, outcome in zip(connection_ids, executor.map(lambda connection_id: post_to_connection(connection_id, data), connection_ids)):
+            if outcome == 'gone':
+                result['gone'].append(connection_id)
+            else:
+                result[outcome] += 1
+    return result
+
+def broadcast_to_subscribers(package_code, message, watcher_ids=()):
+    """
+    Broadcast message to all subscribers of a package and to watcher_ids,
+    the connections watching all packages of its sender. Returns {'delivered', 'failed', 'gone'} counts. Errors looking up the
+    subscribers are raised so the SQS record is retried.
+    """
+    if not os.environ.get('WEBSOCKET_API_ENDPOINT'):
+        print("WebSocket API endpoint not configured")
+        return {'delivered': 0, 'failed': 0, 'gone': 0}
+    
+    # Subscribers of this package, one page at a time
+    query_kwargs = {
+        'KeyConditionExpression': 'package_code = :package_code',
+        'ExpressionAttributeValues': {':package_code': package_code},
+        'ProjectionExpression': 'connection_id'
+    }
+    connection_ids = []
+    while True:
+        response = websocket_subscriptions_table.query(**query_kwargs)
+        connection_ids.extend(subscription['connection_id'] for subscription in response.get('Items', []))
         
-        # Log notification
-        print(f"Track update notification sent for package {package_code}")
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    # A connection both subscribed and watching gets the message once
+    connection_ids = list(dict.fromkeys(connection_ids + list(watcher_ids)))
+    result = push_to_connections(connection_ids, message)
+    
+    # Stale connections are removed together once the fan-out is done
+    if result['gone']:
+        try:
+            delete_gone_connections(result['gone'], package_code)
+        except Exception as e:
+            print(f"Error removing gone connections for package {package_code}: {str(e)}")
+    
+    counts = {'delivered': result['delivered'], 'failed': result['failed'], 'gone': len(result['gone'])}
+    print(f"Broadcast to package {package_code}: {counts}")
+    return counts
+
+def handle_package_created_notification(message_data, watcher_ids=()):
+    """Handle package creation notification"""
+    package_code = message_data.get('code')
+    user_id = message_data.get('user_id')
+    timestamp = message_data.get('timestamp')
+    
+    # Broadcast to WebSocket subscribers
+    websocket_message = {
+        'action': 'package_created',
+        'package_code': package_code,
+        'user_id': user_id,
+        'timestamp': timestamp,
+        'message': f'Package {package_code} has been created'
+    }
+    
+    broadcast_to_subscribers(package_code, websocket_message, watcher_ids)
+    
+    # Log notification
+    print(f"Package creation notification sent for package {package_code}")
+
+def coalesce_track_updates(updates):
+    """
+    Track update events of one package -> (latest event, transitions oldest first).
+    Events from a batch list every action they applied, only the last one has a known state.
+    """
+    latest = None
+    transitions = []
+    seen_track_ids = set()
+    for update in sorted(updates, key=lambda update: update.get('timestamp') or ''):
+        # SQS may deliver the same event twice
+        if update.get('track_id') in seen_track_ids:
+            continue
+        seen_track_ids.add(update.get('track_id'))
         
-    except Exception as e:
-        print(f"Error handling track updated notification: {str(e)}")
+        actions = update.get('actions') or [update.get('action')]
+        track_ids = update.get('track_ids') or [update.get('track_id')]
+        for track_id, action in zip(track_ids[:-1], actions[:-1]):
+            transitions.append({'track_id': track_id, 'track_action': action, 'timestamp': update.get('timestamp')})
+        transitions.append({
+            'track_id': track_ids[-1],
+            'track_action': actions[-1],
+            'new_state': update.get('new_state'),
+            'timestamp': update.get('timestamp')
+        })
+        latest = update
+    return latest, transitions
+
+def handle_track_updated_notification(package_code, updates, watcher_ids=()):
+    """Handle the track update notifications of one package as a single broadcast"""
+    latest, transitions = coalesce_track_updates(updates)
+    new_state = latest.get('new_state')
+    
+    # Broadcast the final state with the transitions that led to it
+    websocket_message = {
+        'action': 'package_track_updated',
+        'package_code': package_code,
+        'track_action': latest.get('action'),
+        'new_state': new_state,
+        'timestamp': latest.get('timestamp'),
+        'transitions': transitions,
+        'message': f'Package {package_code} status updated to {new_state}'
+    }
+    
+    broadcast_to_subscribers(package_code, websocket_message, watcher_ids)
+    
+    # Log notification
+    print(f"Track update notification sent for package {package_code} ({len(transitions)} transitions)")
 
-def handle_image_uploaded_notification(message_data):
+def handle_image_uploaded_notification(message_data, watcher_ids=()):
     """Handle image upload notification"""
-    try:
-        package_code = message_data.get('code')
-        purpose = message_data.get('purpose')
-        timestamp = message_data.get('timestamp')
-        user_id = message_data.get('user_id')
-        
-        # Broadcast to WebSocket subscribers
-        websocket_message = {
-            'action': 'image_uploaded',
-            'package_code': package_code,
-            'purpose': purpose,
-            'user_id': user_id,
-            'timestamp': timestamp,
-            'message': f'Image uploaded for package {package_code}'
-        }
-        
-        broadcast_to_subscribers(package_code, websocket_message)
-        
-        # Log notification
-        print(f"Image upload notification sent for package {package_code}")
-        
-    except Exception as e:
-        print(f"Error handling image uploaded notification: {str(e)}")
+    package_code = message_data.get('code')
+    purpose = message_data.get('purpose')
+    timestamp = message_data.get('timestamp')
+    user_id = message_data.get('user_id')
+    
+    # Broadcast to WebSocket subscribers
+    websocket_message = {
+        'action': 'image_uploaded',
+        'package_code': package_code,
+        'purpose': purpose,
+        'user_id': user_id,
+        'timestamp': timestamp,
+        'message': f'Image uploaded for package {package_code}'
+    }
+    
+    broadcast_to_subscribers(package_code, websocket_message, watcher_ids)
+    
+    # Log notification
+    print(f"Image upload notification sent for package {package_code}")
 
 def log_notification(notification_type, data):
     """Log notification for audit purposes"""
@@ -1,20 +1,71 @@
 import json
+import hashlib
 import boto3
 import uuid
+import base64
 from datetime import datetime
 from decimal import Decimal
 from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeDeserializer
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
 sns = boto3.client('sns')
+deserializer = TypeDeserializer()
 
 # Table references
 packages_table = dynamodb.Table('package-tracking-packages')
 tracks_table = dynamodb.Table('package-tracking-tracks')
 addresses_table = dynamodb.Table('package-tracking-addresses')
 users_table = dynamodb.Table('package-tracking-users')
+package_codes_table = dynamodb.Table('package-tracking-package-codes')
+idempotency_table = dynamodb.Table('package-tracking-idempotency')
+
+# Package code allocation: codes are PACKAGE_CODE_BASE + counter value. Each
+# container leases a block of counter values and hands them out locally.
+PACKAGE_CODE_BASE = 10000000
+PACKAGE_CODE_COUNTER_KEY = 'COUNTER'
+PACKAGE_CODE_BLOCK_SIZE = int(os.environ.get('PACKAGE_CODE_BLOCK_SIZE', '100'))
+PACKAGE_CODE_MAX_ATTEMPTS = 5
+
+# GET /packages/ pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Stop reading pages when the invocation gets this close to its timeout
+MIN_REMAINING_TIME_MS = 3000
+
+# Parallel scan used for admin-wide listings
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '8'))
+MAX_SCAN_SEGMENTS = 64
+MAX_SCAN_WORKERS = 8
+
+# POST /packages/batch
+MAX_BATCH_PACKAGES = 500
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+BATCH_WRITE_WORKERS = 4
+SNS_BATCH_SIZE = 10
+# BatchWriteItem errors worth retrying as a whole; any other rejects the request
+# because of one of its items, which are then written one by one
+BATCH_WRITE_RETRYABLE_ERRORS = {
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded', 'InternalServerError'
+}
+
+# SNS event envelope, bumped on incompatible changes to an event's data
+EVENT_VERSION = 1
+
+# Idempotency-Key handling for POSTs retried by clients
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LOCK_SECONDS = 30
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Leased block, kept across warm invocations of this container
+code_block = {'next': 0, 'end': 0}
+code_block_lock = threading.Lock()
 
 def convert_decimals_to_float(obj):
     """Convert Decimal objects to float for JSON serialization"""
@@ -27,7 +78,24 @@ def convert_decimals_to_float(obj):
     else:
         return obj
 
-def cors_response(status_code, body=None):
+def build_event(event_type, event_id, data):
+    """Versioned SNS event envelope, the same in every producer"""
+    return {
+        'event_id': event_id,
+        'event_type': event_type,
+        'event_version': EVENT_VERSION,
+        'occurred_at': datetime.utcnow().isoformat(),
+        'data': data
+    }
+
+def event_attributes(event):
+    """SNS message attributes of an event, matched by the queue subscription filter policies"""
+    return {
+        'event_type': {'DataType': 'String', 'StringValue': event['event_type']},
+        'event_version': {'DataType': 'Number', 'StringValue': str(event['event_version'])}
+    }
+
+def cors_response(status_code, body=None, headers=None):
     """
     Create a CORS-enabled response
     """
@@ -39,18 +107,116 @@ def cors_response(status_code, body=None):
         }
     }
 
+    if headers:
+        response['headers'].update(headers)
+
     if body is not None:
         body = convert_decimals_to_float(body)
         response['body'] = json.dumps(body)
 
     return response
     
+def get_header(event, name):
+    """Case-insensitive request header lookup"""
+    for header, value in (event.get('headers') or {}).items():
+        if header.lower() == name.lower():
+            return value
+    return None
+
+def replay_idempotent_response(record, request_hash):
+    """Answer a request whose Idempotency-Key is already taken"""
+    if record.get('request_hash') != request_hash:
+        return cors_response(422, {'error': 'Idempotency-Key was already used with a different request'})
+    if record.get('status') != 'COMPLETED':
+        return cors_response(409, {'error': 'A request with this Idempotency-Key is still in progress'}, {'Retry-After': '1'})
+
+    response = json.loads(record['response'])
+    response['headers']['Idempotent-Replayed'] = 'true'
+    response['headers']['Access-Control-Expose-Headers'] = 'Idempotent-Replayed'
+    return response
+
+def run_idempotent(event, user_id, scope, operation):
+    """
+    Run operation() at most once per Idempotency-Key header (per user and route).
+    The first response is stored in the idempotency table and replayed to
+    retries, which cost one get_item. Concurrent requests with the same key are
+    collapsed by a conditional put; the loser gets 409 until the first finishes.
+    5xx responses are not stored, so the client can retry them for real.
+    """
+    key = get_header(event, 'Idempotency-Key')
+    if key is None:
+        return operation()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return cors_response(400, {'error': f'Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'})
+
+    record_key = f"{user_id or 'anon'}#{scope}#{key}"
+    request_hash = hashlib.sha256((event.get('body') or '').encode('utf-8')).hexdigest()
+    now = int(time.time())
+
+    # Retries of a finished request: one read, no writes
+    record = idempotency_table.get_item(Key={'idempotency_key': record_key}).get('Item')
+    if record and record['expires_at'] > now and (record['status'] == 'COMPLETED' or record['locked_until'] > now):
+        return replay_idempotent_response(record, request_hash)
+
+    # Claim the key. Expired records (TTL deletion lags) and locks left by a
+    # crashed invocation can be taken over.
+    locked_until = now + IDEMPOTENCY_LOCK_SECONDS
+    try:
+        idempotency_table.put_item(
+            Item={
+                'idempotency_key': record_key,
+                'status': 'IN_PROGRESS',
+                'request_hash': request_hash,
+                'locked_until': locked_until,
+                'expires_at': now + IDEMPOTENCY_TTL_SECONDS
+            },
+            ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at < :now '
+                                'OR (#status = :in_progress AND locked_until < :now)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':now': now, ':in_progress': 'IN_PROGRESS'},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        record = {name: deserializer.deserialize(value) for name, value in e.response.get('Item', {}).items()}
+        return replay_idempotent_response(record, request_hash)
+
+    def release():
+        idempotency_table.delete_item(
+            Key={'idempotency_key': record_key},
+            ConditionExpression='locked_until = :locked_until',
+            ExpressionAttributeValues={':locked_until': locked_until}
+        )
+
+    try:
+        response = operation()
+    except Exception:
+        release()
+        raise
+
+    if response['statusCode'] >= 500:
+        release()
+    else:
+        idempotency_table.update_item(
+            Key={'idempotency_key': record_key},
+            UpdateExpression='SET #status = :completed, #response = :response REMOVE locked_until',
+            ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+            ExpressionAttributeValues={':completed': 'COMPLETED', ':response': json.dumps(response)}
+        )
+    return response
+
 def lambda_handler(event, context):
     """
-    Handle package-related API requests
-    Routes: GET /packages/, POST /packages/, GET /packages/{code}/
+    Handle package-related API requests and the packages table stream
+    Routes: GET /packages/, POST /packages/, POST /packages/batch, GET /packages/{code}/
     """
     
+    # Packages table stream: publish creation events. Errors are raised, not
+    # turned into a 500 response, which Lambda would take as the batch succeeding
+    if event.get('Records') and event['Records'][0].get('eventSource') == 'aws:dynamodb':
+        return handle_stream_event(event)
+
     try:
         user_id = None
         user_email = None
@@ -65,18 +231,26 @@ def lambda_handler(event, context):
             user_email = claims.get('email')
             user_role = claims.get('custom:role', 'user')
 
-        query_parameters = event.get('queryStringParameters', {})
+        query_parameters = event.get('queryStringParameters') or {}
         
         # Route to appropriate handler
         if http_method == 'GET' and not path_parameters:
             if user_role == 'anon':
                 return cors_response(401, {'error': 'Authentication required'})
-            return get_packages_list(query_parameters, user_id, user_role)
+            return get_packages_list(query_parameters, user_id, user_role, context)
+
+        elif http_method == 'POST' and not path_parameters and event.get('path', '').rstrip('/').endswith('/batch'):
+            if user_role == 'anon':
+                return cors_response(401, {'error': 'Authentication required'})
+            return create_packages_batch(json.loads(event['body']), user_id, user_email)
 
         elif http_method == 'POST' and not path_parameters:
             if user_role == 'anon':
                 return cors_response(401, {'error': 'Authentication required'})
-            return create_package(json.loads(event['body']), user_id, user_email)
+            return run_idempotent(
+                event, user_id, 'POST /packages',
+                lambda: create_package(json.loads(event['body']), user_id, user_email)
+            )
 
         elif http_method == 'GET' and path_parameters.get('code'):
             # public endpoint
@@ -89,90 +263,317 @@ def lambda_handler(event, context):
         print(f"Error in packages_handler: {str(e)}")
         return cors_response(500, {'error': 'Internal server error'})
 
-def get_packages_list(query_params, user_id, user_role):
-    """Get list of packages with optional filtering"""
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque continuation token"""
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on malformed tokens"""
     try:
-        # If user is not admin, only show their packages
-        if user_role != 'admin':
-            response = packages_table.query(
-                IndexName='sender-index',
-                KeyConditionExpression='sender_id = :sender_id',
-                ExpressionAttributeValues={':sender_id': user_id}
-            )
-        else:
-            # Admin can see all packages
-            response = packages_table.scan()
-        
-        packages = response['Items']
-        
-        # Convert Decimal to float for JSON serialization
-        for package in packages:
-            if 'weight' in package and package['weight']:
-                package['weight'] = float(package['weight'])
-        
-        return cors_response(200, packages)
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(value, dict):
+        raise ValueError('Invalid cursor')
+    return value
+
+def parse_page_size(value):
+    """Validate the limit query parameter"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+def parse_scan_state(cursor):
+    """
+    Validate a parallel scan cursor:
+    {'total_segments': N, 'segments': {'<segment>': <start key or None>}}
+    Only unfinished segments are listed.
+    """
+    total_segments = cursor.get('total_segments')
+    segments = cursor.get('segments')
+    if not isinstance(total_segments, int) or not 1 <= total_segments <= MAX_SCAN_SEGMENTS:
+        raise ValueError('Invalid cursor')
+    if not isinstance(segments, dict) or not segments:
+        raise ValueError('Invalid cursor')
+
+    state = {}
+    for segment, start_key in segments.items():
+        if not segment.isdigit() or int(segment) >= total_segments:
+            raise ValueError('Invalid cursor')
+        if start_key is not None and not isinstance(start_key, dict):
+            raise ValueError('Invalid cursor')
+        state[int(segment)] = start_key
+    return total_segments, state
+
+def parallel_scan(table, segments, total_segments, page_size=None, **scan_kwargs):
+    """
+    Scan the given segments concurrently on a bounded thread pool.
+    `segments` maps segment number -> ExclusiveStartKey (None = from the start).
+    Yields (segment, items, last_evaluated_key) as soon as each page arrives and
+    keeps following a segment until DynamoDB stops returning LastEvaluatedKey.
+    """
+    def read_page(segment, start_key):
+        kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        if page_size:
+            kwargs['Limit'] = page_size
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = table.scan(**kwargs)
+        return segment, response['Items'], response.get('LastEvaluatedKey')
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(segments), MAX_SCAN_WORKERS)))
+    try:
+        pending = {executor.submit(read_page, segment, start_key) for segment, start_key in segments.items()}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                segment, items, last_key = future.result()
+                if last_key:
+                    pending.add(executor.submit(read_page, segment, last_key))
+                yield segment, items, last_key
+    finally:
+        # Consumer may stop early: drop queued page reads
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def scan_packages_page(limit, cursor, context):
+    """
+    Read up to `limit` packages with a parallel segmented scan.
+    Returns the items and the merged cursor of all unfinished segments (None when done).
+    """
+    if cursor:
+        total_segments, segments = parse_scan_state(cursor)
+    else:
+        total_segments = SCAN_SEGMENTS
+        segments = {segment: None for segment in range(total_segments)}
+
+    page_size = max(1, -(-limit // len(segments)))
+    packages = []
+    pages = parallel_scan(packages_table, segments, total_segments, page_size)
+    try:
+        for segment, items, last_key in pages:
+            room = limit - len(packages)
+            if len(items) > room:
+                # Keep the page exact: resume this segment right after the last item we return
+                items = items[:room]
+                last_key = {'package_id': items[-1]['package_id']}
+
+            packages.extend(items)
+            if last_key:
+                segments[segment] = last_key
+            else:
+                del segments[segment]
+
+            if len(packages) >= limit:
+                break
+            if context and context.get_remaining_time_in_millis() < MIN_REMAINING_TIME_MS:
+                break
+    finally:
+        pages.close()
+
+    next_cursor = None
+    if segments:
+        next_cursor = {
+            'total_segments': total_segments,
+            'segments': {str(segment): start_key for segment, start_key in segments.items()}
+        }
+    return packages, next_cursor
+
+def query_sender_packages_page(user_id, limit, cursor, context):
+    """Read up to `limit` packages of one sender through sender-index"""
+    if cursor and not all(isinstance(value, str) for value in cursor.values()):
+        raise ValueError('Invalid cursor')
+
+    query_kwargs = {
+        'IndexName': 'sender-index',
+        'KeyConditionExpression': 'sender_id = :sender_id',
+        'ExpressionAttributeValues': {':sender_id': user_id}
+    }
+
+    packages = []
+    last_key = cursor
+    while True:
+        query_kwargs['Limit'] = limit - len(packages)
+        if last_key:
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+        response = packages_table.query(**query_kwargs)
+        packages.extend(response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+
+        if not last_key or len(packages) >= limit:
+            break
+        # Hand back what we have instead of running into the Lambda timeout
+        if context and context.get_remaining_time_in_millis() < MIN_REMAINING_TIME_MS:
+            break
+
+    return packages, last_key
+
+def get_packages_list(query_params, user_id, user_role, context=None):
+    """
+    Get one page of packages.
+    Query params: limit (page size) and cursor (token from the previous page).
+    The token for the next page is returned in the X-Next-Cursor header.
+    """
+    try:
+        try:
+            limit = parse_page_size(query_params.get('limit'))
+            cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+
+            try:
+                # If user is not admin, only show their packages
+                if user_role != 'admin':
+                    packages, next_cursor = query_sender_packages_page(user_id, limit, cursor, context)
+                else:
+                    # Admin can see all packages
+                    packages, next_cursor = scan_packages_page(limit, cursor, context)
+            except ClientError as e:
+                if cursor and e.response['Error']['Code'] == 'ValidationException':
+                    raise ValueError('Invalid cursor')
+                raise
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+
+        headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+        if next_cursor:
+            headers['X-Next-Cursor'] = encode_cursor(next_cursor)
+
+        return cors_response(200, packages, headers)
         
     except Exception as e:
         print(f"Error getting packages list: {str(e)}")
         return cors_response(500, {'error': 'Failed to retrieve packages'})
 
+def validate_package_data(package_data):
+    """Return an error message for invalid package data, None if it is valid"""
+    if not isinstance(package_data, dict):
+        return 'Package must be an object'
+
+    required_fields = ['origin', 'destination', 'receiver_name', 'receiver_email']
+    for field in required_fields:
+        if field not in package_data:
+            return f'Missing required field: {field}'
+
+    if package_data.get('weight'):
+        try:
+            Decimal(str(package_data['weight']))
+        except ArithmeticError:
+            return 'Invalid weight'
+
+    return None
+
+def build_package_item(package_data, package_id, package_code, track_item, user_id):
+    """Package item as stored in DynamoDB, with its first track as latest_track"""
+    return {
+        'package_id': package_id,
+        'code': package_code,
+        'origin': package_data['origin'],
+        'destination': package_data['destination'],
+        'sender_id': user_id,
+        'receiver_name': package_data['receiver_name'],
+        'receiver_email': package_data['receiver_email'],
+        'size': package_data.get('size'),
+        'weight': Decimal(str(package_data['weight'])) if package_data.get('weight') else None,
+        'state': 'CREATED',
+        'latest_track': track_item,
+        'created_at': datetime.utcnow().isoformat(),
+        'updated_at': datetime.utcnow().isoformat()
+    }
+
+def build_create_track_item(package_id):
+    """Initial CREATE track for a new package"""
+    return {
+        'track_id': str(uuid.uuid4()),
+        'package_id': package_id,
+        'timestamp': datetime.utcnow().isoformat(),
+        'action': 'CREATE',
+        'depot_id': None,
+        'comment': "Package created"
+    }
+
+def build_package_created_message(package_id, package_code, user_id, timestamp=None):
+    """
+    SNS event for a created package. The event id is derived from the package,
+    so republishing after a stream retry lets consumers drop the duplicate.
+    """
+    return build_event('package_created', f'package_created:{package_id}', {
+        'package_id': package_id,
+        'code': package_code,
+        'user_id': user_id,
+        'timestamp': timestamp or datetime.utcnow().isoformat()
+    })
+
+def from_attribute_values(image):
+    """DynamoDB attribute value map (e.g. a stream image) -> Python dict"""
+    return {key: deserializer.deserialize(value) for key, value in image.items()}
+
+def save_new_package(package_item, track_item):
+    """
+    Write the code registry item, the package and its CREATE track in a single
+    TransactWriteItems call. Returns False if the package code was already taken.
+    The resource's client (de)serializes attribute values like Table does.
+    """
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=[
+            {
+                'Put': {
+                    'TableName': package_codes_table.name,
+                    'Item': {
+                        'code': package_item['code'],
+                        'package_id': package_item['package_id'],
+                        'created_at': package_item['created_at']
+                    },
+                    'ConditionExpression': 'attribute_not_exists(code)'
+                }
+            },
+            {
+                'Put': {
+                    'TableName': packages_table.name,
+                    'Item': package_item,
+                    'ConditionExpression': 'attribute_not_exists(package_id)'
+                }
+            },
+            {
+                'Put': {
+                    'TableName': tracks_table.name,
+                    'Item': track_item
+                }
+            }
+        ])
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'TransactionCanceledException':
+            reasons = e.response.get('CancellationReasons', [])
+            if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                return False
+        raise
+
 def create_package(package_data, user_id, user_email):
     """Create a new package"""
     try:
         # Validate required fields
-        required_fields = ['origin', 'destination', 'receiver_name', 'receiver_email']
-        for field in required_fields:
-            if field not in package_data:
-                return cors_response(400, {'error': f'Missing required field: {field}'})
-        
-        # Generate unique package code
-        package_code = generate_package_code()
+        error = validate_package_data(package_data)
+        if error:
+            return cors_response(400, {'error': error})
         
-        # Create package item
         package_id = str(uuid.uuid4())
-        package_item = {
-            'package_id': package_id,
-            'code': package_code,
-            'origin': package_data['origin'],
-            'destination': package_data['destination'],
-            'sender_id': user_id,
-            'receiver_name': package_data['receiver_name'],
-            'receiver_email': package_data['receiver_email'],
-            'size': package_data.get('size'),
-            'weight': Decimal(str(package_data['weight'])) if package_data.get('weight') else None,
-            'state': 'CREATED',
-            'created_at': datetime.utcnow().isoformat(),
-            'updated_at': datetime.utcnow().isoformat()
-        }
-        
-        # Save to DynamoDB
-        packages_table.put_item(Item=package_item)
-        
-        track_item = {
-            'track_id': str(uuid.uuid4()),
-            'package_id': package_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'action': 'CREATE',
-            'depot_id': None,
-            'comment': "Package created"
-        }
-
-        tracks_table.put_item(Item=track_item)
+        track_item = build_create_track_item(package_id)
 
-        # Publish to SNS for notifications
-        sns_message = {
-            'package_id': package_id,
-            'code': package_code,
-            'user_id': user_id,
-            'action': 'package_created',
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
-        sns.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(sns_message),
-            Subject='Package Created'
-        )
+        # Package, code registry entry and CREATE track are written atomically.
+        # The package_created event is published from the table stream.
+        for _ in range(PACKAGE_CODE_MAX_ATTEMPTS):
+            package_item = build_package_item(package_data, package_id, allocate_package_codes(1)[0], track_item, user_id)
+            if save_new_package(package_item, track_item):
+                break
+            print(f"Package code {package_item['code']} already taken, trying next one")
+        else:
+            raise Exception('Could not reserve a unique package code')
         
         # Convert Decimal to float for response
         if package_item['weight']:
@@ -184,6 +585,258 @@ def create_package(package_data, user_id, user_email):
         print(f"Error creating package: {str(e)}")
         return cors_response(500, {'error': str(e)})
 
+def write_individually(requests):
+    """Apply (table_name, write request) pairs one at a time; returns the ones that failed"""
+    failed = []
+    for table_name, request in requests:
+        table = dynamodb.Table(table_name)
+        try:
+            if 'PutRequest' in request:
+                table.put_item(Item=request['PutRequest']['Item'])
+            else:
+                table.delete_item(Key=request['DeleteRequest']['Key'])
+        except ClientError as e:
+            print(f"Write to {table_name} failed: {str(e)}")
+            failed.append((table_name, request))
+    return failed
+
+def batch_write_chunk(requests):
+    """
+    Apply up to BATCH_WRITE_SIZE (table_name, write request) pairs, PutRequest
+    or DeleteRequest, with one BatchWriteItem, retrying UnprocessedItems and
+    throttling with exponential backoff. When the request is rejected for
+    another reason, its items are written one by one so only the bad one fails.
+    Returns the requests that could not be applied.
+    """
+    request_items = {}
+    for table_name, request in requests:
+        request_items.setdefault(table_name, []).append(request)
+
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(min(1.0, 0.05 * 2 ** attempt))
+        try:
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+        except ClientError as e:
+            print(f"BatchWriteItem failed: {str(e)}")
+            if e.response['Error']['Code'] in BATCH_WRITE_RETRYABLE_ERRORS:
+                continue
+            return write_individually([
+                (table_name, request) for table_name, table_requests in request_items.items() for request in table_requests
+            ])
+
+        request_items = response.get('UnprocessedItems') or {}
+        if not request_items:
+            return []
+
+    return [(table_name, request) for table_name, table_requests in request_items.items() for request in table_requests]
+
+def batch_write(requests):
+    """Apply (table_name, write request) pairs in BatchWriteItem chunks; returns the failed ones"""
+    chunks = [requests[i:i + BATCH_WRITE_SIZE] for i in range(0, len(requests), BATCH_WRITE_SIZE)]
+    if not chunks:
+        return []
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(len(chunks), BATCH_WRITE_WORKERS)) as executor:
+        for chunk_failed in executor.map(batch_write_chunk, chunks):
+            failed.extend(chunk_failed)
+    return failed
+
+def put_request(table, item):
+    """(table_name, write request) putting item"""
+    return table.name, {'PutRequest': {'Item': item}}
+
+def delete_request(table, key):
+    """(table_name, write request) deleting key"""
+    return table.name, {'DeleteRequest': {'Key': key}}
+
+def publish_batch(messages, subject):
+    """
+    Publish (entry_id, event) pairs with SNS PublishBatch, 10 per call.
+    Returns the ids of the entries that were not published.
+    """
+    failed_ids = []
+    for start in range(0, len(messages), SNS_BATCH_SIZE):
+        chunk = messages[start:start + SNS_BATCH_SIZE]
+        try:
+            response = sns.publish_batch(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                PublishBatchRequestEntries=[
+                    {
+                        'Id': entry_id,
+                        'Message': json.dumps(event),
+                        'Subject': subject,
+                        'MessageAttributes': event_attributes(event)
+                    }
+                    for entry_id, event in chunk
+                ]
+            )
+            failed_ids.extend(entry['Id'] for entry in response.get('Failed', []))
+        except Exception as e:
+            print(f"Error publishing SNS batch: {str(e)}")
+            failed_ids.extend(entry_id for entry_id, _ in chunk)
+    return failed_ids
+
+def reserve_package_code(package_item):
+    """
+    Register the package's code, unless another package already holds it.
+    Returns False if the code was already taken, like save_new_package.
+    """
+    try:
+        package_codes_table.put_item(
+            Item={
+                'code': package_item['code'],
+                'package_id': package_item['package_id'],
+                'created_at': package_item['created_at']
+            },
+            ConditionExpression='attribute_not_exists(code)'
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def reserve_batch_package(package_data, package_code, user_id):
+    """
+    Build a batch package and reserve its code, taking the next code when the
+    allocated one is already taken. Returns (package_item, track_item).
+    """
+    package_id = str(uuid.uuid4())
+    track_item = build_create_track_item(package_id)
+
+    for _ in range(PACKAGE_CODE_MAX_ATTEMPTS):
+        package_item = build_package_item(package_data, package_id, package_code, track_item, user_id)
+        if reserve_package_code(package_item):
+            return package_item, track_item
+        print(f"Package code {package_code} already taken, trying next one")
+        package_code = allocate_package_codes(1)[0]
+
+    raise Exception('Could not reserve a unique package code')
+
+def create_packages_batch(batch_data, user_id, user_email):
+    """
+    Create many packages in one request.
+    Body: {"packages": [...]} with the same fields as POST /packages/.
+    Every package is validated first and codes are allocated in one step.
+    Codes are reserved with conditional puts, as in save_new_package; then the
+    CREATE tracks and finally the packages are written with BatchWriteItem.
+    A package is only written once its code and track are, so a stored package
+    is always complete; any failed write fails just that package, and its code
+    and track are deleted again.
+    Creation events go out from the packages table stream (handle_stream_event).
+    The response lists the outcome of each package by its index in the request.
+    """
+    try:
+        packages_data = batch_data.get('packages') if isinstance(batch_data, dict) else None
+        if not isinstance(packages_data, list) or not packages_data:
+            return cors_response(400, {'error': 'packages must be a non-empty list'})
+        if len(packages_data) > MAX_BATCH_PACKAGES:
+            return cors_response(400, {'error': f'At most {MAX_BATCH_PACKAGES} packages per batch'})
+
+        results = [None] * len(packages_data)
+        valid_indexes = []
+        for index, package_data in enumerate(packages_data):
+            error = validate_package_data(package_data)
+            if error:
+                results[index] = {'index': index, 'status': 'failed', 'error': error}
+            else:
+                valid_indexes.append(index)
+
+        def fail(index, error):
+            results[index] = {'index': index, 'status': 'failed', 'error': error}
+
+        # Code registry first: a package never goes out with a duplicate code
+        reserved = {}
+        if valid_indexes:
+            package_codes = allocate_package_codes(len(valid_indexes))
+            with ThreadPoolExecutor(max_workers=min(len(valid_indexes), BATCH_WRITE_WORKERS)) as executor:
+                futures = {
+                    index: executor.submit(reserve_batch_package, packages_data[index], package_code, user_id)
+                    for index, package_code in zip(valid_indexes, package_codes)
+                }
+            for index, future in futures.items():
+                try:
+                    reserved[index] = future.result()
+                except Exception as e:
+                    print(f"Error reserving package code for batch index {index}: {str(e)}")
+                    fail(index, 'Failed to reserve package code')
+
+        # Then the CREATE tracks, and only the packages whose track was saved
+        failed_track_ids = {
+            request['PutRequest']['Item']['package_id'] for _, request in
+            batch_write([put_request(tracks_table, track_item) for _, track_item in reserved.values()])
+        }
+        failed_package_ids = {
+            request['PutRequest']['Item']['package_id'] for _, request in
+            batch_write([
+                put_request(packages_table, package_item) for package_item, _ in reserved.values()
+                if package_item['package_id'] not in failed_track_ids
+            ])
+        }
+
+        # Whatever was written for a failed package is removed again
+        cleanup = []
+        for index, (package_item, track_item) in list(reserved.items()):
+            if package_item['package_id'] in failed_track_ids:
+                fail(index, 'Failed to save package track')
+            elif package_item['package_id'] in failed_package_ids:
+                fail(index, 'Failed to save package')
+                cleanup.append(delete_request(tracks_table, {'track_id': track_item['track_id']}))
+            else:
+                continue
+            cleanup.append(delete_request(package_codes_table, {'code': package_item['code']}))
+            del reserved[index]
+        for table_name, request in batch_write(cleanup):
+            print(f"Could not remove {request['DeleteRequest']['Key']} from {table_name} after a failed package")
+
+        # package_created events are published from the packages table stream
+        for index, (package_item, _) in reserved.items():
+            results[index] = {'index': index, 'status': 'created', 'package': package_item}
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        return cors_response(201 if created == len(results) else 207, {
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        })
+
+    except Exception as e:
+        print(f"Error creating packages batch: {str(e)}")
+        return cors_response(500, {'error': 'Failed to create packages'})
+
+def handle_stream_event(event):
+    """
+    Publish package_created for every package inserted in the packages table.
+    Publishing from the stream keeps SNS off the request path, and a package
+    that is stored always gets its event. Failed entries are reported back so
+    Lambda retries from the first one.
+    """
+    messages = []
+    unreadable_ids = []
+    for record in event['Records']:
+        if record.get('eventName') != 'INSERT':
+            continue
+
+        sequence_number = record['dynamodb']['SequenceNumber']
+        try:
+            package = from_attribute_values(record['dynamodb']['NewImage'])
+            messages.append((
+                sequence_number,
+                build_package_created_message(package['package_id'], package['code'], package.get('sender_id'), package.get('created_at'))
+            ))
+        except Exception as e:
+            # Retried like a failed publish; event ids make the republished events duplicates
+            print(f"Error reading stream record {sequence_number}: {str(e)}")
+            unreadable_ids.append(sequence_number)
+
+    failed_ids = unreadable_ids + publish_batch(messages, 'Package Created')
+    if failed_ids:
+        print(f"Failed to publish {len(failed_ids)} package_created events")
+
+    return {'batchItemFailures': [{'itemIdentifier': sequence_number} for sequence_number in failed_ids]}
+
 def get_package_by_code(package_code, user_id, user_role):
     """Get package details by code"""
     try:
@@ -214,47 +867,29 @@ def get_package_by_code(package_code, user_id, user_role):
         print(f"Error getting package by code: {str(e)}")
         return cors_response(500, {'error': 'Failed to retrieve package'})
 
-def generate_package_code():
-    """Generate unique 8-digit package code"""
-    try:
-        # Get the last package to determine next code
-        response = packages_table.scan(
-            ProjectionExpression='code',
-            Limit=1
-        )
-        
-        if not response['Items']:
-            # First package
-            return '10000000'
-        
-        # Find the highest code
-        max_code = 10000000
-        for item in response['Items']:
-            try:
-                code_num = int(item['code'])
-                if code_num > max_code:
-                    max_code = code_num
-            except ValueError:
-                continue
-        
-        # Generate next code
-        next_code = max_code + 1
-        
-        # Verify code doesn't exist (handle race conditions)
-        while True:
-            code_str = str(next_code).zfill(8)
-            check_response = packages_table.query(
-                IndexName='code-index',
-                KeyConditionExpression='code = :code',
-                ExpressionAttributeValues={':code': code_str}
-            )
-            
-            if not check_response['Items']:
-                return code_str
-            
-            next_code += 1
-            
-    except Exception as e:
-        print(f"Error generating package code: {str(e)}")
-        # Fallback to UUID-based code
-        return str(uuid.uuid4())[:8].upper()
+def lease_code_block(size):
+    """Reserve `size` consecutive counter values with one atomic ADD"""
+    response = package_codes_table.update_item(
+        Key={'code': PACKAGE_CODE_COUNTER_KEY},
+        UpdateExpression='ADD next_value :size',
+        ExpressionAttributeValues={':size': size},
+        ReturnValues='UPDATED_NEW'
+    )
+    block_end = int(response['Attributes']['next_value'])
+    return block_end - size, block_end
+
+def allocate_package_codes(count):
+    """Take `count` codes from this container's block, leasing a new one when it runs out"""
+    codes = []
+    with code_block_lock:
+        while len(codes) < count:
+            if code_block['next'] >= code_block['end']:
+                missing = count - len(codes)
+                code_block['next'], code_block['end'] = lease_code_block(max(PACKAGE_CODE_BLOCK_SIZE, missing))
+
+            take = min(count - len(codes), code_block['end'] - code_block['next'])
+            for value in range(code_block['next'], code_block['next'] + take):
+                codes.append(str(PACKAGE_CODE_BASE + value).zfill(8))
+            code_block['next'] += take
+
+    return codes
@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
 from zipfile import ZipFile
 
@@ -8,6 +9,10 @@ from zipfile import ZipFile
 # CONFIG
 # -----------------------------
 LAMBDA_DIR = "packaged"
+# Must match envs/dev/lambda.tf (runtime) and modules/lambda-api (architectures):
+# dependencies with native code such as Pillow need wheels built for Lambda, not this machine
+LAMBDA_PLATFORM = "manylinux2014_aarch64"
+LAMBDA_PYTHON_VERSION = "3.12"
 FUNCTIONS = [
     ("packages_handler", "packages_handler.py"),
     ("tracks_handler", "tracks_handler.py"),
@@ -22,9 +27,9 @@ FUNCTIONS = [
 # SCRIPT
 # -----------------------------
 def run(cmd):
-    """Run shell command with visible output and error handling"""
+    """Run command with visible output and error handling"""
     print(f"$ {' '.join(cmd)}")
-    subprocess.run(cmd, check=True, shell=True)
+    subprocess.run(cmd, check=True)
 
 def package_lambda(function_name: str, source_file: str):
     print(f"\n Packaging {function_name}...")
@@ -37,7 +42,11 @@ def package_lambda(function_name: str, source_file: str):
     # Install dependencies if requirements.txt exists
     if os.path.isfile("requirements.txt"):
         print("→ Installing dependencies...")
-        run(["pip", "install", "-r", "requirements.txt", "-t", temp_dir])
+        run([
+            sys.executable, "-m", "pip", "install", "-r", "requirements.txt", "-t", temp_dir,
+            "--platform", LAMBDA_PLATFORM, "--python-version", LAMBDA_PYTHON_VERSION,
+            "--implementation", "cp", "--only-binary=:all:"
+        ])
 
     # Create target dir if needed
     os.makedirs(LAMBDA_DIR, exist_ok=True)
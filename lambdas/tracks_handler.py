@@ -1,18 +1,82 @@
 import json
+import hashlib
 import boto3
 import uuid
 import os
-from datetime import datetime
+import base64
+import time
+from datetime import datetime, timezone, timedelta
 from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeDeserializer
+from concurrent.futures import ThreadPoolExecutor
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb')
 sns = boto3.client('sns')
+sqs = boto3.client('sqs')
+deserializer = TypeDeserializer()
 
 # Table references
 tracks_table = dynamodb.Table('package-tracking-tracks')
 packages_table = dynamodb.Table('package-tracking-packages')
 depots_table = dynamodb.Table('package-tracking-depots')
+package_codes_table = dynamodb.Table('package-tracking-package-codes')
+scan_batches_table = dynamodb.Table('package-tracking-scan-batches')
+idempotency_table = dynamodb.Table('package-tracking-idempotency')
+
+# Track history pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MIN_REMAINING_TIME_MS = 3000
+
+# Batch scan ingestion (POST /tracks/batch)
+MAX_BATCH_SCANS = 500
+BATCH_GET_SIZE = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+TRANSACTION_MAX_ITEMS = 100
+TRANSACTION_MAX_ATTEMPTS = 3
+TRANSACTION_WORKERS = 8
+SNS_BATCH_SIZE = 10
+
+# SNS event envelope, bumped on incompatible changes to an event's data
+EVENT_VERSION = 1
+
+# Queued scan ingestion (POST /tracks/batches)
+SCAN_QUEUE_URL = os.environ.get('SCAN_QUEUE_URL')
+MAX_QUEUED_SCANS = 5000
+SQS_BATCH_SIZE = 10
+SQS_SEND_MAX_ATTEMPTS = 3
+ENQUEUE_WORKERS = 8
+SCAN_BATCH_TTL_DAYS = 7
+
+# Idempotency-Key handling for POSTs retried by clients
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LOCK_SECONDS = 30
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Package state machine: state -> actions allowed from it
+TRANSITIONS = {
+    'CREATED': ['SEND_DEPOT', 'SEND_FINAL', 'CANCEL'],
+    'IN_TRANSIT': ['ARRIVED_DEPOT', 'ARRIVED_FINAL', 'CANCEL'],
+    'ON_HOLD': ['SEND_FINAL', 'SEND_DEPOT', 'CANCEL'],
+    'DELIVERED': [],
+    'CANCELLED': []
+}
+
+# action -> state the package ends up in
+ACTION_RESULTS = {
+    'SEND_DEPOT': 'IN_TRANSIT',
+    'ARRIVED_DEPOT': 'ON_HOLD',
+    'SEND_FINAL': 'IN_TRANSIT',
+    'ARRIVED_FINAL': 'DELIVERED',
+    'CANCEL': 'CANCELLED'
+}
+
+# action -> states it may be applied from, used as the write condition
+ACTION_SOURCE_STATES = {
+    action: sorted(state for state, actions in TRANSITIONS.items() if action in actions)
+    for action in ACTION_RESULTS
+}
 
 def convert_decimals_to_float(obj):
     """Convert Decimal objects to float for JSON serialization"""
@@ -26,7 +90,24 @@ def convert_decimals_to_float(obj):
     else:
         return obj
 
-def cors_response(status_code, body=None):
+def build_event(event_type, event_id, data):
+    """Versioned SNS event envelope, the same in every producer"""
+    return {
+        'event_id': event_id,
+        'event_type': event_type,
+        'event_version': EVENT_VERSION,
+        'occurred_at': datetime.utcnow().isoformat(),
+        'data': data
+    }
+
+def event_attributes(event):
+    """SNS message attributes of an event, matched by the queue subscription filter policies"""
+    return {
+        'event_type': {'DataType': 'String', 'StringValue': event['event_type']},
+        'event_version': {'DataType': 'Number', 'StringValue': str(event['event_version'])}
+    }
+
+def cors_response(status_code, body=None, headers=None):
     """
     Create a CORS-enabled response
     """
@@ -38,18 +119,117 @@ def cors_response(status_code, body=None):
         }
     }
 
+    if headers:
+        response['headers'].update(headers)
+
     if body is not None:
         body = convert_decimals_to_float(body)
         response['body'] = json.dumps(body)
 
     return response
 
+def get_header(event, name):
+    """Case-insensitive request header lookup"""
+    for header, value in (event.get('headers') or {}).items():
+        if header.lower() == name.lower():
+            return value
+    return None
+
+def replay_idempotent_response(record, request_hash):
+    """Answer a request whose Idempotency-Key is already taken"""
+    if record.get('request_hash') != request_hash:
+        return cors_response(422, {'error': 'Idempotency-Key was already used with a different request'})
+    if record.get('status') != 'COMPLETED':
+        return cors_response(409, {'error': 'A request with this Idempotency-Key is still in progress'}, {'Retry-After': '1'})
+
+    response = json.loads(record['response'])
+    response['headers']['Idempotent-Replayed'] = 'true'
+    response['headers']['Access-Control-Expose-Headers'] = 'Idempotent-Replayed'
+    return response
+
+def run_idempotent(event, user_id, scope, operation):
+    """
+    Run operation() at most once per Idempotency-Key header (per user and route).
+    The first response is stored in the idempotency table and replayed to
+    retries, which cost one get_item. Concurrent requests with the same key are
+    collapsed by a conditional put; the loser gets 409 until the first finishes.
+    5xx responses are not stored, so the client can retry them for real.
+    """
+    key = get_header(event, 'Idempotency-Key')
+    if key is None:
+        return operation()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return cors_response(400, {'error': f'Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'})
+
+    record_key = f"{user_id or 'anon'}#{scope}#{key}"
+    request_hash = hashlib.sha256((event.get('body') or '').encode('utf-8')).hexdigest()
+    now = int(time.time())
+
+    # Retries of a finished request: one read, no writes
+    record = idempotency_table.get_item(Key={'idempotency_key': record_key}).get('Item')
+    if record and record['expires_at'] > now and (record['status'] == 'COMPLETED' or record['locked_until'] > now):
+        return replay_idempotent_response(record, request_hash)
+
+    # Claim the key. Expired records (TTL deletion lags) and locks left by a
+    # crashed invocation can be taken over.
+    locked_until = now + IDEMPOTENCY_LOCK_SECONDS
+    try:
+        idempotency_table.put_item(
+            Item={
+                'idempotency_key': record_key,
+                'status': 'IN_PROGRESS',
+                'request_hash': request_hash,
+                'locked_until': locked_until,
+                'expires_at': now + IDEMPOTENCY_TTL_SECONDS
+            },
+            ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at < :now '
+                                'OR (#status = :in_progress AND locked_until < :now)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':now': now, ':in_progress': 'IN_PROGRESS'},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        record = {name: deserializer.deserialize(value) for name, value in e.response.get('Item', {}).items()}
+        return replay_idempotent_response(record, request_hash)
+
+    def release():
+        idempotency_table.delete_item(
+            Key={'idempotency_key': record_key},
+            ConditionExpression='locked_until = :locked_until',
+            ExpressionAttributeValues={':locked_until': locked_until}
+        )
+
+    try:
+        response = operation()
+    except Exception:
+        release()
+        raise
+
+    if response['statusCode'] >= 500:
+        release()
+    else:
+        idempotency_table.update_item(
+            Key={'idempotency_key': record_key},
+            UpdateExpression='SET #status = :completed, #response = :response REMOVE locked_until',
+            ExpressionAttributeNames={'#status': 'status', '#response': 'response'},
+            ExpressionAttributeValues={':completed': 'COMPLETED', ':response': json.dumps(response)}
+        )
+    return response
+
 def lambda_handler(event, context):
     """
-    Handle track-related API requests
-    Routes: GET /packages/{code}/tracks/, POST /packages/{code}/tracks/, GET /packages/{code}/tracks/latest/
+    Handle track-related API requests and the queued scans
+    Routes: GET /packages/{code}/tracks/, POST /packages/{code}/tracks/, GET /packages/{code}/tracks/latest/,
+    POST /tracks/batch, POST /tracks/batches, GET /tracks/batches/{batch_id}
     """
     
+    # Scan queue: apply queued scans. Errors are raised, not turned into a 500
+    # response, which SQS would take as the whole batch succeeding
+    if event.get('Records') and event['Records'][0].get('eventSource') == 'aws:sqs':
+        return handle_scan_queue_event(event)
+
     try:
         # Extract user information from Cognito JWT (if available)
         user_id = None
@@ -64,7 +244,16 @@ def lambda_handler(event, context):
         
         # Parse HTTP method and path
         http_method = event['httpMethod']
-        path_parameters = event.get('pathParameters', {})
+        path_parameters = event.get('pathParameters') or {}
+        
+        # Batch scans carry their own package codes
+        path = event.get('path', '').rstrip('/')
+        if http_method == 'POST' and path.endswith('/tracks/batch'):
+            return create_tracks_batch(json.loads(event['body']), user_id, user_role)
+        if http_method == 'POST' and path.endswith('/tracks/batches'):
+            return create_scan_batch(json.loads(event['body']), user_id, user_role)
+        if http_method == 'GET' and path_parameters.get('batch_id'):
+            return get_scan_batch(path_parameters['batch_id'], user_id, user_role)
         
         # Get package code from path
         package_code = path_parameters.get('code')
@@ -75,9 +264,13 @@ def lambda_handler(event, context):
         if http_method == 'GET' and 'latest' in event.get('path', ''):
             return get_latest_track(package_code, user_id, user_role)
         elif http_method == 'GET':
-            return get_tracks_list(package_code, user_id, user_role)
+            query_parameters = event.get('queryStringParameters') or {}
+            return get_tracks_list(package_code, query_parameters, user_id, user_role, context)
         elif http_method == 'POST':
-            return create_track(package_code, json.loads(event['body']), user_id, user_role)
+            return run_idempotent(
+                event, user_id, f'POST /packages/{package_code}/tracks',
+                lambda: create_track(package_code, json.loads(event['body']), user_id, user_role)
+            )
         else:
             return cors_response(405, {'error': 'Method not allowed'})
             
@@ -85,9 +278,121 @@ def lambda_handler(event, context):
         print(f"Error in tracks_handler: {str(e)}")
         return cors_response(500, {'error': 'Internal server error'})
 
-def get_tracks_list(package_code, user_id, user_role):
-    """Get complete track history for a package"""
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque continuation token"""
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on malformed tokens"""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(value, dict):
+        raise ValueError('Invalid cursor')
+    return value
+
+def parse_page_size(value):
+    """Validate the limit query parameter"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
     try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+def parse_timestamp(value, name):
+    """
+    Validate a since/until query parameter and normalize it to the format
+    tracks are stored with (naive UTC isoformat), so string order is time order
+    """
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat()
+
+def query_tracks_page(package_id, since, until, limit, cursor, context):
+    """
+    Read up to `limit` tracks of one package in timestamp order through
+    package-timestamp-index. since is exclusive and until inclusive, so a
+    client can poll with since=<timestamp of the last track it has>.
+    """
+    if cursor and (
+        not all(isinstance(value, str) for value in cursor.values())
+        or cursor.get('package_id') != package_id
+    ):
+        raise ValueError('Invalid cursor')
+
+    key_condition = 'package_id = :package_id'
+    expression_values = {':package_id': package_id}
+    if since and until:
+        # BETWEEN is inclusive on both ends, since is filtered below
+        key_condition += ' AND #timestamp BETWEEN :since AND :until'
+        expression_values[':since'] = since
+        expression_values[':until'] = until
+    elif since:
+        key_condition += ' AND #timestamp > :since'
+        expression_values[':since'] = since
+    elif until:
+        key_condition += ' AND #timestamp <= :until'
+        expression_values[':until'] = until
+
+    query_kwargs = {
+        'IndexName': 'package-timestamp-index',
+        'KeyConditionExpression': key_condition,
+        'ExpressionAttributeValues': expression_values,
+        'ScanIndexForward': True
+    }
+    if since or until:
+        query_kwargs['ExpressionAttributeNames'] = {'#timestamp': 'timestamp'}
+    if since and until:
+        query_kwargs['FilterExpression'] = '#timestamp <> :since'
+
+    tracks = []
+    last_key = cursor
+    while True:
+        query_kwargs['Limit'] = limit - len(tracks)
+        if last_key:
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+        response = tracks_table.query(**query_kwargs)
+        tracks.extend(response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+
+        if not last_key or len(tracks) >= limit:
+            break
+        # Hand back what we have instead of running into the Lambda timeout
+        if context and context.get_remaining_time_in_millis() < MIN_REMAINING_TIME_MS:
+            break
+
+    return tracks, last_key
+
+def get_tracks_list(package_code, query_params, user_id, user_role, context=None):
+    """
+    Get one page of the track history of a package, oldest first.
+    Query params: since (exclusive), until (inclusive), limit and cursor
+    (token from the previous page). The token for the next page is returned
+    in the X-Next-Cursor header.
+    """
+    try:
+        try:
+            limit = parse_page_size(query_params.get('limit'))
+            cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+            since = parse_timestamp(query_params['since'], 'since') if query_params.get('since') else None
+            until = parse_timestamp(query_params['until'], 'until') if query_params.get('until') else None
+            if since and until and since >= until:
+                raise ValueError('since must be earlier than until')
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+
         # First, get the package to verify access
         package = get_package_by_code(package_code, user_id, user_role)
         if package['statusCode'] != 200:
@@ -96,19 +401,21 @@ def get_tracks_list(package_code, user_id, user_role):
         package_data = json.loads(package['body'])
         package_id = package_data['package_id']
         
-        # Get all tracks for this package
-        response = tracks_table.query(
-            IndexName='package-index',
-            KeyConditionExpression='package_id = :package_id',
-            ExpressionAttributeValues={':package_id': package_id}
-        )
-        
-        tracks = response['Items']
-        
-        # Sort by timestamp
-        tracks.sort(key=lambda x: x['timestamp'])
-        
-        return cors_response(200, tracks)
+        try:
+            try:
+                tracks, next_cursor = query_tracks_page(package_id, since, until, limit, cursor, context)
+            except ClientError as e:
+                if cursor and e.response['Error']['Code'] == 'ValidationException':
+                    raise ValueError('Invalid cursor')
+                raise
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+
+        headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+        if next_cursor:
+            headers['X-Next-Cursor'] = encode_cursor(next_cursor)
+
+        return cors_response(200, tracks, headers)
         
     except Exception as e:
         print(f"Error getting tracks list: {str(e)}")
@@ -125,22 +432,24 @@ def get_latest_track(package_code, user_id, user_role):
         package_data = json.loads(package['body'])
         package_id = package_data['package_id']
         
-        # Get all tracks for this package
+        # The package carries a snapshot of its latest track, written with every track
+        latest_track = package_data.get('latest_track')
+        if latest_track:
+            return cors_response(200, latest_track)
+        
+        # Packages created before the snapshot existed: newest track from the sorted index
         response = tracks_table.query(
-            IndexName='package-index',
+            IndexName='package-timestamp-index',
             KeyConditionExpression='package_id = :package_id',
-            ExpressionAttributeValues={':package_id': package_id}
+            ExpressionAttributeValues={':package_id': package_id},
+            ScanIndexForward=False,
+            Limit=1
         )
         
-        tracks = response['Items']
-        
-        if not tracks:
+        if not response['Items']:
             return cors_response(404, {'error': 'No tracks found for this package'})
         
-        # Get the latest track
-        latest_track = max(tracks, key=lambda x: x['timestamp'])
-        
-        return cors_response(200, latest_track)
+        return cors_response(200, response['Items'][0])
         
     except Exception as e:
         print(f"Error getting latest track: {str(e)}")
@@ -180,23 +489,15 @@ def create_track(package_code, track_data, user_id, user_role):
             'timestamp': datetime.utcnow().isoformat()
         }
         
-        # Save track to DynamoDB
-        tracks_table.put_item(Item=track_item)
-        
-        # Update package state
+        # Save track and move the package in one transaction, conditioned on the
+        # package still being in a state the action can be applied from
         new_state = get_new_state(current_state, action)
-        packages_table.update_item(
-            Key={'package_id': package_id},
-            UpdateExpression='SET #state = :state, updated_at = :updated_at',
-            ExpressionAttributeNames={'#state': 'state'},
-            ExpressionAttributeValues={
-                ':state': new_state,
-                ':updated_at': datetime.utcnow().isoformat()
-            }
-        )
+        can_transition, message = apply_transition(package_id, track_item, new_state)
+        if not can_transition:
+            return cors_response(400, {'error': message})
         
         # Publish to SNS for notifications
-        sns_message = {
+        sns_event = build_event('package_track_updated', f'track:{track_id}', {
             'package_id': package_id,
             'code': package_code,
             'track_id': track_id,
@@ -204,12 +505,13 @@ def create_track(package_code, track_data, user_id, user_role):
             'new_state': new_state,
             'user_id': user_id,
             'timestamp': datetime.utcnow().isoformat()
-        }
+        })
         
         sns.publish(
             TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(sns_message),
-            Subject='Package Track Updated'
+            Message=json.dumps(sns_event),
+            Subject='Package Track Updated',
+            MessageAttributes=event_attributes(sns_event)
         )
         
         return cors_response(201, track_item)
@@ -218,6 +520,612 @@ def create_track(package_code, track_data, user_id, user_role):
         print(f"Error creating track: {str(e)}")
         return cors_response(500, {'error': 'Failed to create track'})
 
+def batch_get_items(table, keys):
+    """
+    Read items by primary key with BatchGetItem, BATCH_GET_SIZE keys per call,
+    retrying UnprocessedKeys with exponential backoff. Missing items are omitted.
+    """
+    items = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {table.name: {'Keys': keys[start:start + BATCH_GET_SIZE]}}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(table.name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+        else:
+            raise Exception(f"Unprocessed keys reading {table.name}")
+    return items
+
+def resolve_packages(package_codes):
+    """
+    Map package codes to package items with two batched reads: the code
+    registry (code -> package_id) and then the packages themselves.
+    Codes missing from the registry (packages older than it) fall back to code-index.
+    """
+    codes = sorted(set(package_codes))
+    registry = batch_get_items(package_codes_table, [{'code': code} for code in codes])
+    package_ids = {item['code']: item['package_id'] for item in registry}
+
+    packages = batch_get_items(packages_table, [{'package_id': package_id} for package_id in set(package_ids.values())])
+    packages_by_id = {package['package_id']: package for package in packages}
+    resolved = {code: packages_by_id[package_id] for code, package_id in package_ids.items() if package_id in packages_by_id}
+
+    for code in codes:
+        if code not in package_ids:
+            response = packages_table.query(
+                IndexName='code-index',
+                KeyConditionExpression='code = :code',
+                ExpressionAttributeValues={':code': code}
+            )
+            if response['Items']:
+                resolved[code] = response['Items'][0]
+    return resolved
+
+def plan_package_tracks(package, events, base_time, track_ids=None):
+    """
+    Run the scans of one package, already in timestamp order, through the state
+    machine starting from its current state.
+    Returns (accepted [(index, track_item)], final state, rejected [(index, message)]).
+    Track timestamps are spaced by a microsecond so the history keeps the scan order.
+    track_ids optionally fixes the track_id of a scan by index (queued scans).
+    """
+    state = package['state']
+    accepted = []
+    rejected = []
+    for index, event in events:
+        can_transition, message = can_transition_to(state, event['action'])
+        if not can_transition:
+            rejected.append((index, message))
+            continue
+        if len(accepted) == TRANSACTION_MAX_ITEMS - 1:
+            rejected.append((index, 'Too many scans for one package in a batch'))
+            continue
+
+        track_item = {
+            'track_id': (track_ids or {}).get(index) or str(uuid.uuid4()),
+            'package_id': package['package_id'],
+            'action': event['action'],
+            'depot_id': event.get('depot_id'),
+            'comment': event.get('comment', ''),
+            'timestamp': (base_time + timedelta(microseconds=len(accepted))).isoformat()
+        }
+        if event.get('scanned_at'):
+            track_item['scanned_at'] = event['scanned_at']
+        accepted.append((index, track_item))
+        state = get_new_state(state, event['action'])
+
+    return accepted, state, rejected
+
+def build_package_transaction_items(package, tracks, new_state):
+    """Track puts plus the package update for one package, conditioned on the state the plan started from"""
+    items = [
+        {
+            'Put': {
+                'TableName': tracks_table.name,
+                'Item': track_item,
+                'ConditionExpression': 'attribute_not_exists(track_id)'
+            }
+        }
+        for _, track_item in tracks
+    ]
+    items.append({
+        'Update': {
+            'TableName': packages_table.name,
+            'Key': {'package_id': package['package_id']},
+            'UpdateExpression': 'SET #state = :state, latest_track = :track, updated_at = :updated_at',
+            'ConditionExpression': '#state = :expected_state',
+            'ExpressionAttributeNames': {'#state': 'state'},
+            'ExpressionAttributeValues': {
+                ':state': new_state,
+                ':track': tracks[-1][1],
+                ':updated_at': datetime.utcnow().isoformat(),
+                ':expected_state': package['state']
+            },
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+        }
+    })
+    return items
+
+def write_package_group(group):
+    """
+    Apply the planned tracks of several packages with one TransactWriteItems.
+    group: [(package_id, transaction items)].
+    Returns ({package_id: refreshed package or None}, {package_id: error}) for the packages that
+    must be planned again (state changed underneath / cancelled by another package) or that failed.
+    """
+    transact_items = []
+    owners = []
+    for package_id, items in group:
+        transact_items.extend(items)
+        owners.extend([package_id] * len(items))
+
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+        return {}, {}
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            print(f"Error writing scan batch: {str(e)}")
+            return {}, {package_id: 'Failed to save track' for package_id, _ in group}
+
+        retry = {package_id: None for package_id, _ in group}
+        reasons = e.response.get('CancellationReasons', [])
+        for package_id, reason, item in zip(owners, reasons, transact_items):
+            if 'Update' in item and reason.get('Code') == 'ConditionalCheckFailed':
+                old_item = reason.get('Item')
+                # Plan again from the state the package is really in
+                retry[package_id] = {key: deserializer.deserialize(value) for key, value in old_item.items()} if old_item else False
+        errors = {package_id: 'Package not found' for package_id, package in retry.items() if package is False}
+        return {package_id: package for package_id, package in retry.items() if package is not False}, errors
+
+def publish_batch(messages, subject):
+    """
+    Publish (entry_id, event) pairs with SNS PublishBatch, 10 per call.
+    Returns the ids of the entries that were not published.
+    """
+    failed_ids = []
+    for start in range(0, len(messages), SNS_BATCH_SIZE):
+        chunk = messages[start:start + SNS_BATCH_SIZE]
+        try:
+            response = sns.publish_batch(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                PublishBatchRequestEntries=[
+                    {
+                        'Id': entry_id,
+                        'Message': json.dumps(event),
+                        'Subject': subject,
+                        'MessageAttributes': event_attributes(event)
+                    }
+                    for entry_id, event in chunk
+                ]
+            )
+            failed_ids.extend(entry['Id'] for entry in response.get('Failed', []))
+        except Exception as e:
+            print(f"Error publishing SNS batch: {str(e)}")
+            failed_ids.extend(entry_id for entry_id, _ in chunk)
+    return failed_ids
+
+def validate_scan(scan):
+    """Return an error message for an invalid scan event, None if it is valid"""
+    if not isinstance(scan, dict):
+        return 'Scan must be an object'
+    if not isinstance(scan.get('code'), str) or not scan['code']:
+        return 'Package code is required'
+    if 'action' not in scan:
+        return 'Action is required'
+    if scan.get('scanned_at'):
+        try:
+            scan['scanned_at'] = parse_timestamp(scan['scanned_at'], 'scanned_at')
+        except (ValueError, TypeError):
+            return 'scanned_at must be an ISO 8601 timestamp'
+    return None
+
+def apply_scans(scans, user_id, user_role, track_ids=None):
+    """
+    Apply depot scans and return one result per scan, by index.
+    Codes are resolved with batched reads, scans are grouped by package and run
+    through the state machine in scanned_at order (request order for ties), and
+    each package's tracks and state change are written together, several packages
+    per transaction. One notification is published per package with all its tracks.
+    Results of scans that could not be saved are marked retryable.
+    """
+    results = [None] * len(scans)
+    valid_indexes = []
+    for index, scan in enumerate(scans):
+        error = validate_scan(scan)
+        if error:
+            results[index] = {'index': index, 'status': 'failed', 'error': error}
+        else:
+            valid_indexes.append(index)
+
+    packages_by_code = resolve_packages([scans[index]['code'] for index in valid_indexes])
+
+    # Group by package, in scan order
+    events_by_package = {}
+    packages = {}
+    for index in valid_indexes:
+        scan = scans[index]
+        package = packages_by_code.get(scan['code'])
+        if not package:
+            results[index] = {'index': index, 'code': scan['code'], 'status': 'failed', 'error': 'Package not found'}
+            continue
+        if user_role != 'anon' and user_role != 'admin' and package['sender_id'] != user_id:
+            results[index] = {'index': index, 'code': scan['code'], 'status': 'failed', 'error': 'Access denied'}
+            continue
+        packages[package['package_id']] = package
+        events_by_package.setdefault(package['package_id'], []).append((index, scan))
+
+    # Scans without scanned_at count as scanned on arrival
+    received_at = datetime.utcnow().isoformat()
+    for events in events_by_package.values():
+        events.sort(key=lambda event: (event[1].get('scanned_at') or received_at, event[0]))
+
+    applied = {}
+    pending = dict(packages)
+    for attempt in range(TRANSACTION_MAX_ATTEMPTS):
+        if not pending:
+            break
+
+        base_time = datetime.utcnow()
+        plans = {}
+        groups = [[]]
+        group_sizes = [0]
+        for package_id, package in pending.items():
+            tracks, new_state, rejected = plan_package_tracks(package, events_by_package[package_id], base_time, track_ids)
+            plans[package_id] = (package, tracks, new_state, rejected)
+            if not tracks:
+                continue
+
+            items = build_package_transaction_items(package, tracks, new_state)
+            if group_sizes[-1] + len(items) > TRANSACTION_MAX_ITEMS:
+                groups.append([])
+                group_sizes.append(0)
+            groups[-1].append((package_id, items))
+            group_sizes[-1] += len(items)
+
+        retry = {}
+        errors = {}
+        groups = [group for group in groups if group]
+        if groups:
+            with ThreadPoolExecutor(max_workers=min(len(groups), TRANSACTION_WORKERS)) as executor:
+                for group_retry, group_errors in executor.map(write_package_group, groups):
+                    retry.update(group_retry)
+                    errors.update(group_errors)
+
+        for package_id, (package, tracks, new_state, rejected) in plans.items():
+            if package_id in retry:
+                continue
+            if package_id in errors:
+                rejected = rejected + [(index, errors[package_id]) for index, _ in tracks]
+                tracks = []
+            applied[package_id] = (package, tracks, new_state, rejected)
+
+        pending = {
+            package_id: refreshed or packages[package_id]
+            for package_id, refreshed in retry.items()
+        }
+
+    for package_id in pending:
+        for index, _ in events_by_package[package_id]:
+            results[index] = {
+                'index': index,
+                'code': packages[package_id]['code'],
+                'status': 'failed',
+                'error': 'Failed to save track',
+                'retryable': True
+            }
+
+    messages = []
+    timestamp = datetime.utcnow().isoformat()
+    for package_id, (package, tracks, new_state, rejected) in applied.items():
+        for index, message in rejected:
+            results[index] = {'index': index, 'code': package['code'], 'status': 'failed', 'error': message}
+            if message == 'Failed to save track':
+                results[index]['retryable'] = True
+        for index, track_item in tracks:
+            results[index] = {'index': index, 'code': package['code'], 'status': 'applied', 'track': track_item}
+        if not tracks:
+            continue
+
+        # One notification per package with every track it got in this batch,
+        # identified by its last track like a single track event
+        messages.append((package_id, build_event('package_track_updated', f"track:{tracks[-1][1]['track_id']}", {
+            'package_id': package_id,
+            'code': package['code'],
+            'track_id': tracks[-1][1]['track_id'],
+            'action': tracks[-1][1]['action'],
+            'new_state': new_state,
+            'track_ids': [track_item['track_id'] for _, track_item in tracks],
+            'actions': [track_item['action'] for _, track_item in tracks],
+            'user_id': user_id,
+            'timestamp': timestamp
+        })))
+
+    for package_id in publish_batch(messages, 'Package Track Updated'):
+        print(f"Failed to publish track update for package {package_id}")
+
+    return results
+
+def create_tracks_batch(batch_data, user_id, user_role):
+    """
+    Ingest many depot scans in one request (see apply_scans).
+    Body: {"scans": [{"code", "action", "depot_id", "comment", "scanned_at"}, ...]}.
+    The response lists the outcome of each scan by its index in the request.
+    """
+    try:
+        scans = batch_data.get('scans') if isinstance(batch_data, dict) else None
+        if not isinstance(scans, list) or not scans:
+            return cors_response(400, {'error': 'scans must be a non-empty list'})
+        if len(scans) > MAX_BATCH_SCANS:
+            return cors_response(400, {'error': f'At most {MAX_BATCH_SCANS} scans per batch'})
+
+        results = apply_scans(scans, user_id, user_role)
+
+        applied_count = sum(1 for result in results if result['status'] == 'applied')
+        return cors_response(201 if applied_count == len(results) else 207, {
+            'applied': applied_count,
+            'failed': len(results) - applied_count,
+            'results': results
+        })
+
+    except Exception as e:
+        print(f"Error creating tracks batch: {str(e)}")
+        return cors_response(500, {'error': 'Failed to create tracks'})
+
+def scan_track_id(batch_id, index):
+    """Track id of a queued scan; fixed so a redelivered message cannot add the track twice"""
+    return str(uuid.uuid5(uuid.UUID(batch_id), str(index)))
+
+def send_scan_messages(messages):
+    """
+    Send up to SQS_BATCH_SIZE (index, body) messages with one SendMessageBatch,
+    retrying failed entries. Returns the indexes that could not be sent.
+    """
+    pending = {str(index): body for index, body in messages}
+    for attempt in range(SQS_SEND_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(min(1.0, 0.05 * 2 ** attempt))
+        try:
+            response = sqs.send_message_batch(
+                QueueUrl=SCAN_QUEUE_URL,
+                Entries=[
+                    {
+                        'Id': entry_id,
+                        'MessageBody': json.dumps(body),
+                        # FIFO queue: one ordered group per package, deduplicated per scan
+                        'MessageGroupId': body['scan']['code'],
+                        'MessageDeduplicationId': f"{body['batch_id']}-{body['index']}"
+                    }
+                    for entry_id, body in pending.items()
+                ]
+            )
+        except ClientError as e:
+            print(f"SendMessageBatch failed: {str(e)}")
+            continue
+
+        pending = {entry['Id']: pending[entry['Id']] for entry in response.get('Failed', [])}
+        if not pending:
+            return []
+
+    return [int(entry_id) for entry_id in pending]
+
+def enqueue_scans(batch_id, scans, user_id, user_role):
+    """
+    Queue one message per scan, SendMessageBatch calls in parallel; returns the
+    indexes not queued. Each package code is its own FIFO message group, so the
+    scans of a package are applied in the order they were queued.
+    """
+    messages = [
+        (index, {'batch_id': batch_id, 'index': index, 'scan': scan, 'user_id': user_id, 'user_role': user_role})
+        for index, scan in scans
+    ]
+    # Parallel lanes with every package code always in the same lane, so the
+    # messages of one package are sent one call after another, in request order
+    lanes = {}
+    for message in messages:
+        lanes.setdefault(hash(message[1]['scan']['code']) % ENQUEUE_WORKERS, []).append(message)
+    if not lanes:
+        return []
+
+    def send_lane(lane):
+        failed = []
+        for start in range(0, len(lane), SQS_BATCH_SIZE):
+            failed.extend(send_scan_messages(lane[start:start + SQS_BATCH_SIZE]))
+        return failed
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(lanes)) as executor:
+        for lane_failed in executor.map(send_lane, lanes.values()):
+            failed.extend(lane_failed)
+    return failed
+
+def record_scan_results(batch_id, applied, errors):
+    """Add processed scans to the progress counters of a scan batch"""
+    scan_batches_table.update_item(
+        Key={'batch_id': batch_id},
+        UpdateExpression='ADD applied :applied, failed :failed '
+                         'SET errors = list_append(if_not_exists(errors, :empty), :errors), updated_at = :updated_at',
+        ExpressionAttributeValues={
+            ':applied': applied,
+            ':failed': len(errors),
+            ':errors': errors,
+            ':empty': [],
+            ':updated_at': datetime.utcnow().isoformat()
+        }
+    )
+
+def create_scan_batch(batch_data, user_id, user_role):
+    """
+    Queue depot scans for asynchronous ingestion.
+    Body: same as POST /tracks/batch, up to MAX_QUEUED_SCANS scans.
+    Scans are checked for required fields, queued one message each on the scan
+    queue and applied by handle_scan_queue_event. Answers 202 with the batch id;
+    progress is served by GET /tracks/batches/{batch_id}.
+    """
+    try:
+        scans = batch_data.get('scans') if isinstance(batch_data, dict) else None
+        if not isinstance(scans, list) or not scans:
+            return cors_response(400, {'error': 'scans must be a non-empty list'})
+        if len(scans) > MAX_QUEUED_SCANS:
+            return cors_response(400, {'error': f'At most {MAX_QUEUED_SCANS} scans per batch'})
+
+        batch_id = str(uuid.uuid4())
+        valid_scans = []
+        errors = []
+        for index, scan in enumerate(scans):
+            error = validate_scan(scan)
+            if error:
+                errors.append({'index': index, 'error': error})
+            else:
+                valid_scans.append((index, scan))
+
+        # The batch must exist before its first scan can be processed
+        now = datetime.utcnow()
+        scan_batches_table.put_item(Item={
+            'batch_id': batch_id,
+            'user_id': user_id,
+            'total': len(scans),
+            'applied': 0,
+            'failed': len(errors),
+            'errors': errors,
+            'created_at': now.isoformat(),
+            'updated_at': now.isoformat(),
+            'expires_at': int((now + timedelta(days=SCAN_BATCH_TTL_DAYS)).replace(tzinfo=timezone.utc).timestamp())
+        })
+
+        not_queued = enqueue_scans(batch_id, valid_scans, user_id, user_role)
+        if not_queued:
+            record_scan_results(batch_id, 0, [
+                {'index': index, 'error': 'Failed to queue scan'} for index in sorted(not_queued)
+            ])
+
+        status_url = f'/tracks/batches/{batch_id}'
+        return cors_response(202, {
+            'batch_id': batch_id,
+            'queued': len(valid_scans) - len(not_queued),
+            'rejected': len(errors) + len(not_queued),
+            'status_url': status_url
+        }, {'Location': status_url, 'Access-Control-Expose-Headers': 'Location'})
+
+    except Exception as e:
+        print(f"Error queuing scan batch: {str(e)}")
+        return cors_response(500, {'error': 'Failed to queue scans'})
+
+def get_scan_batch(batch_id, user_id, user_role):
+    """Progress of a queued scan batch: counters, failed scans and overall status"""
+    try:
+        response = scan_batches_table.get_item(Key={'batch_id': batch_id})
+        batch = response.get('Item')
+        if not batch:
+            return cors_response(404, {'error': 'Batch not found'})
+        if user_role != 'admin' and batch.get('user_id') != user_id:
+            return cors_response(403, {'error': 'Access denied'})
+
+        for counter in ('total', 'applied', 'failed'):
+            batch[counter] = int(batch[counter])
+        processed = batch['applied'] + batch['failed']
+        if processed >= batch['total']:
+            batch['status'] = 'completed'
+        elif processed:
+            batch['status'] = 'processing'
+        else:
+            batch['status'] = 'queued'
+        batch['errors'] = sorted(
+            ({**error, 'index': int(error['index'])} for error in batch.get('errors', [])),
+            key=lambda error: error['index']
+        )
+        batch.pop('expires_at', None)
+
+        return cors_response(200, batch)
+
+    except Exception as e:
+        print(f"Error getting scan batch: {str(e)}")
+        return cors_response(500, {'error': 'Failed to retrieve batch'})
+
+def handle_scan_queue_event(event):
+    """
+    Apply queued scans. Messages whose scan could not be saved, or whose batch
+    progress could not be updated, are reported in batchItemFailures so only
+    they are redelivered. Scans already applied by an earlier delivery are
+    recognized by their track id and only counted, since that delivery did not
+    get to update the batch progress.
+    """
+    batch_item_failures = []
+    entries = []
+    track_ids = set()
+    for record in event['Records']:
+        try:
+            message = json.loads(record['body'])
+            track_id = scan_track_id(message['batch_id'], message['index'])
+            if not isinstance(message['scan'], dict):
+                raise ValueError('scan must be an object')
+        except Exception as e:
+            # Redelivering a malformed message would not fix it
+            print(f"Dropping malformed scan message {record.get('messageId')}: {str(e)}")
+            continue
+        # Never apply the same scan twice in one delivery
+        if track_id not in track_ids:
+            track_ids.add(track_id)
+            entries.append((record['messageId'], message, track_id))
+
+    try:
+        existing = batch_get_items(tracks_table, [{'track_id': track_id} for track_id in track_ids])
+    except Exception as e:
+        print(f"Error checking queued scans: {str(e)}")
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id, _, _ in entries]}
+    existing_ids = {item['track_id'] for item in existing}
+
+    # The scan queue is FIFO with one message group per package code. Once a
+    # scan of a package fails, its later scans in this batch are returned too,
+    # so they are redelivered after it and the package's scans stay in order
+    progress = {}
+    blocked_codes = set()
+
+    def fail(message_id, message):
+        batch_item_failures.append({'itemIdentifier': message_id})
+        blocked_codes.add(message['scan'].get('code'))
+
+    # apply_scans checks access for one user at a time; consecutive runs of the
+    # same user keep the delivery order between users
+    runs = []
+    for entry in entries:
+        user = (entry[1].get('user_id'), entry[1].get('user_role'))
+        if not runs or runs[-1][0] != user:
+            runs.append((user, []))
+        runs[-1][1].append(entry)
+
+    for (user_id, user_role), run in runs:
+        group = []
+        for entry in run:
+            message_id, message, track_id = entry
+            if message['scan'].get('code') in blocked_codes:
+                fail(message_id, message)
+            elif track_id in existing_ids:
+                batch_progress = progress.setdefault(message['batch_id'], [0, [], []])
+                batch_progress[0] += 1
+                batch_progress[2].append(message_id)
+            else:
+                group.append(entry)
+        if not group:
+            continue
+
+        try:
+            results = apply_scans(
+                [message['scan'] for _, message, _ in group],
+                user_id,
+                user_role,
+                {position: track_id for position, (_, _, track_id) in enumerate(group)}
+            )
+        except Exception as e:
+            print(f"Error applying queued scans: {str(e)}")
+            for message_id, message, _ in group:
+                fail(message_id, message)
+            continue
+
+        for (message_id, message, _), result in zip(group, results):
+            if result.get('retryable') or message['scan'].get('code') in blocked_codes:
+                fail(message_id, message)
+                continue
+
+            batch_progress = progress.setdefault(message['batch_id'], [0, [], []])
+            if result['status'] == 'applied':
+                batch_progress[0] += 1
+            else:
+                batch_progress[1].append({'index': message['index'], 'code': result.get('code'), 'error': result['error']})
+            batch_progress[2].append(message_id)
+
+    for batch_id, (applied, errors, message_ids) in progress.items():
+        try:
+            record_scan_results(batch_id, applied, errors)
+        except Exception as e:
+            print(f"Error updating scan batch {batch_id}: {str(e)}")
+            batch_item_failures.extend({'itemIdentifier': message_id} for message_id in message_ids)
+
+    return {'batchItemFailures': batch_item_failures}
+
 def get_package_by_code(package_code, user_id, user_role):
     """Get package by code with access control"""
     try:
@@ -243,20 +1151,67 @@ def get_package_by_code(package_code, user_id, user_role):
         print(f"Error getting package by code: {str(e)}")
         return cors_response(500, {'error': 'Failed to retrieve package'})
 
+def apply_transition(package_id, track_item, new_state):
+    """
+    Insert the track and update the package state and its latest_track snapshot
+    with one TransactWriteItems. The package update only succeeds if its current state allows the action,
+    so concurrent scans cannot both move a package out of the same state.
+    Returns (success, error message).
+    """
+    action = track_item['action']
+    source_states = ACTION_SOURCE_STATES[action]
+    expression_values = {
+        ':state': new_state,
+        ':track': track_item,
+        ':updated_at': datetime.utcnow().isoformat()
+    }
+    for index, state in enumerate(source_states):
+        expression_values[f':from{index}'] = state
+    source_placeholders = ', '.join(f':from{index}' for index in range(len(source_states)))
+
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=[
+            {
+                'Put': {
+                    'TableName': tracks_table.name,
+                    'Item': track_item,
+                    'ConditionExpression': 'attribute_not_exists(track_id)'
+                }
+            },
+            {
+                'Update': {
+                    'TableName': packages_table.name,
+                    'Key': {'package_id': package_id},
+                    'UpdateExpression': 'SET #state = :state, latest_track = :track, updated_at = :updated_at',
+                    'ConditionExpression': f'#state IN ({source_placeholders})',
+                    'ExpressionAttributeNames': {'#state': 'state'},
+                    'ExpressionAttributeValues': expression_values,
+                    'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                }
+            }
+        ])
+        return True, "Valid transition"
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+
+        reasons = e.response.get('CancellationReasons', [])
+        if len(reasons) < 2 or reasons[1].get('Code') != 'ConditionalCheckFailed':
+            raise
+
+        # Report the same message a pre-check against the real state would give
+        package = reasons[1].get('Item')
+        if not package:
+            return False, "Package not found"
+        current_state = deserializer.deserialize(package['state']) if 'state' in package else None
+        return can_transition_to(current_state, action)
+
 def can_transition_to(current_state, action):
     """Validate if state transition is allowed"""
-    transitions = {
-        'CREATED': ['SEND_DEPOT', 'SEND_FINAL', 'CANCEL'],
-        'IN_TRANSIT': ['ARRIVED_DEPOT', 'ARRIVED_FINAL', 'CANCEL'],
-        'ON_HOLD': ['SEND_FINAL', 'SEND_DEPOT', 'CANCEL'],
-        'DELIVERED': [],
-        'CANCELLED': []
-    }
-    
-    if current_state not in transitions:
+    if current_state not in TRANSITIONS:
         return False, "Invalid current state"
     
-    if action not in transitions[current_state]:
+    if action not in TRANSITIONS[current_state]:
         if current_state == 'DELIVERED':
             return False, "The package has already been delivered"
         elif current_state == 'CANCELLED':
@@ -268,12 +1223,4 @@ def can_transition_to(current_state, action):
 
 def get_new_state(current_state, action):
     """Get new state based on action"""
-    state_mapping = {
-        'SEND_DEPOT': 'IN_TRANSIT',
-        'ARRIVED_DEPOT': 'ON_HOLD',
-        'SEND_FINAL': 'IN_TRANSIT',
-        'ARRIVED_FINAL': 'DELIVERED',
-        'CANCEL': 'CANCELLED'
-    }
-    
-    return state_mapping.get(action, current_state)
+    return ACTION_RESULTS.get(action, current_state)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Fill latest_track on packages created before the snapshot existed, so
+GET /packages/{code}/tracks/latest can be served from the package item.
+Run once from the project root after deploying package-timestamp-index.
+"""
+
+import boto3
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource('dynamodb')
+packages_table = dynamodb.Table('package-tracking-packages')
+tracks_table = dynamodb.Table('package-tracking-tracks')
+
+def scan_packages_without_snapshot():
+    """Yield package_id of every package missing latest_track, following LastEvaluatedKey"""
+    scan_kwargs = {
+        'ProjectionExpression': 'package_id',
+        'FilterExpression': 'attribute_not_exists(latest_track)'
+    }
+    while True:
+        response = packages_table.scan(**scan_kwargs)
+        for item in response['Items']:
+            yield item['package_id']
+
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_latest_track(package_id):
+    """Newest track of a package from the timestamp-sorted index"""
+    response = tracks_table.query(
+        IndexName='package-timestamp-index',
+        KeyConditionExpression='package_id = :package_id',
+        ExpressionAttributeValues={':package_id': package_id},
+        ScanIndexForward=False,
+        Limit=1
+    )
+    return response['Items'][0] if response['Items'] else None
+
+def main():
+    updated = 0
+    skipped = 0
+
+    for package_id in scan_packages_without_snapshot():
+        latest_track = get_latest_track(package_id)
+        if not latest_track:
+            skipped += 1
+            continue
+
+        try:
+            # Never overwrite a snapshot written by a new track in the meantime
+            packages_table.update_item(
+                Key={'package_id': package_id},
+                UpdateExpression='SET latest_track = :track',
+                ConditionExpression='attribute_exists(package_id) AND attribute_not_exists(latest_track)',
+                ExpressionAttributeValues={':track': latest_track}
+            )
+            updated += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            skipped += 1
+
+    print(f"latest_track set on {updated} packages, {skipped} skipped")
+
+if __name__ == "__main__":
+    main()
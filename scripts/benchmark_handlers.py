@@ -0,0 +1,901 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Lambda handlers against a local DynamoDB stand-in
+(DynamoDB Local, moto_server, ...) and, for scan_queue, a local SQS.
+Run from the project root:
+
+    python scripts/benchmark_handlers.py create_package --endpoint-url http://localhost:8000
+    python scripts/benchmark_handlers.py scan_ingest --iterations 5
+    python scripts/benchmark_handlers.py scan_queue --sqs-endpoint-url http://localhost:9324
+    python scripts/benchmark_handlers.py multipart_upload --upload-sizes 1 3 6
+    python scripts/benchmark_handlers.py image_variants --resolutions 1600x1200 4032x3024
+    python scripts/benchmark_handlers.py image_listing --images 10 100
+    python scripts/benchmark_handlers.py s3_uploads --uploads 1 10 50
+
+Each simulated container loads its own copy of the handler module, so module
+level state (clients, caches, leased blocks) behaves like separate Lambdas.
+SNS publishes are counted but never sent. Needs botocore >= 1.31 for
+AWS_ENDPOINT_URL_DYNAMODB / AWS_ENDPOINT_URL_SQS.
+"""
+
+import argparse
+import base64
+import importlib.util
+import io
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from email import message_from_string
+from pathlib import Path
+
+import boto3
+from botocore.exceptions import ClientError
+
+LAMBDAS_DIR = Path(__file__).resolve().parent.parent / 'lambdas'
+
+# Same key schema as envs/dev/database.tf
+TABLES = {
+    'package-tracking-packages': {
+        'keys': [('package_id', 'HASH')],
+        'attributes': {'package_id': 'S', 'code': 'S', 'sender_id': 'S', 'state': 'S'},
+        'indexes': {'code-index': ('code',), 'sender-index': ('sender_id',), 'state-index': ('state',)}
+    },
+    'package-tracking-tracks': {
+        'keys': [('track_id', 'HASH')],
+        'attributes': {'track_id': 'S', 'package_id': 'S', 'timestamp': 'S'},
+        'indexes': {'package-index': ('package_id',), 'package-timestamp-index': ('package_id', 'timestamp')}
+    },
+    'package-tracking-package-codes': {
+        'keys': [('code', 'HASH')],
+        'attributes': {'code': 'S'},
+        'indexes': {}
+    },
+    'package-tracking-scan-batches': {
+        'keys': [('batch_id', 'HASH')],
+        'attributes': {'batch_id': 'S'},
+        'indexes': {}
+    },
+    'package-tracking-idempotency': {
+        'keys': [('idempotency_key', 'HASH')],
+        'attributes': {'idempotency_key': 'S'},
+        'indexes': {}
+    },
+    'package-tracking-processed-events': {
+        'keys': [('event_id', 'HASH')],
+        'attributes': {'event_id': 'S'},
+        'indexes': {}
+    },
+    'package-tracking-images': {
+        'keys': [('image_id', 'HASH')],
+        'attributes': {'image_id': 'S', 'package_id': 'S'},
+        'indexes': {'package-index': ('package_id',)}
+    },
+    'package-tracking-websocket-connections': {
+        'keys': [('connection_id', 'HASH')],
+        'attributes': {'connection_id': 'S', 'user_id': 'S'},
+        'indexes': {'user-id-index': ('user_id',)}
+    },
+    'package-tracking-websocket-subscriptions': {
+        'keys': [('package_code', 'HASH'), ('connection_id', 'RANGE')],
+        'attributes': {'package_code': 'S', 'connection_id': 'S'},
+        'indexes': {}
+    }
+}
+
+
+class CallCounter:
+    """Thread-safe counter for AWS API calls"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + amount
+
+    def total(self):
+        return sum(self.calls.values())
+
+class NullPublisher:
+    """Stand-in for the SNS client that only counts publishes"""
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def publish(self, **kwargs):
+        self.counter.add('Publish')
+        return {'MessageId': 'local'}
+
+    def publish_batch(self, **kwargs):
+        self.counter.add('PublishBatch')
+        entries = kwargs.get('PublishBatchRequestEntries', [])
+        return {'Successful': [{'Id': entry['Id']} for entry in entries], 'Failed': []}
+
+def setup_environment(endpoint_url, sqs_endpoint_url):
+    os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = endpoint_url
+    os.environ['AWS_ENDPOINT_URL_SQS'] = sqs_endpoint_url
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:benchmark')
+    os.environ.setdefault('S3_BUCKET_NAME', 'benchmark')
+
+def reset_tables(names):
+    """Drop and recreate the given tables in the local stand-in"""
+    dynamodb = boto3.resource('dynamodb')
+    existing = set(dynamodb.meta.client.list_tables()['TableNames'])
+
+    for name in names:
+        if name in existing:
+            dynamodb.Table(name).delete()
+            dynamodb.meta.client.get_waiter('table_not_exists').wait(TableName=name)
+
+        definition = TABLES[name]
+        create_kwargs = {
+            'TableName': name,
+            'BillingMode': 'PAY_PER_REQUEST',
+            'KeySchema': [{'AttributeName': attr, 'KeyType': key_type} for attr, key_type in definition['keys']],
+            'AttributeDefinitions': [
+                {'AttributeName': attr, 'AttributeType': attr_type}
+                for attr, attr_type in definition['attributes'].items()
+            ]
+        }
+        if definition['indexes']:
+            create_kwargs['GlobalSecondaryIndexes'] = [
+                {
+                    'IndexName': index_name,
+                    'KeySchema': [
+                        {'AttributeName': attr, 'KeyType': key_type}
+                        for attr, key_type in zip(index_keys, ('HASH', 'RANGE'))
+                    ],
+                    'Projection': {'ProjectionType': 'ALL'}
+                }
+                for index_name, index_keys in definition['indexes'].items()
+            ]
+        dynamodb.create_table(**create_kwargs)
+        dynamodb.meta.client.get_waiter('table_exists').wait(TableName=name)
+
+def load_handler(module_name, counter):
+    """Load a fresh copy of a handler module, i.e. one simulated container"""
+    spec = importlib.util.spec_from_file_location(module_name, LAMBDAS_DIR / f'{module_name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    def count_call(model, **kwargs):
+        counter.add(model.name)
+
+    module.dynamodb.meta.client.meta.events.register('before-call.dynamodb', count_call)
+    if hasattr(module, 'sqs'):
+        module.sqs.meta.events.register('before-call.sqs', count_call)
+    module.sns = NullPublisher(counter)
+    return module
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def print_row(label, latencies, counter, units):
+    print(
+        f"{label:>14} | p50 {percentile(latencies, 50) * 1000:8.2f} ms"
+        f" | p99 {percentile(latencies, 99) * 1000:8.2f} ms"
+        f" | mean {statistics.mean(latencies) * 1000:8.2f} ms"
+        f" | calls/{units[:-1]} {counter.total() / len(latencies):6.2f}"
+        f" {dict(sorted(counter.calls.items()))}"
+    )
+
+def bench_create_package(args):
+    """Package creation latency and AWS calls per package at several concurrency levels"""
+    print("create_package")
+    for creators in args.concurrency:
+        reset_tables(['package-tracking-packages', 'package-tracking-tracks', 'package-tracking-package-codes'])
+        counter = CallCounter()
+        handlers = [load_handler('packages_handler', counter) for _ in range(creators)]
+        counter.calls.clear()
+
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def creator(index):
+            handler = handlers[index]
+            for n in range(args.iterations):
+                package_data = {
+                    'origin': 'Depot A',
+                    'destination': 'Depot B',
+                    'receiver_name': f'Receiver {index}-{n}',
+                    'receiver_email': f'receiver{index}-{n}@example.com',
+                    'weight': 1.5
+                }
+                start = time.perf_counter()
+                response = handler.create_package(package_data, f'user-{index}', f'user{index}@example.com')
+                elapsed = time.perf_counter() - start
+                if response['statusCode'] != 201:
+                    print(f"create_package failed: {response.get('body')}")
+                with latencies_lock:
+                    latencies.append(elapsed)
+
+        with ThreadPoolExecutor(max_workers=creators) as executor:
+            list(executor.map(creator, range(creators)))
+
+        print_row(f'{creators} creators', latencies, counter, 'packages')
+
+def create_benchmark_packages(count):
+    """Create `count` packages through POST /packages/batch and return their codes"""
+    handler = load_handler('packages_handler', CallCounter())
+    codes = []
+    while len(codes) < count:
+        size = min(handler.MAX_BATCH_PACKAGES, count - len(codes))
+        response = handler.create_packages_batch({'packages': [
+            {
+                'origin': 'Depot A',
+                'destination': 'Depot B',
+                'receiver_name': f'Receiver {len(codes) + n}',
+                'receiver_email': f'receiver{len(codes) + n}@example.com'
+            }
+            for n in range(size)
+        ]}, 'depot-user', 'depot@example.com')
+        codes.extend(result['package']['code'] for result in json.loads(response['body'])['results'])
+    return codes
+
+def bench_scan_ingest(args):
+    """
+    Depot scan throughput per Lambda invocation: one POST /packages/{code}/tracks/
+    per scan against POST /tracks/batch with several batch sizes.
+    Every scan moves a different package out of CREATED.
+    """
+    def ingest_single(handler, scans):
+        response = handler.create_track(scans[0]['code'], scans[0], 'depot-user', 'admin')
+        return response['statusCode'] == 201, response
+
+    def ingest_batch(handler, scans):
+        response = handler.create_tracks_batch({'scans': scans}, 'depot-user', 'admin')
+        return response['statusCode'] == 201, response
+
+    runs = [('single', 1, ingest_single)] + [(f'batch {size}', size, ingest_batch) for size in args.batch_sizes]
+
+    print("scan_ingest")
+    for label, batch_size, ingest in runs:
+        reset_tables(['package-tracking-packages', 'package-tracking-tracks', 'package-tracking-package-codes'])
+        codes = create_benchmark_packages(batch_size * args.iterations)
+        counter = CallCounter()
+        handler = load_handler('tracks_handler', counter)
+        counter.calls.clear()
+
+        latencies = []
+        for n in range(args.iterations):
+            scans = [
+                {'code': code, 'action': 'SEND_DEPOT', 'depot_id': 'depot-1'}
+                for code in codes[n * batch_size:(n + 1) * batch_size]
+            ]
+            start = time.perf_counter()
+            ok, response = ingest(handler, scans)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                print(f"scan ingestion failed: {response.get('body')}")
+
+        p50 = percentile(latencies, 50)
+        print(
+            f"{label:>14} | invocation p50 {p50 * 1000:8.2f} ms"
+            f" | p99 {percentile(latencies, 99) * 1000:8.2f} ms"
+            f" | scans/s per invocation {batch_size / p50:9.1f}"
+            f" | calls/scan {counter.total() / (batch_size * args.iterations):6.2f}"
+            f" {dict(sorted(counter.calls.items()))}"
+        )
+
+def create_scan_queue():
+    """
+    Create a fresh local FIFO scan queue, like envs/dev/events.tf, and point the handlers at it.
+    A new name per run, since SQS only allows one purge a minute.
+    """
+    sqs = boto3.client('sqs')
+    queue_url = sqs.create_queue(
+        QueueName=f'benchmark-scan-queue-{int(time.time() * 1000)}.fifo',
+        Attributes={'FifoQueue': 'true'}
+    )['QueueUrl']
+    os.environ['SCAN_QUEUE_URL'] = queue_url
+    return sqs, queue_url
+
+def receive_scan_event(sqs, queue_url, size):
+    """Receive up to `size` messages as the SQS event the Lambda event source mapping would deliver"""
+    records = []
+    while len(records) < size:
+        response = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, size - len(records)),
+            VisibilityTimeout=1,
+            WaitTimeSeconds=0
+        )
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        records.extend(
+            {
+                'messageId': message['MessageId'],
+                'receiptHandle': message['ReceiptHandle'],
+                'body': message['Body'],
+                'eventSource': 'aws:sqs'
+            }
+            for message in messages
+        )
+    return {'Records': records}
+
+def bench_scan_queue(args):
+    """
+    Queued scan ingestion against a local SQS stand-in (ElasticMQ, moto_server, ...):
+    latency of the 202 from POST /tracks/batches, then the queue is drained in
+    10 message events the way the FIFO event source mapping would, honouring
+    batchItemFailures, until GET /tracks/batches/{batch_id} reports completion.
+    """
+    print("scan_queue")
+    for batch_size in args.batch_sizes:
+        reset_tables([
+            'package-tracking-packages', 'package-tracking-tracks',
+            'package-tracking-package-codes', 'package-tracking-scan-batches'
+        ])
+        sqs, queue_url = create_scan_queue()
+        codes = create_benchmark_packages(batch_size)
+        scans = [{'code': code, 'action': 'SEND_DEPOT', 'depot_id': 'depot-1'} for code in codes]
+
+        enqueue_counter = CallCounter()
+        producer = load_handler('tracks_handler', enqueue_counter)
+        enqueue_counter.calls.clear()
+        start = time.perf_counter()
+        response = producer.create_scan_batch({'scans': scans}, 'depot-user', 'admin')
+        enqueue_elapsed = time.perf_counter() - start
+        if response['statusCode'] != 202:
+            print(f"queuing scans failed: {response.get('body')}")
+            sqs.delete_queue(QueueUrl=queue_url)
+            continue
+        batch_id = json.loads(response['body'])['batch_id']
+
+        drain_counter = CallCounter()
+        consumer = load_handler('tracks_handler', drain_counter)
+        drain_counter.calls.clear()
+        invocations = []
+        status = None
+        deadline = time.time() + 300
+        while time.time() < deadline:
+            event = receive_scan_event(sqs, queue_url, 10)
+            if not event['Records']:
+                status = json.loads(producer.get_scan_batch(batch_id, 'depot-user', 'admin')['body'])
+                if status['status'] == 'completed':
+                    break
+                time.sleep(1)
+                continue
+
+            start = time.perf_counter()
+            result = consumer.lambda_handler(event, None)
+            invocations.append((time.perf_counter() - start, len(event['Records'])))
+
+            # Failed messages are left to reappear after the visibility timeout
+            failed = {failure['itemIdentifier'] for failure in result['batchItemFailures']}
+            done = [record for record in event['Records'] if record['messageId'] not in failed]
+            for start_index in range(0, len(done), 10):
+                sqs.delete_message_batch(QueueUrl=queue_url, Entries=[
+                    {'Id': str(n), 'ReceiptHandle': record['receiptHandle']}
+                    for n, record in enumerate(done[start_index:start_index + 10])
+                ])
+
+        sqs.delete_queue(QueueUrl=queue_url)
+
+        drain_time = sum(elapsed for elapsed, _ in invocations)
+        processed = sum(count for _, count in invocations)
+        print(
+            f"{f'{batch_size} scans':>14} | 202 in {enqueue_elapsed * 1000:8.2f} ms"
+            f" ({batch_size / enqueue_elapsed:8.1f} scans/s accepted, {enqueue_counter.total()} calls)"
+            f" | drained in {len(invocations)} invocations, {processed / drain_time if drain_time else 0:7.1f} scans/s"
+            f" | consumer calls/scan {drain_counter.total() / batch_size:5.2f}"
+            f" | status {status and status['status']} applied {status and status['applied']} failed {status and status['failed']}"
+        )
+
+def bench_idempotent_retry(args):
+    """
+    POST /packages/ through lambda_handler with an Idempotency-Key: the first
+    request, sequential retries of it, and a storm of concurrent duplicates.
+    Reports AWS calls per request and how many packages each key produced.
+    """
+    def package_event(key, n):
+        return {
+            'httpMethod': 'POST',
+            'path': '/packages',
+            'pathParameters': None,
+            'headers': {'Idempotency-Key': key},
+            'body': json.dumps({
+                'origin': 'Depot A',
+                'destination': 'Depot B',
+                'receiver_name': f'Receiver {n}',
+                'receiver_email': f'receiver{n}@example.com'
+            }),
+            'requestContext': {'authorizer': {'claims': {'sub': 'user-1', 'email': 'user1@example.com'}}}
+        }
+
+    print("idempotent_retry")
+    reset_tables(['package-tracking-packages', 'package-tracking-tracks',
+                  'package-tracking-package-codes', 'package-tracking-idempotency'])
+    counter = CallCounter()
+    handler = load_handler('packages_handler', counter)
+    packages_table = boto3.resource('dynamodb').Table('package-tracking-packages')
+
+    for label, phase in (('first', 'first'), ('retry', 'retry')):
+        counter.calls.clear()
+        latencies = []
+        for n in range(args.iterations):
+            start = time.perf_counter()
+            response = handler.lambda_handler(package_event(f'key-{n}', n), None)
+            latencies.append(time.perf_counter() - start)
+            if response['statusCode'] != 201:
+                print(f"{phase} request failed: {response.get('body')}")
+        print_row(label, latencies, counter, 'requests')
+
+    for duplicates in args.concurrency:
+        counter.calls.clear()
+        handlers = [load_handler('packages_handler', counter) for _ in range(duplicates)]
+        counter.calls.clear()
+        key = f'storm-{duplicates}'
+        before = packages_table.scan(Select='COUNT')['Count']
+
+        latencies = []
+        statuses = []
+        lock = threading.Lock()
+
+        def send(index):
+            start = time.perf_counter()
+            response = handlers[index].lambda_handler(package_event(key, 0), None)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response['statusCode'])
+
+        with ThreadPoolExecutor(max_workers=duplicates) as executor:
+            list(executor.map(send, range(duplicates)))
+
+        created = packages_table.scan(Select='COUNT')['Count'] - before
+        print_row(f'{duplicates} concurrent', latencies, counter, 'requests')
+        print(f"{'':>14}   statuses {dict(sorted((code, statuses.count(code)) for code in set(statuses)))}, packages created {created}")
+
+def item_size(item):
+    """Approximate DynamoDB item size in bytes (attribute names plus values)"""
+    size = 0
+    for name, value in item.items():
+        size += len(name.encode('utf-8'))
+        if isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        else:
+            size += len(str(value).lstrip('-').replace('.', '')) // 2 + 1
+    return size
+
+def read_units(pages, size):
+    """Eventually consistent read units for pages of ScannedCount items of `size` bytes, rounded per page"""
+    return sum(math.ceil(scanned * size / 4096) * 0.5 for scanned in pages)
+
+def seed_connections(connections, subscribers_per_package):
+    """
+    Fill the connections and subscriptions tables with `connections` open
+    connections, each watching one package shared by `subscribers_per_package`.
+    Returns (sample connection item, sample subscription item).
+    """
+    dynamodb = boto3.resource('dynamodb')
+    now = int(time.time())
+    connection = subscription = None
+    with dynamodb.Table('package-tracking-websocket-connections').batch_writer() as connections_batch, \
+            dynamodb.Table('package-tracking-websocket-subscriptions').batch_writer() as subscriptions_batch:
+        for n in range(connections):
+            package_code = str(10000000 + n // subscribers_per_package)
+            connection = {
+                'connection_id': f'conn-{n:07d}',
+                'user_id': f'user-{n % 1000}',
+                'connected_at': '2025-01-01T00:00:00.000000+00:00',
+                'ttl': now + 3600,
+                'package_codes': {package_code}
+            }
+            subscription = {
+                'package_code': package_code,
+                'connection_id': connection['connection_id'],
+                'user_id': connection['user_id'],
+                'ttl': connection['ttl']
+            }
+            connections_batch.put_item(Item=connection)
+            subscriptions_batch.put_item(Item=subscription)
+    return connection, subscription
+
+def bench_broadcast_reads(args):
+    """
+    Read cost of finding one package's subscribers: the old paginated Scan with
+    a package code filter over every connection against the Query on the
+    subscriptions table that broadcast_to_subscribers now runs.
+    Read units come from ReturnConsumedCapacity when the stand-in reports real
+    numbers (DynamoDB Local does, moto reports a flat 0.5 per call), and are
+    also estimated from ScannedCount and item size, rounded up per page.
+    """
+    print("broadcast_reads")
+    for connections in args.connections:
+        reset_tables(['package-tracking-websocket-connections', 'package-tracking-websocket-subscriptions'])
+        connection, subscription = seed_connections(connections, args.subscribers)
+        package_code = '10000000'
+
+        # Before: scan every connection, filter on its subscribed package codes
+        client = boto3.client('dynamodb')
+        scan_kwargs = {
+            'TableName': 'package-tracking-websocket-connections',
+            'FilterExpression': 'contains(package_codes, :package_code)',
+            'ExpressionAttributeValues': {':package_code': {'S': package_code}},
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        scan_pages = []
+        scan_reported = 0
+        found = 0
+        start = time.perf_counter()
+        while True:
+            response = client.scan(**scan_kwargs)
+            scan_pages.append(response['ScannedCount'])
+            scan_reported += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+            found += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        scan_elapsed = time.perf_counter() - start
+
+        # After: broadcast_to_subscribers, with pushes stubbed out
+        counter = CallCounter()
+        handler = load_handler('notifications_handler', counter)
+        query_pages = []
+        query_reported = []
+        events = handler.dynamodb.meta.client.meta.events
+
+        def request_capacity(params, **kwargs):
+            params['ReturnConsumedCapacity'] = 'TOTAL'
+
+        def record_page(parsed, **kwargs):
+            query_pages.append(parsed.get('ScannedCount', 0))
+            query_reported.append(parsed.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+
+        events.register('provide-client-params.dynamodb.Query', request_capacity)
+        events.register('after-call.dynamodb.Query', record_page)
+        pushed = []
+        handler.send_websocket_message = lambda connection_id, message: pushed.append(connection_id) or True
+
+        start = time.perf_counter()
+        handler.broadcast_to_subscribers(package_code, {'action': 'package_track_updated'})
+        query_elapsed = time.perf_counter() - start
+
+        print(
+            f"{f'{connections} conns':>14} | scan: {len(scan_pages):4d} pages, {sum(scan_pages):7d} items read,"
+            f" {read_units(scan_pages, item_size(connection)):8.1f} RCU est, {scan_reported:8.1f} reported,"
+            f" {scan_elapsed * 1000:9.1f} ms, {found} found"
+            f" | query: {len(query_pages)} pages, {sum(query_pages)} items read,"
+            f" {read_units(query_pages, item_size(subscription)):4.1f} RCU est, {sum(query_reported):4.1f} reported,"
+            f" {query_elapsed * 1000:6.1f} ms, {len(pushed)} pushed"
+        )
+
+class FakeManagementApi:
+    """Stand-in for the API Gateway management client: fixed latency per push, some connections gone"""
+
+    def __init__(self, latency_s, gone_ids):
+        self.latency_s = latency_s
+        self.gone_ids = gone_ids
+
+    def post_to_connection(self, ConnectionId, Data):
+        time.sleep(self.latency_s)
+        if ConnectionId in self.gone_ids:
+            raise ClientError({'Error': {'Code': 'GoneException', 'Message': 'Gone'}}, 'PostToConnection')
+        return {}
+
+def bench_websocket_fanout(args):
+    """
+    broadcast_to_subscribers for one package with many watchers: serial pushes
+    (one worker, as before) against the pooled fan-out. post_to_connection is
+    simulated with --push-latency-ms; one in ten connections is gone.
+    """
+    os.environ['WEBSOCKET_API_ENDPOINT'] = 'https://localhost/api'
+    print("websocket_fanout")
+    for watchers in args.connections:
+        for workers in (1, None):
+            reset_tables(['package-tracking-websocket-connections', 'package-tracking-websocket-subscriptions'])
+            seed_connections(watchers, watchers)
+            gone_ids = {f'conn-{n:07d}' for n in range(0, watchers, 10)}
+
+            counter = CallCounter()
+            handler = load_handler('notifications_handler', counter)
+            if workers:
+                handler.WEBSOCKET_PUSH_WORKERS = workers
+            handler.apigatewaymanagementapi = FakeManagementApi(args.push_latency_ms / 1000, gone_ids)
+            counter.calls.clear()
+
+            start = time.perf_counter()
+            counts = handler.broadcast_to_subscribers('10000000', {'action': 'package_track_updated'})
+            elapsed = time.perf_counter() - start
+
+            remaining = boto3.resource('dynamodb').Table('package-tracking-websocket-subscriptions').scan(Select='COUNT')['Count']
+            label = f'{watchers} x {handler.WEBSOCKET_PUSH_WORKERS} workers'
+            print(
+                f"{label:>22} | {elapsed * 1000:9.1f} ms | {counts}"
+                f" | subscriptions left {remaining} | dynamodb calls {dict(sorted(counter.calls.items()))}"
+            )
+
+class DrainingS3:
+    """Stand-in for the S3 client that reads file bodies in chunks, as botocore sends them"""
+
+    def put_object(self, Body, **kwargs):
+        if hasattr(Body, 'read'):
+            while Body.read(1024 * 1024):
+                pass
+        return {}
+
+def legacy_multipart_upload(handler, s3, body, content_type):
+    """The multipart path of upload_image before parse_multipart, kept for comparison"""
+    raw_body = base64.b64decode(body).decode('utf-8')
+    msg = message_from_string(f"Content-Type: {content_type}\r\n\r\n" + raw_body)
+    file_data = None
+    for part in msg.walk():
+        if part.get_content_disposition() == 'form-data' and part.get_param('filename', header='content-disposition'):
+            file_data = base64.b64encode(part.get_payload(decode=True)).decode('utf-8')
+    s3.put_object(Bucket='benchmark', Key='legacy', Body=base64.b64decode(file_data), ContentType='image/jpeg')
+
+def multipart_upload(handler, s3, body, content_type):
+    """The multipart path of upload_image now: bytes parser and a memoryview reader"""
+    fields, files = handler.parse_multipart(base64.b64decode(body), content_type)
+    _, file_content_type, view = files['image']
+    s3.put_object(Bucket='benchmark', Key='current', Body=handler.MemoryviewReader(view), ContentType=file_content_type)
+
+def multipart_body(payload):
+    """API Gateway style (base64) multipart body with a purpose field and one image, and its Content-Type"""
+    boundary = 'benchmarkboundary7MA4YWxkTrZu0gW'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\nCREATION\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="photo.jpg"\r\n'
+        'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + payload + f'\r\n--{boundary}--\r\n'.encode()
+    return base64.b64encode(body).decode(), f'multipart/form-data; boundary={boundary}'
+
+def bench_multipart_upload(args):
+    """
+    Peak memory (tracemalloc, on top of the event body) and time from the
+    API Gateway body to the S3 upload, old multipart path against the current
+    one. The old path decodes the body as UTF-8, so payloads are ASCII here;
+    real binary images are rejected by it (shown on the last line).
+    """
+    print("multipart_upload")
+    handler = load_handler('images_handler', CallCounter())
+    s3 = DrainingS3()
+    for size_mb in args.upload_sizes:
+        payload = base64.b64encode(os.urandom(size_mb * 1024 * 1024))[:size_mb * 1024 * 1024]
+        body, content_type = multipart_body(payload)
+        row = [f'{size_mb} MB']
+        for upload in (legacy_multipart_upload, multipart_upload):
+            timings = []
+            for _ in range(min(args.iterations, 5)):
+                start = time.perf_counter()
+                upload(handler, s3, body, content_type)
+                timings.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            upload(handler, s3, body, content_type)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            row.append(f'{upload.__name__} {peak / 1024 / 1024:6.1f} MB peak {statistics.median(timings) * 1000:7.1f} ms')
+        print(' | '.join(row))
+
+    body, content_type = multipart_body(os.urandom(1024 * 1024))
+    try:
+        legacy_multipart_upload(handler, s3, body, content_type)
+        print("binary 1 MB | legacy_multipart_upload accepted")
+    except UnicodeDecodeError as e:
+        print(f"binary 1 MB | legacy_multipart_upload rejected: {e.reason}")
+    multipart_upload(handler, s3, body, content_type)
+    print("binary 1 MB | multipart_upload accepted")
+
+class MemoryS3:
+    """Stand-in for the S3 client that keeps objects in memory"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+        return {}
+
+def photo_bytes(handler, width, height, image_format):
+    """Gradient with noise at the given resolution, the noise keeps it from compressing better than a photo"""
+    Image = handler.Image
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=90)
+    return buffer.getvalue()
+
+def bench_image_variants(args):
+    """
+    Time for generate_image_variants to write every variant of one upload
+    (p50 of --iterations, capped at 5), and for a redelivered S3 event for
+    the same image, which finds the variants recorded and does nothing.
+    """
+    reset_tables(['package-tracking-images'])
+    handler = load_handler('images_handler', CallCounter())
+    handler.s3 = MemoryS3()
+    print(f"image_variants ({', '.join(f'{size} {px}px' for size, px in handler.IMAGE_VARIANTS.items())}, {handler.variant_format()[0]})")
+    images_table = boto3.resource('dynamodb').Table('package-tracking-images')
+
+    for resolution in args.resolutions:
+        width, height = (int(value) for value in resolution.split('x'))
+        for image_format, extension in (('JPEG', 'jpg'), ('PNG', 'png')):
+            original_key = f'packages/benchmark/{resolution}.{extension}'
+            handler.s3.objects[original_key] = photo_bytes(handler, width, height, image_format)
+            image_item = {'image_id': f'{resolution}-{extension}', 'package_id': 'benchmark', 's3_key': original_key}
+
+            timings = []
+            for _ in range(min(args.iterations, 5)):
+                images_table.put_item(Item=image_item)
+                start = time.perf_counter()
+                handler.generate_image_variants('benchmark', image_item, len(handler.s3.objects[original_key]))
+                timings.append(time.perf_counter() - start)
+
+            stored = images_table.get_item(Key={'image_id': image_item['image_id']})['Item']
+            redelivered = []
+            for _ in range(min(args.iterations, 5)):
+                start = time.perf_counter()
+                handler.generate_image_variants('benchmark', stored, len(handler.s3.objects[original_key]))
+                redelivered.append(time.perf_counter() - start)
+
+            sizes = ' '.join(
+                f"{size} {len(handler.s3.objects[variant['s3_key']]) / 1024:.0f} KB"
+                for size, variant in sorted(stored.get('variants', {}).items())
+            ) or 'no variants (over the source limits)'
+            print(
+                f"{resolution:>10} {extension} | original {len(handler.s3.objects[original_key]) / 1024:6.0f} KB | {sizes}"
+                f" | first {statistics.median(timings) * 1000:7.1f} ms | redelivered {statistics.median(redelivered) * 1000:5.2f} ms"
+            )
+
+def bench_image_listing(args):
+    """
+    GET /packages/{code}/images/ for a package with N images, signing every
+    URL on each request (cache size 0) against the presigned URL cache, and
+    whether a listing a second later returns the same URLs.
+    """
+    print("image_listing")
+    reset_tables(['package-tracking-packages', 'package-tracking-images'])
+    boto3.resource('dynamodb').Table('package-tracking-packages').put_item(
+        Item={'package_id': 'benchmark', 'code': 'BENCH', 'sender_id': 'benchmark-user'}
+    )
+    images_table = boto3.resource('dynamodb').Table('package-tracking-images')
+
+    listed = 0
+    for count in args.images:
+        with images_table.batch_writer() as batch:
+            for index in range(listed, count):
+                batch.put_item(Item={
+                    'image_id': f'image-{index}',
+                    'package_id': 'benchmark',
+                    's3_key': f'packages/benchmark/image-{index}.jpg'
+                })
+        listed = max(listed, count)
+
+        for label, cache_size in (('no cache', 0), ('cached', 5000)):
+            counter = CallCounter()
+            handler = load_handler('images_handler', counter)
+            handler.PRESIGNED_URL_CACHE_SIZE = cache_size
+            signed = 0
+            original_sign = handler.s3.generate_presigned_url
+
+            def count_signing(*sign_args, **sign_kwargs):
+                nonlocal signed
+                signed += 1
+                return original_sign(*sign_args, **sign_kwargs)
+            handler.s3.generate_presigned_url = count_signing
+
+            latencies = []
+            responses = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                responses.append(handler.get_package_images('BENCH', 'benchmark-user', 'user', {'size': 'thumb'})['body'])
+                latencies.append(time.perf_counter() - start)
+
+            print_row(f'{listed} {label}', latencies, counter, 'listings')
+
+            # Signatures carry a timestamp in seconds, so compare across a second boundary
+            time.sleep(1.1)
+            later = handler.get_package_images('BENCH', 'benchmark-user', 'user', {'size': 'thumb'})['body']
+            print(f"{'':>14} | signed {signed} URLs | same URLs a second later: {later == responses[0]}")
+
+def legacy_s3_upload(handler, record):
+    """handle_s3_event before handle_s3_records, for one record, kept for comparison"""
+    _, s3_key, package_id, image_id = handler.parse_s3_record(record)
+    handler.package_images_table.update_item(
+        Key={'image_id': image_id},
+        UpdateExpression='SET #status = :status, uploaded_at = :uploaded_at',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':status': 'UPLOADED', ':uploaded_at': '2024-01-01T00:00:00'}
+    )
+    image_item = handler.package_images_table.get_item(Key={'image_id': image_id})['Item']
+    package = handler.packages_table.get_item(Key={'package_id': package_id})['Item']
+    sns_event = handler.build_event('image_uploaded', f'image_uploaded:{image_id}', {
+        'package_id': package_id, 'code': package.get('code'), 'image_id': image_id,
+        's3_key': s3_key, 'purpose': image_item['purpose']
+    })
+    handler.sns.publish(TopicArn='benchmark', Message=json.dumps(sns_event), Subject='Package Image Uploaded')
+
+def bench_s3_uploads(args):
+    """
+    One S3 notification carrying N uploads: the old handler (first record
+    only, looped here over every record) against handle_s3_records.
+    Variants are turned off to time the bookkeeping alone.
+    """
+    print("s3_uploads")
+    reset_tables(['package-tracking-packages', 'package-tracking-images'])
+    packages_table = boto3.resource('dynamodb').Table('package-tracking-packages')
+    images_table = boto3.resource('dynamodb').Table('package-tracking-images')
+
+    for count in args.uploads:
+        records = []
+        with images_table.batch_writer() as batch:
+            for index in range(count):
+                package_id = f'benchmark-{index % 10}'
+                image_id = f'upload-{count}-{index}'
+                s3_key = f'packages/{package_id}/{image_id}.jpg'
+                batch.put_item(Item={'image_id': image_id, 'package_id': package_id, 'purpose': 'DELIVERY', 's3_key': s3_key})
+                records.append({
+                    'eventSource': 'aws:s3',
+                    'eventName': 'ObjectCreated:Put',
+                    's3': {'bucket': {'name': 'benchmark'}, 'object': {'key': s3_key}}
+                })
+        for index in range(min(count, 10)):
+            packages_table.put_item(Item={'package_id': f'benchmark-{index}', 'code': f'BENCH{index}', 'sender_id': 'benchmark-user'})
+
+        for label, process in (
+            ('per record', lambda handler: [legacy_s3_upload(handler, record) for record in records]),
+            ('batched', lambda handler: handler.handle_s3_records(records, None))
+        ):
+            counter = CallCounter()
+            handler = load_handler('images_handler', counter)
+            handler.IMAGE_VARIANTS = {}
+            latencies = []
+            for _ in range(min(args.iterations, 5)):
+                start = time.perf_counter()
+                process(handler)
+                latencies.append(time.perf_counter() - start)
+            print_row(f'{count} {label}', latencies, counter, 'events')
+
+SCENARIOS = {
+    'create_package': bench_create_package,
+    'scan_ingest': bench_scan_ingest,
+    'scan_queue': bench_scan_queue,
+    'idempotent_retry': bench_idempotent_retry,
+    'broadcast_reads': bench_broadcast_reads,
+    'websocket_fanout': bench_websocket_fanout,
+    'multipart_upload': bench_multipart_upload,
+    'image_variants': bench_image_variants,
+    'image_listing': bench_image_listing,
+    's3_uploads': bench_s3_uploads
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Lambda handlers against local AWS stand-ins')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--endpoint-url', default='http://localhost:8000', help='Local DynamoDB endpoint')
+    parser.add_argument('--sqs-endpoint-url', default='http://localhost:9324', help='Local SQS endpoint (scan_queue)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--iterations', type=int, default=20, help='Operations per simulated container')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1000, 10000, 100000], help='Open WebSocket connections (broadcast_reads)')
+    parser.add_argument('--push-latency-ms', type=float, default=20, help='Simulated post_to_connection latency (websocket_fanout)')
+    parser.add_argument('--subscribers', type=int, default=10, help='Connections watching each package (broadcast_reads)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[50, 200, 500], help='Scans per batch request (scan_ingest)')
+    parser.add_argument('--upload-sizes', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6], help='Image sizes in MB (multipart_upload)')
+    parser.add_argument('--uploads', type=int, nargs='+', default=[1, 10, 50], help='Uploads per S3 notification (s3_uploads)')
+    parser.add_argument('--images', type=int, nargs='+', default=[10, 100], help='Images per package (image_listing)')
+    parser.add_argument('--resolutions', nargs='+', default=['1600x1200', '4032x3024', '6000x4000'], help='Original image sizes, WIDTHxHEIGHT (image_variants)')
+    args = parser.parse_args()
+
+    setup_environment(args.endpoint_url, args.sqs_endpoint_url)
+    SCENARIOS[args.scenario](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
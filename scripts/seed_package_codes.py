@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Register existing package codes in package-tracking-package-codes and move the
+code counter past the highest code already issued.
+Run once from the project root after deploying the package codes table.
+"""
+
+import boto3
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Must match packages_handler.py
+PACKAGE_CODE_BASE = 10000000
+PACKAGE_CODE_COUNTER_KEY = 'COUNTER'
+
+dynamodb = boto3.resource('dynamodb')
+packages_table = dynamodb.Table('package-tracking-packages')
+package_codes_table = dynamodb.Table('package-tracking-package-codes')
+
+def scan_packages():
+    """Yield (package_id, code) for every package, following LastEvaluatedKey"""
+    scan_kwargs = {'ProjectionExpression': 'package_id, code'}
+    while True:
+        response = packages_table.scan(**scan_kwargs)
+        for item in response['Items']:
+            yield item['package_id'], item['code']
+
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def main():
+    max_value = -1
+    registered = 0
+
+    with package_codes_table.batch_writer(overwrite_by_pkeys=['code']) as batch:
+        for package_id, code in scan_packages():
+            batch.put_item(Item={
+                'code': code,
+                'package_id': package_id,
+                'created_at': datetime.utcnow().isoformat()
+            })
+            registered += 1
+
+            if code.isdigit():
+                max_value = max(max_value, int(code) - PACKAGE_CODE_BASE)
+
+    print(f"Registered {registered} existing package codes")
+
+    next_value = max_value + 1
+    try:
+        # Only ever move the counter forward
+        package_codes_table.update_item(
+            Key={'code': PACKAGE_CODE_COUNTER_KEY},
+            UpdateExpression='SET next_value = :next_value',
+            ConditionExpression='attribute_not_exists(next_value) OR next_value < :next_value',
+            ExpressionAttributeValues={':next_value': next_value}
+        )
+        print(f"Code counter set to {next_value} (next code {str(PACKAGE_CODE_BASE + next_value).zfill(8)})")
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        print("Code counter is already past the existing codes, left unchanged")
+
+if __name__ == "__main__":
+    main()